@@ -0,0 +1,246 @@
+"""ASGI entry point of the backend.
+
+Image generation and book summarization are awaited on dedicated executors,
+so they neither block the event loop nor hold a request thread while the
+models run. All other routes run the Flask app of server.py through the
+WSGI adapter of a2wsgi on a pool of request threads.
+"""
+
+import argparse
+import asyncio
+import json
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from a2wsgi import WSGIMiddleware
+from werkzeug.exceptions import BadRequest
+from werkzeug.formparser import FormDataParser
+from werkzeug.http import parse_options_header
+
+import server
+
+# Request bodies larger than this are buffered on disk.
+BODY_SPOOL_SIZE = 1024 * 1024
+
+flask_app = WSGIMiddleware(server.app, workers=server.app.config.get("ASGI_REQUEST_WORKERS", 16))
+# The request threads of the adapter also prepare the requests of the model routes.
+request_executor = flask_app.executor
+image_executor = ThreadPoolExecutor(
+    max_workers=server.app.config.get("ASGI_IMAGE_WORKERS", 1), thread_name_prefix="image"
+)
+# The summarization model itself runs on the scheduler thread, these
+# threads only wait for the chunks of the books being summarized.
+summarization_executor = ThreadPoolExecutor(
+    max_workers=server.app.config.get("ASGI_SUMMARIZATION_WORKERS", 4),
+    thread_name_prefix="summarization",
+)
+
+
+class ClientDisconnected(Exception):
+    """The client disconnected before the request body was received."""
+
+
+def run_in(executor: ThreadPoolExecutor, function, *function_args):
+    """Run a blocking function on an executor without blocking the event loop.
+
+    Args:
+        executor (ThreadPoolExecutor): the executor
+        function (Callable): the blocking function
+        *function_args: the arguments of the function
+
+    Returns:
+        Future: awaitable result of the function
+    """
+    return asyncio.get_running_loop().run_in_executor(executor, function, *function_args)
+
+
+async def read_body(receive, body):
+    """Receive the body of a request.
+
+    Args:
+        receive (Callable): the ASGI receive function
+        body (SpooledTemporaryFile): the file the body is written to, positioned
+        at its start afterwards
+
+    Raises:
+        ClientDisconnected: if the client disconnected before sending the whole body
+    """
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ClientDisconnected()
+        body.write(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    body.seek(0)
+
+
+def header(scope: dict, name: bytes):
+    """Get a request header.
+
+    Args:
+        scope (dict): the ASGI scope
+        name (bytes): the lower case header name
+
+    Returns:
+        str: the value of the header, None if it is missing
+    """
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin1")
+    return None
+
+
+def cors_headers(scope: dict):
+    """Get the CORS headers Flask-CORS adds to the Flask responses of a request.
+
+    Args:
+        scope (dict): the ASGI scope
+
+    Returns:
+        list: the (name, value) byte string tuples of the headers
+    """
+    headers = {}
+    origin = header(scope, b"origin")
+    if origin is not None:
+        headers["Origin"] = origin
+    with server.app.test_request_context(
+        scope["path"], method=scope["method"], headers=headers
+    ):
+        response = server.app.process_response(server.app.response_class())
+    return [
+        (name.lower().encode("latin1"), value.encode("latin1"))
+        for name, value in response.headers.items()
+        if name.lower().startswith("access-control-") or name.lower() == "vary"
+    ]
+
+
+async def send_json(scope: dict, send, data, status: int):
+    """Send a JSON response.
+
+    Args:
+        scope (dict): the ASGI scope
+        send (Callable): the ASGI send function
+        data: the response data
+        status (int): the HTTP status
+    """
+    body = json.dumps(data).encode("utf-8")
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("ascii")),
+            ]
+            + cors_headers(scope),
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+def prepare_image(body):
+    """Parse the request body and prepare the image, see server.prepare_image.
+
+    Args:
+        body (file): the request body
+
+    Returns:
+        tuple: (file name, prompt) or None, see server.prepare_image
+
+    Raises:
+        BadRequest: if the body is not a JSON object
+    """
+    try:
+        data = json.load(body)
+    except ValueError as e:
+        raise BadRequest(f"Invalid JSON: {e}") from e
+    if not isinstance(data, dict):
+        raise BadRequest("Invalid JSON: expected an object")
+    return server.prepare_image(data)
+
+
+async def generate_image(scope, receive, send):
+    """Generate an image, see server.generate_image."""
+    try:
+        with tempfile.SpooledTemporaryFile(max_size=BODY_SPOOL_SIZE) as body:
+            await read_body(receive, body)
+            target = await run_in(request_executor, prepare_image, body)
+        if target is None:
+            await send_json(scope, send, {"error": "Unknown route type"}, server.ERROR_STATUS)
+            return
+        await run_in(image_executor, server.render_image, *target)
+    except ClientDisconnected:
+        return
+    except BadRequest as e:
+        await send_json(scope, send, {"error": e.description}, server.ERROR_STATUS)
+        return
+    except (FileNotFoundError, ValueError) as e:
+        await send_json(
+            scope, send, {"error": f"Error generating image: {str(e)}"}, server.ERROR_STATUS
+        )
+        return
+    await send_json(scope, send, {"message": "Image successfully generated"}, server.OK_STATUS)
+
+
+async def upload_book(scope, receive, send):
+    """Upload and summarize a book, see server.upload_book."""
+
+    def prepare(body):
+        mimetype, options = parse_options_header(header(scope, b"content-type") or "")
+        content_length = header(scope, b"content-length")
+        _, _, files = FormDataParser().parse(
+            body, mimetype, int(content_length) if content_length else None, options
+        )
+        return server.prepare_upload(files)
+
+    try:
+        with tempfile.SpooledTemporaryFile(max_size=BODY_SPOOL_SIZE) as body:
+            await read_body(receive, body)
+            data, status, upload = await run_in(request_executor, prepare, body)
+    except ClientDisconnected:
+        return
+    if upload is not None:
+        data, status = await run_in(summarization_executor, server.summarize_upload, upload)
+    await send_json(scope, send, data, status)
+
+
+# Routes that await the models instead of running the Flask view
+ASYNC_ROUTES = {
+    ("POST", "/api/image"): generate_image,
+    ("POST", "/api/book"): upload_book,
+}
+
+
+async def app(scope, receive, send):
+    """The ASGI application.
+
+    Args:
+        scope (dict): the ASGI scope
+        receive (Callable): the ASGI receive function
+        send (Callable): the ASGI send function
+    """
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                for executor in (request_executor, image_executor, summarization_executor):
+                    executor.shutdown(wait=False, cancel_futures=True)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+    handler = ASYNC_ROUTES.get((scope["method"], scope["path"]), flask_app)
+    await handler(scope, receive, send)
+
+
+if __name__ == "__main__":
+    import uvicorn  # pylint: disable=import-outside-toplevel
+
+    parser = argparse.ArgumentParser(description="Run the backend as ASGI app")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    arguments = parser.parse_args()
+    uvicorn.run(app, host=arguments.host, port=arguments.port)
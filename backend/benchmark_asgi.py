@@ -0,0 +1,153 @@
+"""Load test: latency of the read endpoints while images are generated and a book is summarized.
+
+Start the backend with `python server.py` or `python asgi.py` and compare the results.
+"""
+
+import argparse
+import json
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import requests
+
+
+def read_endpoints(book_uuid: str):
+    """List the read endpoints of the load test.
+
+    Args:
+        book_uuid (str): a summarized book
+
+    Returns:
+        list: the paths of the endpoints
+    """
+    return [
+        "/api/books",
+        f"/api/books/{book_uuid}",
+        f"/api/books/{book_uuid}/images/selected",
+        "/api/book/progress",
+    ]
+
+
+def read_load(url: str, paths: list, stop: threading.Event, latencies: dict):
+    """Request the read endpoints in turn until stopped.
+
+    Args:
+        url (str): URL of the backend
+        paths (list): the read endpoints
+        stop (threading.Event): ends the loop once set
+        latencies (dict): path mapped to a list the latencies are appended to,
+        failed requests are appended as None
+    """
+    session = requests.Session()
+    while not stop.is_set():
+        for path in paths:
+            start = time.perf_counter()
+            response = session.get(url + path, timeout=60)
+            latencies[path].append(time.perf_counter() - start if response.ok else None)
+
+
+def heavy_load(url: str, book_uuid: str, image_jobs: int, epub: Path, stop: threading.Event):
+    """Generate images and summarize a book until stopped.
+
+    Args:
+        url (str): URL of the backend
+        book_uuid (str): a summarized book
+        image_jobs (int): number of concurrent image generations
+        epub (Path): a book to upload and summarize, or None
+        stop (threading.Event): ends the image generations once set
+
+    Returns:
+        list: the started threads
+    """
+
+    def generate_images():
+        session = requests.Session()
+        while not stop.is_set():
+            session.post(
+                f"{url}/api/image",
+                json={"src": f"/api/books/{book_uuid}/images", "prompt": "A quiet library"},
+                timeout=600,
+            )
+
+    def upload():
+        with open(epub, "rb") as file:
+            requests.post(f"{url}/api/book", files={"file": file}, timeout=3600)
+
+    threads = [threading.Thread(target=generate_images, daemon=True) for _ in range(image_jobs)]
+    if epub is not None:
+        threads.append(threading.Thread(target=upload, daemon=True))
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def measure(url: str, paths: list, readers: int, seconds: float):
+    """Measure the latency percentiles of the read endpoints.
+
+    Args:
+        url (str): URL of the backend
+        paths (list): the read endpoints
+        readers (int): number of concurrent clients
+        seconds (float): duration of the measurement
+
+    Returns:
+        dict: requests, errors and p50, p95 and p99 latency in milliseconds per endpoint
+    """
+    latencies = {path: [] for path in paths}
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=read_load, args=(url, paths, stop, latencies), daemon=True)
+        for _ in range(readers)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    stats = {}
+    for path, values in latencies.items():
+        succeeded = [value for value in values if value is not None]
+        stats[path] = {"requests": len(values), "errors": len(values) - len(succeeded)}
+        if succeeded:
+            for percentile in (50, 95, 99):
+                stats[path][f"p{percentile}_ms"] = round(
+                    float(np.percentile(succeeded, percentile)) * 1000, 1
+                )
+    return stats
+
+
+def first_summarized_book(url: str) -> str:
+    """Find a book to benchmark.
+
+    Args:
+        url (str): URL of the backend
+
+    Returns:
+        str: uuid of the first summarized book in the library
+    """
+    books = requests.get(f"{url}/api/books", timeout=60).json()
+    return next(entry["uuid"] for entry in books if entry["status"] == "summarized")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test of the backend")
+    parser.add_argument("--url", type=str, default="http://127.0.0.1:5000")
+    parser.add_argument("--book", type=str, help="uuid of a summarized book", default=None)
+    parser.add_argument("--epub", type=str, help="book to upload during the test", default=None)
+    parser.add_argument("--image_jobs", type=int, default=2)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    args = parser.parse_args()
+
+    book = args.book or first_summarized_book(args.url)
+    endpoints = read_endpoints(book)
+
+    idle = measure(args.url, endpoints, args.readers, args.seconds)
+    stop_heavy = threading.Event()
+    heavy_load(args.url, book, args.image_jobs, args.epub and Path(args.epub), stop_heavy)
+    loaded = measure(args.url, endpoints, args.readers, args.seconds)
+    stop_heavy.set()
+    print(json.dumps({"idle": idle, "under_load": loaded}, indent=4))
@@ -0,0 +1,129 @@
+"""Compare the speed and summary quality of chunking strategies on the chapters of a book."""
+
+import argparse
+import json
+import time
+from collections import Counter
+from pathlib import Path
+
+import util
+from book_summarizer import BookSummarizer
+from chunking import ChunkingStrategy
+from search import tokenize
+
+# Number of most frequent terms of a chapter that a summary should mention.
+KEY_TERMS = 20
+
+
+def key_term_coverage(text: str, summary: str) -> float:
+    """Get the share of the most frequent terms of a text mentioned in its summary.
+
+    Args:
+        text (str): the summarized text
+        summary (str): the summary
+
+    Returns:
+        float: between 0 and 1
+    """
+    key_terms = [term for term, _ in Counter(tokenize(text)).most_common(KEY_TERMS)]
+    summary_terms = set(tokenize(summary))
+    return sum(term in summary_terms for term in key_terms) / max(len(key_terms), 1)
+
+
+def rouge1_f1(summary: str, reference: str) -> float:
+    """Get the unigram overlap of a summary with a reference summary (ROUGE-1 F1).
+
+    Args:
+        summary (str): the summary
+        reference (str): the reference summary
+
+    Returns:
+        float: between 0 and 1
+    """
+    summary_terms, reference_terms = Counter(tokenize(summary)), Counter(tokenize(reference))
+    overlap = sum((summary_terms & reference_terms).values())
+    if overlap == 0:
+        return 0.0
+    precision = overlap / sum(summary_terms.values())
+    recall = overlap / sum(reference_terms.values())
+    return 2 * precision * recall / (precision + recall)
+
+
+def benchmark(summarizer: BookSummarizer, chapters: list, strategies: list):
+    """Summarize chapters with each chunking strategy.
+
+    The summaries of the first strategy are the reference for ROUGE-1.
+
+    Args:
+        summarizer (BookSummarizer): the summarizer
+        chapters (list): the texts of the chapters
+        strategies (list): the ChunkingStrategies to compare
+
+    Returns:
+        dict: statistics per strategy
+    """
+    results = {}
+    references = None
+    # Averages over no chapters are reported as 0.
+    num_chapters = max(len(chapters), 1)
+    for strategy in strategies:
+        summarizer.options.chunking = strategy
+        summaries, chunk_tokens = [], []
+        start = time.perf_counter()
+        for text in chapters:
+            chunks = summarizer.split_text(text)
+            chunk_tokens += [num_tokens for _, num_tokens in chunks]
+            summaries.append(
+                "\n".join(
+                    summarizer.text_summarization(chunk, num_tokens)
+                    for chunk, num_tokens in chunks
+                )
+            )
+        seconds = time.perf_counter() - start
+        references = references or summaries
+
+        results[strategy.name] = {
+            "seconds": round(seconds, 2),
+            "chunks": len(chunk_tokens),
+            "min_chunk_tokens": min(chunk_tokens, default=0),
+            "max_chunk_tokens": max(chunk_tokens, default=0),
+            "key_term_coverage": round(
+                sum(map(key_term_coverage, chapters, summaries)) / num_chapters, 3
+            ),
+            "rouge1_vs_" + strategies[0].name: round(
+                sum(map(rouge1_f1, summaries, references)) / num_chapters, 3
+            ),
+            "summary_words": sum(len(summary.split()) for summary in summaries),
+        }
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark chunking strategies")
+    parser.add_argument("--input_file", type=str, help="input json/epub file")
+    parser.add_argument("--chapters", type=int, help="number of chapters", default=3)
+    parser.add_argument(
+        "--chunk_sizes", type=int, nargs="+", help="target chunk sizes", default=[1024, 4096]
+    )
+    parser.add_argument("--overlap", type=int, help="overlap in tokens", default=128)
+    args = parser.parse_args()
+
+    book = util.parse_book(Path(args.input_file))["book"]
+    # The longest chapters show the difference between the strategies best.
+    chapter_texts = sorted(
+        # The same cleaned text that summarize_book splits into chunks.
+        (util.chapter_text_for_summary(chapter) for chapter in book["chapters"]),
+        key=len,
+        reverse=True,
+    )[: args.chapters]
+
+    # The first strategy is the previous behavior: greedy chunks of the maximal length.
+    chunking_strategies = [ChunkingStrategy(balanced=False), ChunkingStrategy()]
+    for size in args.chunk_sizes:
+        chunking_strategies += [
+            ChunkingStrategy(size, balanced=False),
+            ChunkingStrategy(size),
+            ChunkingStrategy(size, overlap_tokens=args.overlap),
+        ]
+
+    print(json.dumps(benchmark(BookSummarizer(), chapter_texts, chunking_strategies), indent=4))
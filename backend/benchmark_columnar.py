@@ -0,0 +1,77 @@
+"""Compare library-wide summary statistics computed from summarized.json files and from columns."""
+
+import argparse
+import json
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from columnar import LibraryColumns, export_library
+
+
+def json_stats(data_dir: Path) -> dict:
+    """Compute the source and summary words per book by parsing every summarized.json.
+
+    Args:
+        data_dir (Path): directory containing one folder per book
+
+    Returns:
+        dict: source and summary words per book
+    """
+    stats = {}
+    for summarized in data_dir.glob("*/summarized.json"):
+        with open(summarized, encoding="utf-8") as json_file:
+            book = json.load(json_file)["book"]
+        stats[summarized.parent.name] = {
+            "source_tokens": sum(
+                len(paragraph.split())
+                for chapter in book["chapters"]
+                for paragraph in chapter["paragraphs"]
+            ),
+            "summary_tokens": sum(
+                len(chapter.get("chapter_summary", "").split()) for chapter in book["chapters"]
+            ),
+        }
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the columnar export")
+    parser.add_argument("--data_dir", type=str, help="book data dir", default="data")
+    parser.add_argument(
+        "--copies", type=int, help="copies of each book to simulate a library", default=200
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as library:
+        library = Path(library)
+        for source in Path(args.data_dir).glob("*/summarized.json"):
+            for copy in range(args.copies):
+                book_dir = library / f"{source.parent.name}-{copy}"
+                book_dir.mkdir()
+                shutil.copy(source, book_dir / "summarized.json")
+
+        start = time.perf_counter()
+        json_stats(library)
+        json_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        export_library(library)
+        export_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        LibraryColumns.load(library / "library_columns").stats()
+        columns_seconds = time.perf_counter() - start
+
+        print(
+            json.dumps(
+                {
+                    "books": len(list(library.glob("*/summarized.json"))),
+                    "json_stats_seconds": round(json_seconds, 3),
+                    "export_seconds": round(export_seconds, 3),
+                    "columnar_stats_seconds": round(columns_seconds, 3),
+                },
+                indent=4,
+            )
+        )
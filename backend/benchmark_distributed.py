@@ -0,0 +1,130 @@
+"""Benchmark distributed summarization with a coordinator and simulated workers on localhost."""
+
+import argparse
+import json
+import multiprocessing
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from werkzeug.serving import make_server
+
+import util
+from distributed_summarization import (
+    SummarizationCoordinator,
+    SummarizationWorker,
+    create_coordinator_app,
+)
+
+
+class SimulatedSummarizer:  # pylint: disable=too-few-public-methods
+    """Takes time proportional to the text length and returns its first sentence."""
+
+    def __init__(self, seconds_per_1000_words: float):
+        self.seconds_per_1000_words = seconds_per_1000_words
+
+    def text_summarization(self, text, num_tokens=None):
+        """Simulate the summarization of a text, see BookSummarizer.text_summarization."""
+        words = num_tokens or len(text.split())
+        time.sleep(self.seconds_per_1000_words * words / 1000)
+        return text.split(".")[0].strip() + "."
+
+
+def split_words(text: str, chunk_words: int = 2000):
+    """Split a text into chunks of a fixed number of words.
+
+    Args:
+        text (str): the text to split
+        chunk_words (int, optional): words per chunk. Defaults to 2000.
+
+    Returns:
+        list: (chunk, number of words) tuples
+    """
+    words = text.split()
+    return [
+        (" ".join(words[start : start + chunk_words]), len(words[start : start + chunk_words]))
+        for start in range(0, len(words), chunk_words)
+    ]
+
+
+def run_worker(url: str, name: str, seconds_per_1000_words: float):
+    """Run a worker with a simulated summarizer until the process is terminated."""
+    SummarizationWorker(
+        url, SimulatedSummarizer(seconds_per_1000_words), name, poll_seconds=0.1
+    ).run()
+
+
+def run(book_content: dict, workers: int, args) -> dict:
+    """Summarize a book with a number of local worker processes.
+
+    Args:
+        book_content (dict): the parsed book, see util.parse_book
+        workers (int): number of worker processes
+        args (argparse.Namespace): the command line arguments
+
+    Returns:
+        dict: duration, status and number of summarized chapters
+    """
+    coordinator = SummarizationCoordinator(split_words, args.lease_seconds)
+    server = make_server("127.0.0.1", 0, create_coordinator_app(coordinator), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        start = time.perf_counter()
+        coordinator.add_book("book", json.loads(json.dumps(book_content)), Path(output_dir))
+        processes = [
+            multiprocessing.Process(
+                target=run_worker,
+                args=(url, f"worker-{index}", args.seconds_per_1000_words),
+                daemon=True,
+            )
+            for index in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        if args.kill and workers > 1:
+            # A dead worker's task is handed out again once its lease expires.
+            time.sleep(args.lease_seconds / 2)
+            processes[0].kill()
+        status = coordinator.wait("book", timeout=args.timeout)
+        seconds = time.perf_counter() - start
+        for process in processes:
+            process.kill()
+
+        summarized = Path(output_dir, "summarized.json")
+        chapters = []
+        if summarized.exists():
+            with open(summarized, encoding="utf-8") as json_file:
+                chapters = json.load(json_file)["book"]["chapters"]
+    server.shutdown()
+    return {
+        "status": status,
+        "seconds": round(seconds, 2),
+        "summarized_chapters": sum("chapter_summary" in chapter for chapter in chapters),
+        "chapters": len(book_content["book"]["chapters"]),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark distributed summarization on localhost")
+    parser.add_argument("--input_file", type=str, help="input json/epub file")
+    parser.add_argument(
+        "--workers", type=int, nargs="+", help="numbers of workers to compare", default=[1, 4]
+    )
+    parser.add_argument("--seconds_per_1000_words", type=float, default=0.5)
+    parser.add_argument("--lease_seconds", type=float, default=2.0)
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument(
+        "--kill", action="store_true", help="kill a worker to test the lease expiry"
+    )
+    arguments = parser.parse_args()
+
+    book = util.parse_book(Path(arguments.input_file))
+    print(
+        json.dumps(
+            {f"{count}_workers": run(book, count, arguments) for count in arguments.workers},
+            indent=4,
+        )
+    )
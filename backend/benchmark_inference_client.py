@@ -0,0 +1,169 @@
+"""Exercise RemoteInferenceClient against a local stand-in for the inference API.
+
+The stub server rate limits a share of the requests, answers others as if
+the model were still loading and counts how many requests it serves at
+once. Run with --down to check that all images are generated by the
+fallback when the API is unavailable.
+"""
+
+import argparse
+import io
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+from remote_inference_client import RemoteInferenceClient
+
+
+def png_bytes(size: int = 64) -> bytes:
+    """Encode a blank image as PNG.
+
+    Args:
+        size (int, optional): width and height of the image. Defaults to 64.
+
+    Returns:
+        bytes: the PNG file
+    """
+    buffer = io.BytesIO()
+    Image.new("RGB", (size, size)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class StubInferenceServer(ThreadingHTTPServer):  # pylint: disable=too-many-instance-attributes
+    """HTTP server that answers like the inference API."""
+
+    daemon_threads = True
+
+    def __init__(self, latency: float, rate_limited: float, loading: float, down: bool):
+        """
+        Listen on a free local port.
+
+        Args:
+            latency (float): seconds it takes to generate an image
+            rate_limited (float): share of requests answered with 429
+            loading (float): share of requests answered with 503 while the model loads
+            down (bool): answer all requests with 503
+        """
+        super().__init__(("127.0.0.1", 0), StubInferenceHandler)
+        self.latency = latency
+        self.rate_limited = rate_limited
+        self.loading = loading
+        self.down = down
+        self.image = png_bytes()
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.connections = set()
+
+    @property
+    def url(self) -> str:
+        """URL the model IDs are appended to."""
+        return f"http://127.0.0.1:{self.server_address[1]}/models/"
+
+
+class StubInferenceHandler(BaseHTTPRequestHandler):
+    """Handles the requests of StubInferenceServer."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Answer a text to image request."""
+        server = self.server
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with server.lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            server.connections.add(self.client_address)
+        try:
+            draw = random.random()
+            if server.down or draw < server.loading:
+                self.reply(503, json.dumps({"estimated_time": 0.05}).encode(), "application/json")
+            elif draw < server.loading + server.rate_limited:
+                self.reply(429, b"Rate limit reached", "text/plain", {"Retry-After": "0"})
+            else:
+                time.sleep(server.latency)
+                self.reply(200, server.image, "image/png")
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def reply(self, status: int, body: bytes, content_type: str, headers: dict = None):
+        """Send a response on the kept-alive connection."""
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *message_args):  # pylint: disable=redefined-builtin
+        pass
+
+
+class BlankImageClient:  # pylint: disable=too-few-public-methods
+    """Fallback that stands in for LocalInferenceClient."""
+
+    def __init__(self, model: str):
+        self.model = model
+
+    def text_to_image(self, prompt: str, model: str = None) -> Image:  # pylint: disable=unused-argument
+        """Return a blank image."""
+        return Image.new("RGB", (64, 64))
+
+
+def benchmark(images: int, concurrency: int, max_in_flight: int, server: StubInferenceServer):
+    """Generate images concurrently through the stub server.
+
+    Args:
+        images (int): number of images to generate
+        concurrency (int): number of threads requesting images
+        max_in_flight (int): limit of concurrent requests of the client
+        server (StubInferenceServer): the stub server
+
+    Returns:
+        dict: duration, client statistics and the concurrency seen by the server
+    """
+    client = RemoteInferenceClient(
+        token="hf_stub",
+        api_url=server.url,
+        max_in_flight=max_in_flight,
+        max_retries=3,
+        backoff_seconds=0.01,
+        fallback=BlankImageClient,
+    )
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(client.text_to_image, [f"prompt {i}" for i in range(images)]))
+    return {
+        "seconds": round(time.perf_counter() - start, 2),
+        "images": sum(isinstance(image, Image.Image) for image in results),
+        **client.stats(),
+        "server_max_in_flight": server.max_in_flight,
+        "server_connections": len(server.connections),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exercise the inference client against a stub")
+    parser.add_argument("--images", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--max_in_flight", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--rate_limited", type=float, default=0.2)
+    parser.add_argument("--loading", type=float, default=0.1)
+    parser.add_argument("--down", action="store_true")
+    args = parser.parse_args()
+
+    stub = StubInferenceServer(args.latency, args.rate_limited, args.loading, args.down)
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    try:
+        stats = benchmark(args.images, args.concurrency, args.max_in_flight, stub)
+        print(json.dumps(stats, indent=4))
+    finally:
+        stub.shutdown()
@@ -0,0 +1,100 @@
+"""Summarize a book while generating images, with both models under one memory budget.
+
+Reports the peak RSS of the process, the resident size of each model and
+how often the models were unloaded, e.g. compare
+`--budget_mb 6000` with a budget that fits both models.
+"""
+
+import argparse
+import json
+import threading
+import time
+from pathlib import Path
+
+import util
+from book_summarizer import BookSummarizer
+from local_inference_client import LocalInferenceClient
+from model_residency import ModelResidencyManager, rss_bytes
+
+MB = 1024 * 1024
+
+
+def sample_rss(stop: threading.Event, samples: list, interval: float = 0.05):
+    """Record the RSS of the process until stopped.
+
+    Args:
+        stop (threading.Event): ends the sampling once set
+        samples (list): the RSS in bytes is appended to it
+        interval (float, optional): seconds between samples. Defaults to 0.05.
+    """
+    while not stop.is_set():
+        samples.append(rss_bytes())
+        time.sleep(interval)
+
+
+def benchmark(input_file: Path, budget_mb: int, chapters: int, images: int):
+    """Summarize chapters of a book and generate images concurrently.
+
+    Args:
+        input_file (Path): the book
+        budget_mb (int): memory budget of the models in megabytes, None for no budget
+        chapters (int): number of chapters to summarize
+        images (int): number of images to generate
+
+    Returns:
+        dict: duration, sampled peak RSS and the statistics of the models
+    """
+    # pylint: disable=too-many-locals
+    residency = ModelResidencyManager(budget_mb * MB if budget_mb else None)
+    summarizer = BookSummarizer(residency=residency)
+    image_client = LocalInferenceClient(residency=residency)
+    book = util.parse_book(input_file)["book"]
+    texts = [util.chapter_text_for_summary(chapter) for chapter in book["chapters"][:chapters]]
+
+    def summarize():
+        for text in texts:
+            summarizer.summarize_batch(summarizer.split_text(text))
+
+    def generate():
+        for text in texts[:images]:
+            image_client.text_to_image(text[:300])
+
+    stop = threading.Event()
+    samples = []
+    sampler = threading.Thread(target=sample_rss, args=(stop, samples), daemon=True)
+    workers = [threading.Thread(target=summarize), threading.Thread(target=generate)]
+    start = time.perf_counter()
+    sampler.start()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    stop.set()
+    sampler.join()
+    stats = residency.stats()
+    return {
+        "seconds": round(time.perf_counter() - start, 1),
+        "sampled_peak_rss_mb": round(max(samples) / MB),
+        "budget_mb": budget_mb,
+        "models": {
+            name: {**model, "resident_mb": round(model["resident_bytes"] / MB)}
+            for name, model in stats["models"].items()
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Peak memory of summarization and image generation under a budget"
+    )
+    parser.add_argument("--input_file", type=str, help="input json/epub file")
+    parser.add_argument("--budget_mb", type=int, default=None)
+    parser.add_argument("--chapters", type=int, default=3)
+    parser.add_argument("--images", type=int, default=3)
+    args = parser.parse_args()
+    print(
+        json.dumps(
+            benchmark(Path(args.input_file), args.budget_mb, args.chapters, args.images),
+            indent=4,
+        )
+    )
@@ -0,0 +1,92 @@
+"""Compare the requests of opening a chapter in the reader with one prefetch request.
+
+Start the backend with `python server.py` first.
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+import requests
+
+from benchmark_asgi import first_summarized_book
+
+
+def serial_requests(session, url: str, book_uuid: str, chapter: dict, number: int):
+    """Request the data of a chapter like the reader does, one route at a time.
+
+    Args:
+        session (requests.Session): the HTTP session
+        url (str): URL of the backend
+        book_uuid (str): a summarized book
+        chapter (dict): the chapter of the book
+        number (int): chapter number, starting at 1
+
+    Returns:
+        int: number of requests
+    """
+    base = f"{url}/api/books/{book_uuid}"
+    paths = [
+        "",
+        "/images/selected",
+        f"/chapters/{number}/image/versions",
+    ]
+    paths.extend(
+        f"/chapters/{number}/summarized_paragraphs/{paragraph}/image/versions"
+        for paragraph in range(len(chapter.get("paragraph_summaries", [])))
+    )
+    for path in paths:
+        session.get(base + path, timeout=60).raise_for_status()
+    return len(paths)
+
+
+def benchmark(url: str, book_uuid: str, repeats: int):
+    """Time opening every chapter of a book with serial requests and with prefetch.
+
+    Args:
+        url (str): URL of the backend
+        book_uuid (str): a summarized book
+        repeats (int): number of passes over the chapters
+
+    Returns:
+        dict: requests and p50/p95 milliseconds per chapter for both variants
+    """
+    session = requests.Session()
+    chapters = session.get(f"{url}/api/books/{book_uuid}", timeout=60).json()["book"]["chapters"]
+    serial, prefetched = [], []
+    num_requests = 0
+    for _ in range(repeats):
+        for number, chapter in enumerate(chapters, start=1):
+            start = time.perf_counter()
+            num_requests += serial_requests(session, url, book_uuid, chapter, number)
+            serial.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            session.get(
+                f"{url}/api/books/{book_uuid}/chapters/{number}/prefetch", timeout=60
+            ).raise_for_status()
+            prefetched.append(time.perf_counter() - start)
+
+    def percentiles(values):
+        return {
+            f"p{percentile}_ms": round(float(np.percentile(values, percentile)) * 1000, 2)
+            for percentile in (50, 95)
+        }
+
+    return {
+        "chapters": len(chapters),
+        "serial": {"requests_per_chapter": num_requests / len(serial), **percentiles(serial)},
+        "prefetch": {"requests_per_chapter": 1, **percentiles(prefetched)},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serial chapter requests versus prefetch")
+    parser.add_argument("--url", type=str, default="http://127.0.0.1:5000")
+    parser.add_argument("--book", type=str, help="uuid of a summarized book", default=None)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    book = args.book or first_summarized_book(args.url)
+    print(json.dumps(benchmark(args.url, book, args.repeats), indent=4))
@@ -0,0 +1,128 @@
+"""Compare built prompts with cut-off prompts and count image regenerations per text node."""
+
+import argparse
+import json
+import re
+from pathlib import Path
+
+from prompt_builder import PromptBuilder, pretrained_clip_token_counter
+from search import book_nodes
+
+VERSION_PATTERN = re.compile(r"(?P<node>.+)-version-(?P<version>\d+)\.png")
+NAIVE_MAX_LENGTH = 77
+
+
+def compare_prompts(book: dict, builder: PromptBuilder):
+    """Compare prompts cut off after NAIVE_MAX_LENGTH characters with built prompts.
+
+    Args:
+        book (dict): the "book" object of summarized.json
+        builder (PromptBuilder): builds prompts fitting the token window
+
+    Returns:
+        dict: token usage and cut-off sentences of both kinds of prompts
+    """
+    stats = {"nodes": 0, "over_budget": 0, "naive_tokens": 0, "built_tokens": 0,
+             "naive_cut_off": 0, "built_cut_off": 0}
+    for node in book_nodes(book):
+        text = " ".join(node["text"].split())
+        if not text:
+            continue
+        naive = text[:NAIVE_MAX_LENGTH]
+        built = builder.build(text)
+        stats["nodes"] += 1
+        stats["over_budget"] += builder.count_tokens(text) > builder.max_tokens
+        stats["naive_tokens"] += min(builder.count_tokens(naive), builder.max_tokens)
+        stats["built_tokens"] += builder.count_tokens(built)
+        # A prompt is cut off if it ends within a sentence of the text.
+        stats["naive_cut_off"] += naive != text and not naive.rstrip().endswith((".", "!", "?"))
+        stats["built_cut_off"] += built != text and not built.rstrip().endswith((".", "!", "?"))
+    return stats
+
+
+def count_regenerations(book_dir: Path):
+    """Count the regenerated images per text node, split by how the prompt was built.
+
+    The number of generations of a node in prompts.json counts its images
+    generated from built prompts, its other images used cut-off prompts.
+
+    Args:
+        book_dir (Path): the folder of the book
+
+    Returns:
+        dict: number of nodes with images and regenerations for built and cut-off prompts
+    """
+    versions = {}
+    for path in book_dir.glob("*-version-*.png"):
+        match = VERSION_PATTERN.fullmatch(path.name)
+        if match:
+            node = match["node"]
+            versions[node] = max(versions.get(node, 0), int(match["version"]) + 1)
+
+    built_nodes = {}
+    if (book_dir / "prompts.json").exists():
+        with open(book_dir / "prompts.json", encoding="utf-8") as json_file:
+            built_nodes = json.load(json_file)
+
+    stats = {"built_nodes": 0, "built_regenerations": 0,
+             "naive_nodes": 0, "naive_regenerations": 0}
+    for node, count in versions.items():
+        # The latest versions were generated with built prompts, the versions
+        # before them, e.g., before prompts were built, with cut-off prompts.
+        built = min(count, built_nodes.get(node, {}).get("generations", 0))
+        naive = count - built
+        if naive:
+            stats["naive_nodes"] += 1
+            stats["naive_regenerations"] += naive - 1
+        if built:
+            stats["built_nodes"] += 1
+            # Every built version after the first version of the node is a regeneration.
+            stats["built_regenerations"] += built - (0 if naive else 1)
+    return stats
+
+
+def benchmark(data_dir: Path, builder: PromptBuilder):
+    """Run the prompt comparison and regeneration count over all summarized books.
+
+    Args:
+        data_dir (Path): directory containing one folder per book
+        builder (PromptBuilder): builds prompts fitting the token window
+
+    Returns:
+        dict: aggregated results
+    """
+    totals = {}
+    for summarized in sorted(data_dir.glob("*/summarized.json")):
+        with open(summarized, encoding="utf-8") as json_file:
+            book = json.load(json_file)["book"]
+        for stats in (compare_prompts(book, builder), count_regenerations(summarized.parent)):
+            for key, value in stats.items():
+                totals[key] = totals.get(key, 0) + value
+
+    nodes = max(totals.get("nodes", 0), 1)
+    naive_rate = totals.get("naive_regenerations", 0) / max(totals.get("naive_nodes", 0), 1)
+    built_rate = totals.get("built_regenerations", 0) / max(totals.get("built_nodes", 0), 1)
+    totals.update(
+        {
+            "mean_naive_tokens": round(totals.get("naive_tokens", 0) / nodes, 1),
+            "mean_built_tokens": round(totals.get("built_tokens", 0) / nodes, 1),
+            "naive_regenerations_per_node": round(naive_rate, 2),
+            "built_regenerations_per_node": round(built_rate, 2),
+            # Regenerations avoided for the nodes that used built prompts
+            "regenerations_saved": round(
+                (naive_rate - built_rate) * totals.get("built_nodes", 0), 1
+            ),
+        }
+    )
+    return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark prompt building")
+    parser.add_argument("--data_dir", type=str, help="book data dir", default="data")
+    parser.add_argument("--model", type=str, help="diffusion model id",
+                        default="lykon/dreamshaper-8")
+    args = parser.parse_args()
+
+    prompt_builder = PromptBuilder(pretrained_clip_token_counter(args.model))
+    print(json.dumps(benchmark(Path(args.data_dir), prompt_builder), indent=4))
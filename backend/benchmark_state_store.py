@@ -0,0 +1,110 @@
+"""Stress test concurrent partial updates of the per-book state store."""
+
+import argparse
+import json
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from book_state import BookStateStore
+
+
+def stress_test(num_writers: int, updates_per_writer: int, num_paragraphs: int):
+    """Run concurrent selected image updates and reads against a single book.
+
+    Every writer owns a disjoint set of paragraphs, so the final document is
+    known in advance and lost updates can be detected.
+
+    Args:
+        num_writers (int): number of threads updating the document
+        updates_per_writer (int): number of updates per thread
+        num_paragraphs (int): number of paragraphs of the book
+
+    Returns:
+        dict: throughput and consistency results
+    """
+    # pylint: disable=too-many-locals
+    with tempfile.TemporaryDirectory() as data_dir:
+        store = BookStateStore(Path(data_dir))
+        book_uuid = "stress-test"
+        (Path(data_dir) / book_uuid).mkdir()
+        store.write(
+            book_uuid,
+            "selected_images",
+            {
+                "bookSelectedId": 0,
+                "chapters": [
+                    {"chapterSelectedId": 0, "paragraphSelectedIds": [0] * num_paragraphs}
+                ],
+            },
+        )
+
+        done = threading.Event()
+        failed_reads = []
+
+        def writer(writer_id):
+            paragraphs = range(writer_id, num_paragraphs, num_writers)
+            for update in range(updates_per_writer):
+                paragraph = paragraphs[update % len(paragraphs)]
+
+                def set_selected_id(data, paragraph=paragraph, update=update):
+                    data["chapters"][0]["paragraphSelectedIds"][paragraph] = update
+                    return data
+
+                store.update(book_uuid, "selected_images", set_selected_id)
+
+        def reader():
+            path = store.path(book_uuid, "selected_images")
+            while not done.is_set():
+                # Read without the lock, like a client downloading the file would.
+                try:
+                    with open(path, encoding="utf-8") as json_file:
+                        json.load(json_file)
+                except ValueError as e:
+                    failed_reads.append(e)
+
+        readers = [threading.Thread(target=reader) for _ in range(2)]
+        writers = [
+            threading.Thread(target=writer, args=(writer_id,))
+            for writer_id in range(num_writers)
+        ]
+        for thread in readers:
+            thread.start()
+        start = time.perf_counter()
+        for thread in writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        done.set()
+        for thread in readers:
+            thread.join()
+
+        expected = [0] * num_paragraphs
+        for writer_id in range(num_writers):
+            paragraphs = range(writer_id, num_paragraphs, num_writers)
+            for update in range(updates_per_writer):
+                expected[paragraphs[update % len(paragraphs)]] = update
+        actual = store.read(book_uuid, "selected_images")["chapters"][0][
+            "paragraphSelectedIds"
+        ]
+
+        return {
+            "updates": num_writers * updates_per_writer,
+            "seconds": elapsed,
+            "updates_per_second": num_writers * updates_per_writer / elapsed,
+            "lost_updates": sum(a != e for a, e in zip(actual, expected)),
+            "torn_reads": len(failed_reads),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stress test the book state store")
+    parser.add_argument("--writers", type=int, help="concurrent writers", default=8)
+    parser.add_argument("--updates", type=int, help="updates per writer", default=200)
+    parser.add_argument("--paragraphs", type=int, help="paragraphs of the book", default=500)
+    args = parser.parse_args()
+
+    results = stress_test(args.writers, args.updates, args.paragraphs)
+    print(json.dumps(results, indent=4))
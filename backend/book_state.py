@@ -0,0 +1,189 @@
+"""Per-book JSON state files with atomic writes and per-book locking."""
+
+import json
+import threading
+from pathlib import Path
+from typing import Callable
+
+import util
+
+
+def atomic_write_json(path: Path, data):
+    """Write JSON to a file so that readers see either the old or the new content.
+
+    Args:
+        path (Path): the file to write
+        data (object): JSON serializable data
+    """
+    content = json.dumps(data, ensure_ascii=False, indent=4).encode("utf-8")
+    util.replace_file(path, lambda tmp_file: tmp_file.write(content))
+
+
+# Results of a book that is being summarized: the parsed book on the first
+# line, followed by one line per chapter as soon as it is summarized.
+PARTIAL_FILE = "summarized.partial.jsonl"
+
+
+def start_partial_book(folder: Path, book_content: dict):
+    """Start the partial results of a book, replacing those of an earlier run.
+
+    Args:
+        folder (Path): the folder of the book
+        book_content (dict): the parsed book, see util.parse_book
+    """
+    with open(folder / PARTIAL_FILE, "w", encoding="utf-8") as partial_file:
+        partial_file.write(json.dumps(book_content) + "\n")
+
+
+def append_partial_chapter(folder: Path, index: int, chapter: dict):
+    """Add a summarized chapter to the partial results of a book.
+
+    Args:
+        folder (Path): the folder of the book
+        index (int): index of the chapter in the book
+        chapter (dict): the chapter with its paragraph_summaries and chapter_summary
+    """
+    with open(folder / PARTIAL_FILE, "a", encoding="utf-8") as partial_file:
+        partial_file.write(json.dumps({"index": index, "chapter": chapter}) + "\n")
+
+
+def read_partial_book(folder: Path):
+    """Read the partial results of a book that is being summarized.
+
+    Args:
+        folder (Path): the folder of the book
+
+    Returns:
+        dict: the book with the summarized chapters so far. Chapters that are not
+        summarized yet have empty summaries, and the book is marked as incomplete
+        with the indices of its summarized chapters. None if there are no results.
+    """
+    try:
+        with open(folder / PARTIAL_FILE, encoding="utf-8") as partial_file:
+            # The last line is either empty or still being written.
+            lines = partial_file.read().split("\n")[:-1]
+    except FileNotFoundError:
+        return None
+    if not lines:
+        return None
+    book_content = json.loads(lines[0])
+    book = book_content["book"]
+    chapters = book["chapters"]
+    # Readers of summarized.json expect the summaries of every chapter.
+    for chapter in chapters:
+        chapter.setdefault("paragraph_summaries", [])
+        chapter.setdefault("chapter_summary", "")
+    book.setdefault("book_summary", "")
+    summarized = set()
+    for line in lines[1:]:
+        entry = json.loads(line)
+        chapters[entry["index"]] = entry["chapter"]
+        summarized.add(entry["index"])
+    book["incomplete"] = True
+    book["summarized_chapters"] = sorted(summarized)
+    return book_content
+
+
+class BookStateStore:
+    """
+    Stores small JSON documents, e.g., selected images or characters, per book.
+    All reads and writes of the documents of one book are serialized by a lock,
+    and documents are replaced atomically on disk.
+    """
+
+    def __init__(self, data_dir: Path):
+        """
+        Create a store for the books in a data directory.
+
+        Args:
+            data_dir (Path): directory containing one folder per book
+        """
+        self.data_dir = data_dir
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def lock(self, book_uuid: str) -> threading.RLock:
+        """Get the lock guarding the documents of a book.
+
+        Args:
+            book_uuid (str): UUID of the book
+
+        Returns:
+            threading.RLock: the lock of the book
+        """
+        with self._locks_lock:
+            return self._locks.setdefault(book_uuid, threading.RLock())
+
+    def path(self, book_uuid: str, name: str) -> Path:
+        """Get the file of a document.
+
+        Args:
+            book_uuid (str): UUID of the book
+            name (str): name of the document, e.g., "selected_images"
+
+        Returns:
+            Path: the JSON file of the document
+        """
+        return self.data_dir / book_uuid / f"{name}.json"
+
+    def read(self, book_uuid: str, name: str, default: Callable[[], object] = None):
+        """Read a document, creating it first if it does not exist.
+
+        Args:
+            book_uuid (str): UUID of the book
+            name (str): name of the document
+            default (Callable[[], object], optional): creates the initial document.
+            If None, None is returned for missing documents.
+
+        Returns:
+            object: the document
+        """
+        path = self.path(book_uuid, name)
+        with self.lock(book_uuid):
+            if path.exists():
+                with open(path, encoding="utf-8") as json_file:
+                    return json.load(json_file)
+            if default is None:
+                return None
+            data = default()
+            self.write(book_uuid, name, data)
+            return data
+
+    def write(self, book_uuid: str, name: str, data):
+        """Replace a document.
+
+        Args:
+            book_uuid (str): UUID of the book
+            name (str): name of the document
+            data (object): the new document
+        """
+        path = self.path(book_uuid, name)
+        if not path.parent.is_dir():
+            raise FileNotFoundError(f"Book {book_uuid} does not exist")
+        with self.lock(book_uuid):
+            atomic_write_json(path, data)
+
+    def update(
+        self,
+        book_uuid: str,
+        name: str,
+        update_fn: Callable[[object], object],
+        default: Callable[[], object] = None,
+    ):
+        """Read, modify and write a document while holding the lock of the book.
+
+        Args:
+            book_uuid (str): UUID of the book
+            name (str): name of the document
+            update_fn (Callable[[object], object]): returns the new document given
+            the current one.
+            default (Callable[[], object], optional): creates the initial document
+            if it does not exist yet.
+
+        Returns:
+            object: the updated document
+        """
+        with self.lock(book_uuid):
+            data = update_fn(self.read(book_uuid, name, default))
+            self.write(book_uuid, name, data)
+            return data
@@ -1,28 +1,158 @@
 """Module for book summarization functionality."""
 
-import asyncio
+import math
+import threading
+from contextlib import contextmanager
 from typing import Callable
 import argparse
 import json
 from pathlib import Path
-from transformers import pipeline
+from transformers import AutoConfig, pipeline
+from transformers.models.auto.tokenization_auto import get_tokenizer_config
 from tokenizers import Tokenizer
 import torch.cuda
 from tqdm import tqdm
 
-from semantic_text_splitter import TextSplitter  # pylint: disable=no-name-in-module
-
 import util
+from book_state import (
+    PARTIAL_FILE,
+    append_partial_chapter,
+    atomic_write_json,
+    start_partial_book,
+)
+from chunking import ChunkingStrategy
+from model_residency import ModelResidencyManager
+from stage_pipeline import PipelineStage, StagePipeline
+
+def model_max_length(model_id: str) -> int:
+    """Read the maximal input length of a model without loading its tokenizer.
+
+    Args:
+        model_id (str): Huggingface model id
+
+    Returns:
+        int: maximal number of input tokens
+    """
+    max_length = get_tokenizer_config(model_id).get("model_max_length")
+    if max_length is None:
+        config = AutoConfig.from_pretrained(model_id)
+        max_length = getattr(config, "max_encoder_position_embeddings", None) or getattr(
+            config, "max_position_embeddings"
+        )
+    return max_length
+
+
+class PipelineOptions:  # pylint: disable=too-few-public-methods
+    """How BookSummarizer splits chapters and overlaps the stages of summarizing a book."""
+
+    def __init__(
+        self, chunking: ChunkingStrategy = None, preprocess_workers: int = 2, queue_size: int = 2
+    ):
+        """
+        Create the options.
+
+        Args:
+            chunking (ChunkingStrategy, optional): how chapters are split into chunks.
+            Defaults to balanced chunks of the maximal input length of the model.
+            preprocess_workers (int, optional): number of threads cleaning, splitting and
+            tokenizing chapters while the model summarizes. Defaults to 2.
+            queue_size (int, optional): maximal number of chapters waiting between
+            the stages of the summarization pipeline. Defaults to 2.
+        """
+        self.chunking = chunking or ChunkingStrategy()
+        self.preprocess_workers = preprocess_workers
+        self.queue_size = queue_size
+
+
+class _ChunkProgress:
+    """
+    Counts the summarized chunks of a book. Until all chapters are split, the
+    chunks of the remaining chapters are estimated from their length.
+    """
+
+    def __init__(self, chapter_lengths: list, callback: Callable[[int, int], None] = None):
+        """
+        Start counting at 0 summarized chunks.
+
+        Args:
+            chapter_lengths (list): number of characters per chapter
+            callback (Callable[[int, int], None], optional): called with the number of
+            summarized chunks and the (estimated) total number of chunks.
+        """
+        self.chapter_lengths = chapter_lengths
+        self.callback = callback
+        self.chapter_chunks = {}
+        # Chunks of the joined chapter summaries and the final book summary.
+        self.book_chunks = 2
+        self.processed = 0
+        self._lock = threading.Lock()
+        self.advance(0)
+
+    def split(self, ch_num: int, num_chunks: int):
+        """Record the number of chunks of a split chapter.
+
+        Args:
+            ch_num (int): the chapter
+            num_chunks (int): its number of chunks
+        """
+        with self._lock:
+            self.chapter_chunks[ch_num] = num_chunks
+
+    def split_book(self, num_chunks: int):
+        """Record the number of chunks of the joined chapter summaries.
+
+        Args:
+            num_chunks (int): the number of chunks, without the final book summary
+        """
+        with self._lock:
+            self.book_chunks = num_chunks + 1
+
+    def advance(self, num_chunks: int):
+        """Count summarized chunks and report the progress.
+
+        Args:
+            num_chunks (int): the number of chunks summarized since the last call
+        """
+        with self._lock:
+            self.processed += num_chunks
+            progress = (self.processed, self._total())
+        if self.callback:
+            self.callback(*progress)
+
+    def _total(self) -> int:
+        """Get the (estimated) total number of chunks, with the lock held.
+
+        Returns:
+            int: the number of chunks
+        """
+        split_chunks = sum(self.chapter_chunks.values())
+        split_length = sum(self.chapter_lengths[ch_num] for ch_num in self.chapter_chunks)
+        remaining = [
+            length
+            for ch_num, length in enumerate(self.chapter_lengths)
+            if ch_num not in self.chapter_chunks and length
+        ]
+        if split_length:
+            estimate = math.ceil(sum(remaining) * split_chunks / split_length)
+        else:
+            estimate = len(remaining)
+        return split_chunks + estimate + self.book_chunks
 
 
-class BookSummarizer:
+class BookSummarizer:  # pylint: disable=too-many-instance-attributes
     """
     Summarizes a book given its input file and saves the
     summarized content to the specified output directory.
     """
 
     def __init__(
-        self, model_id="pszemraj/led-large-book-summary", min_length=32, max_length=512
+        self,
+        model_id="pszemraj/led-large-book-summary",
+        min_length=32,
+        max_length=512,
+        *,
+        options: PipelineOptions = None,
+        residency: ModelResidencyManager = None,
     ):
         """
         Summarize a given text to a provided length.
@@ -31,17 +161,46 @@ class BookSummarizer:
             model_id (string): Huggingface model id
             min_length (int, optional): the minimal length of the summarization. Defaults to 32.
             max_length (int, optional): the maximal length of the summarization. Defaults to 512.
+            options (PipelineOptions, optional): chunking and pipeline options.
+            Defaults to PipelineOptions().
+            residency (ModelResidencyManager, optional): loads the model when it is
+            needed and may unload it while it is idle. If None, the model is loaded
+            right away and stays loaded.
 
         Returns:
             string: the summarized version of the text
         """
+        self.model_id = model_id
         self.tokenizer = Tokenizer.from_pretrained(model_id)
-        self.summarizer = pipeline(
+        self.min_length = min_length
+        self.max_length = max_length
+        self.residency = residency
+        if residency is None:
+            self.summarizer = self.load_model()
+            self.model_max_length = self.summarizer.tokenizer.model_max_length
+        else:
+            self.summarizer = None
+            self.model_max_length = model_max_length(model_id)
+            residency.register(model_id, self.load_model)
+        self.options = options or PipelineOptions()
+        # Queue occupancy and timing of the stages of the last summarized book
+        self.pipeline_stats = {}
+
+    def load_model(self):
+        """Load the summarization pipeline.
+
+        Returns:
+            SummarizationPipeline: the model and its tokenizer
+        """
+        return pipeline(
             "summarization",
-            model=model_id,
+            model=self.model_id,
             device=0 if torch.cuda.is_available() else -1,
-            min_length=min_length,
-            max_length=max_length,
+            # Load the weights directly instead of initializing random weights
+            # first, which would need twice the memory while loading.
+            model_kwargs={"low_cpu_mem_usage": True},
+            min_length=self.min_length,
+            max_length=self.max_length,
             no_repeat_ngram_size=3,
             encoder_no_repeat_ngram_size=3,
             repetition_penalty=3.5,
@@ -52,50 +211,89 @@ class BookSummarizer:
             # Detailed information about parameters:
             # https://github.com/pszemraj/textsum/wiki/Inference-&-Parameters
         )
-        self.min_length = min_length
-        self.max_length = max_length
 
-    def semantic_text_split(self, text, max_tokens):
-        """Split text into chunks accoding to https://github.com/benbrandt/text-splitter. (v0.12.3)
+    @contextmanager
+    def model(self):
+        """Use the summarization pipeline, loading it if it has been unloaded.
+
+        Yields:
+            SummarizationPipeline: the model and its tokenizer
+        """
+        if self.residency is None:
+            yield self.summarizer
+        else:
+            with self.residency.use(self.model_id) as summarizer:
+                yield summarizer
+
+    def split_text(self, text):
+        """Split text into chunks with the chunking strategy of the summarizer.
 
         Args:
             text (string): the text to be chunked
-            max_tokens (int): maximal length of a chunk
 
         Returns:
-            list: chunks (strings) of text
+            list: (chunk, number of tokens) tuples
         """
-        splitter = TextSplitter.from_huggingface_tokenizer(self.tokenizer, max_tokens)
-        chunks = splitter.chunks(text)
-        return chunks
+        return self.options.chunking.split(text, self.tokenizer, self.model_max_length)
 
-    def text_summarization(self, text):
+    def text_summarization(self, text, num_tokens=None):
         """
         Summarize a given text to a provided length.
 
         Args:
             text (string): the text to be summarized
+            num_tokens (int, optional): number of tokens of the text if already known.
         Returns:
             string: the summarized version of the text
         """
-        tokens = self.tokenizer.encode(text)
-
-        num_tokens = len(tokens)
-
-        summary = self.summarizer(
-            text,
-            # Avoid warning:
-            # Your max_length is set to X, but your input_length is only Y. "
-            min_length=min(self.min_length, num_tokens),
-            max_length=min(self.max_length, num_tokens),
-        )
+        if num_tokens is None:
+            num_tokens = len(self.tokenizer.encode(text))
+
+        with self.model() as summarizer:
+            summary = summarizer(
+                text,
+                # Avoid warning:
+                # Your max_length is set to X, but your input_length is only Y. "
+                min_length=min(self.min_length, num_tokens),
+                max_length=min(self.max_length, num_tokens),
+            )
         return summary[0]["summary_text"]
 
-    async def summarize_book(
+    def summarize_batch(self, chunks):
+        """
+        Summarize several texts with as few model calls as possible.
+
+        Args:
+            chunks (list): (text, number of tokens) tuples
+        Returns:
+            list: the summarized versions of the texts
+        """
+        # Texts sharing the same length limits can be passed to the model together.
+        groups = {}
+        for index, (_, num_tokens) in enumerate(chunks):
+            limits = (min(self.min_length, num_tokens), min(self.max_length, num_tokens))
+            groups.setdefault(limits, []).append(index)
+
+        summaries = [None] * len(chunks)
+        with self.model() as summarizer:
+            for (min_length, max_length), indices in groups.items():
+                results = summarizer(
+                    [chunks[index][0] for index in indices],
+                    min_length=min_length,
+                    max_length=max_length,
+                    batch_size=len(indices),
+                )
+                for index, result in zip(indices, results):
+                    summaries[index] = result["summary_text"]
+        return summaries
+
+    def summarize_book(
         self,
         input_file: Path,
         output_dir: Path,
         progress_callback: Callable[[int, int], None] = None,
+        book_content: dict = None,
+        summarize_chunks: Callable[[list], list] = None,
     ):
         """
         Summarizes a book given its input file and saves the
@@ -107,8 +305,14 @@ class BookSummarizer:
             output_dir (str): The path to the output directory where
             the summarized content will be saved. If unspecified,
             the output directory will be the same as the input file's parent directory.
-            progress_callback (Callable[[int, int], None]): Called with number of processed
-            items and total items as arguments if not None.
+            progress_callback (Callable[[int, int], None]): Called with the number of
+            summarized chunks and the total number of chunks, which is estimated until
+            all chapters are split, as arguments if not None.
+            book_content (dict): The already parsed input file, see util.parse_book.
+            If None, the input file is parsed.
+            summarize_chunks (Callable[[list], list]): Summarizes a list of
+            (text, number of tokens) tuples, e.g., through a SummarizationScheduler
+            shared by several books. If None, the texts are summarized one by one.
 
         Returns:
             bool: True if the book is successfully summarized and saved
@@ -116,75 +320,86 @@ class BookSummarizer:
         # pylint: disable=too-many-locals
         output_dir.mkdir(parents=True, exist_ok=True)
 
-        book_content = util.parse_book(input_file)
+        if book_content is None:
+            book_content = util.parse_book(input_file)
 
         book: dict = book_content["book"]
         summarized_book = book
-        chapter_summaries = []
 
-        num_paragraphs_per_chapter = [
-            len(chapter["paragraphs"]) for chapter in book["chapters"]
-        ]
-        num_paragraphs = sum(num_paragraphs_per_chapter)
         num_chapters = len(book["chapters"])
-        num_book = 1
-        total_to_process = num_book + num_chapters + num_paragraphs
-
-        num_processed = 0
-
-        def increment_progress(inc: int):
-            nonlocal num_processed
-            num_processed += inc
-            if progress_callback:
-                progress_callback(num_processed, total_to_process)
-
-        # Initiate 0% progress
-        increment_progress(0)
-
-        for ch_num, chapter in enumerate(book["chapters"]):
-            translation_table = dict.fromkeys(map(ord, '\n*\xa0\u2009""'), None)
-            # Clean paragraphs to eleminate strange characters in original text
-            # that are irrelevant for summarization: e.g. multiple new lines,
-            # \xa0 non-breaking space, \u2009 thin space
-
-            clean_paragraphs = [
-                paragraph.translate(translation_table)
-                for paragraph in chapter["paragraphs"]
-            ]
-
-            chapter_text: str = "\n".join(clean_paragraphs)
-            chapter_chunks: list = self.semantic_text_split(
-                chapter_text, self.summarizer.tokenizer.model_max_length
-            )
-            chapter_chunk_summaries: list = [
-                self.text_summarization(chunk) for chunk in chapter_chunks
-            ]
-            summarized_book["chapters"][ch_num][
-                "paragraph_summaries"
-            ] = chapter_chunk_summaries
-
-            chapter_summary: str = "\n".join(chapter_chunk_summaries)
-            increment_progress(1)
-
-            summarized_book["chapters"][ch_num]["chapter_summary"] = chapter_summary
-            chapter_summaries.append(chapter_summary)
+        # Progress is counted in chunks, as the model runs once per chunk.
+        progress = _ChunkProgress(
+            [sum(map(len, chapter["paragraphs"])) for chapter in book["chapters"]],
+            progress_callback,
+        )
 
-        chapter_summary_chunks: list = self.semantic_text_split(
-            "\n".join(chapter_summaries), self.summarizer.tokenizer.model_max_length
+        def split_chapter(ch_num: int):
+            chapter_text: str = util.chapter_text_for_summary(book["chapters"][ch_num])
+            # Tokenized here so that the summarization stage only runs the model.
+            chunks = self.split_text(chapter_text)
+            progress.split(ch_num, len(chunks))
+            return ch_num, chunks
+
+        if summarize_chunks is None:
+
+            def summarize_chunks(chunks):
+                return [
+                    self.text_summarization(chunk, num_tokens)
+                    for chunk, num_tokens in chunks
+                ]
+
+        def summarize_chapter(split):
+            ch_num, chapter_chunks = split
+            return ch_num, summarize_chunks(chapter_chunks)
+
+        # Chapters can be read through the partial results as soon as they
+        # are summarized, see book_state.read_partial_book.
+        start_partial_book(output_dir, book_content)
+
+        def write_chapter(result):
+            ch_num, chapter_chunk_summaries = result
+            chapter = summarized_book["chapters"][ch_num]
+            chapter["paragraph_summaries"] = chapter_chunk_summaries
+            chapter["chapter_summary"] = "\n".join(chapter_chunk_summaries)
+            append_partial_chapter(output_dir, ch_num, chapter)
+            progress.advance(len(chapter_chunk_summaries))
+            return chapter["chapter_summary"]
+
+        # Splitting and tokenizing the next chapters runs in parallel to the
+        # summarization of the current chapter, so the model does not wait for it.
+        chapter_pipeline = StagePipeline(
+            [
+                PipelineStage("split", split_chapter, self.options.preprocess_workers),
+                PipelineStage("summarize", summarize_chapter),
+                PipelineStage("write", write_chapter),
+            ],
+            queue_size=self.options.queue_size,
         )
-        chapter_chunk_summaries: list = [
-            self.text_summarization(chunk) for chunk in chapter_summary_chunks
-        ]
-        book_summary = self.text_summarization("\n".join(chapter_chunk_summaries))
-        increment_progress(1)
+        chapter_summaries = chapter_pipeline.run(range(num_chapters))
+        self.pipeline_stats = chapter_pipeline.stats()
+
+        book_chunks = self.split_text("\n".join(chapter_summaries))
+        progress.split_book(len(book_chunks))
+        chapter_chunk_summaries: list = summarize_chunks(book_chunks)
+        progress.advance(len(book_chunks))
+        book_summary_text = "\n".join(chapter_chunk_summaries)
+        book_summary = summarize_chunks(
+            [(book_summary_text, len(self.tokenizer.encode(book_summary_text)))]
+        )[0]
+        progress.advance(1)
 
         book["book_summary"] = book_summary
 
-        with open(Path(output_dir, "summarized.json"), "w", encoding="utf-8") as f:
-            json.dump({"book": book}, f)
-        self.summarizer.model.config.to_json_file(
-            Path(output_dir, "summarized_config.json")
+        # Readers see either the partial results or the complete book.
+        atomic_write_json(Path(output_dir, "summarized.json"), {"book": book})
+        Path(output_dir, PARTIAL_FILE).unlink(missing_ok=True)
+        # The unloaded model is not loaded again just for its configuration.
+        config = (
+            self.summarizer.model.config
+            if self.summarizer is not None
+            else AutoConfig.from_pretrained(self.model_id)
         )
+        config.to_json_file(Path(output_dir, "summarized_config.json"))
 
         return True
 
@@ -200,23 +415,38 @@ if __name__ == "__main__":
         help="output dir. Same as input if unspecified",
         default=None,
     )
+    parser.add_argument(
+        "--chunk_tokens",
+        type=int,
+        help="target chunk size in tokens. Maximal input length of the model if unspecified",
+        default=None,
+    )
+    parser.add_argument(
+        "--chunk_overlap", type=int, help="tokens repeated from the previous chunk", default=0
+    )
+    parser.add_argument(
+        "--greedy_chunks",
+        action="store_true",
+        help="fill chunks up to the target size instead of splitting evenly, "
+        "which was the default before balanced chunks",
+    )
     args = parser.parse_args()
     with tqdm(desc="Summarizing book") as pbar:
 
         def print_progress(progress, total):
             """Log progress bar"""
-            if progress == 0:
-                pbar.reset(total)
-            else:
-                pbar.update(1)
+            # The total is estimated until all chapters are split.
+            pbar.total = total
+            pbar.update(progress - pbar.n)
 
         out_dir = (
             Path(args.output_dir) if args.output_dir else Path(args.input_file).parent
         )
 
-        Booksummarizer = BookSummarizer()
-        asyncio.run(
-            Booksummarizer.summarize_book(
-                Path(args.input_file), out_dir, print_progress
+        book_summarizer = BookSummarizer(
+            options=PipelineOptions(
+                ChunkingStrategy(args.chunk_tokens, not args.greedy_chunks, args.chunk_overlap)
             )
         )
+        book_summarizer.summarize_book(Path(args.input_file), out_dir, print_progress)
+    print(json.dumps(book_summarizer.pipeline_stats, indent=4))
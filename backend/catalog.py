@@ -0,0 +1,241 @@
+"""Persistent index of the books in the library."""
+
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import util
+
+UPLOADED = "uploaded"
+SUMMARIZING = "summarizing"
+SUMMARIZED = "summarized"
+FAILED = "failed"
+
+# Sort keys mapped to the ORDER BY expressions, which match the indices below.
+SORT_COLUMNS = {
+    "title": "title COLLATE NOCASE",
+    "creator": "creator COLLATE NOCASE",
+    "added": "added_at",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    uuid TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    creator TEXT,
+    status TEXT NOT NULL,
+    added_at REAL NOT NULL,
+    content_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS books_title ON books (title COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS books_creator ON books (creator COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS books_added_at ON books (added_at);
+CREATE INDEX IF NOT EXISTS books_content_hash ON books (content_hash);
+"""
+INSERT = (
+    "INSERT OR REPLACE INTO books (uuid, title, creator, status, added_at, content_hash) "
+    "VALUES (?, ?, ?, ?, ?, ?)"
+)
+
+
+def like_pattern(text: str) -> str:
+    """Build a LIKE pattern matching text anywhere, with its wildcards taken literally.
+
+    Args:
+        text (str): the text to search for
+
+    Returns:
+        str: the pattern, to be used with ESCAPE '\\'
+    """
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+class BookCatalog:
+    """
+    SQLite backed index of the books in the data directory, so that listing
+    books does not need to open the metadata of every book.
+    """
+
+    def __init__(self, data_dir: Path, db_name: str = "catalog.sqlite3"):
+        """
+        Open the catalog of a data directory, creating it from the book
+        folders if it does not exist yet.
+
+        Args:
+            data_dir (Path): directory containing one folder per book
+            db_name (str, optional): file name of the database within data_dir.
+        """
+        self.data_dir = data_dir
+        data_dir.mkdir(parents=True, exist_ok=True)
+        db_path = data_dir / db_name
+        is_new = not db_path.exists()
+        # The connection is shared by the server threads, the lock serializes its use.
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.executescript(SCHEMA)
+        if is_new:
+            self.rebuild()
+        else:
+            self.reset_interrupted()
+
+    def reset_interrupted(self):
+        """Update books that were being summarized when the server stopped.
+
+        Their summarization is not resumed, books with a summary are marked
+        as summarized and the others as failed, so they can be uploaded again.
+
+        Returns:
+            int: number of updated books
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT uuid FROM books WHERE status = ?", (SUMMARIZING,)
+            ).fetchall()
+        for row in rows:
+            summarized = (self.data_dir / row["uuid"] / "summarized.json").exists()
+            self.set_status(row["uuid"], SUMMARIZED if summarized else FAILED)
+        return len(rows)
+
+    def rebuild(self):
+        """Recreate the catalog from the book folders in the data directory.
+
+        Folders without metadata are skipped.
+
+        Returns:
+            int: number of books in the catalog
+        """
+        rows = []
+        for path in self.data_dir.iterdir():
+            metadata_path = path / "metadata.json"
+            if not metadata_path.exists():
+                continue
+            with open(metadata_path, encoding="utf8") as json_file:
+                metadata = json.load(json_file)
+            status = SUMMARIZED if (path / "summarized.json").exists() else UPLOADED
+            content_hash = metadata.get("content_hash")
+            if content_hash is None and (path / "book.epub").exists():
+                content_hash = util.file_hash(path / "book.epub")
+            rows.append(
+                (
+                    path.name,
+                    metadata["title"],
+                    metadata.get("creator"),
+                    status,
+                    metadata_path.stat().st_mtime,
+                    content_hash,
+                )
+            )
+
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM books")
+            self._connection.executemany(INSERT, rows)
+        return len(rows)
+
+    def add_book(
+        self,
+        book_uuid: str,
+        title: str,
+        creator: str,
+        status: str = UPLOADED,
+        content_hash: str = None,
+    ):
+        """Add a book to the catalog or replace its entry.
+
+        Args:
+            book_uuid (str): UUID of the book
+            title (str): title of the book
+            creator (str): author of the book
+            status (str, optional): summarization status. Defaults to UPLOADED.
+            content_hash (str, optional): SHA-256 digest of the uploaded file.
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                INSERT, (book_uuid, title, creator, status, time.time(), content_hash)
+            )
+
+    def find_by_hash(self, content_hash: str):
+        """Find a summarized book, or one being summarized, by the digest of its file.
+
+        Books that were only uploaded or failed are not returned, so uploading
+        them again summarizes them.
+
+        Args:
+            content_hash (str): SHA-256 digest of the uploaded file
+
+        Returns:
+            dict: uuid, title, creator and status of the book, None if not found
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT uuid, title, creator, status FROM books "
+                "WHERE content_hash = ? AND status IN (?, ?) ORDER BY added_at LIMIT 1",
+                (content_hash, SUMMARIZING, SUMMARIZED),
+            ).fetchone()
+        return dict(row) if row else None
+
+    def set_status(self, book_uuid: str, status: str):
+        """Update the summarization status of a book.
+
+        Args:
+            book_uuid (str): UUID of the book
+            status (str): the new status
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE books SET status = ? WHERE uuid = ?", (status, book_uuid)
+            )
+
+    def list_books(  # pylint: disable=too-many-arguments
+        self,
+        offset: int = 0,
+        limit: int = None,
+        *,
+        sort: str = "title",
+        descending: bool = False,
+        title: str = None,
+        creator: str = None,
+    ):
+        """List a page of books.
+
+        Args:
+            offset (int, optional): number of books to skip. Defaults to 0.
+            limit (int, optional): maximal number of books to return. Defaults to all.
+            sort (str, optional): one of SORT_COLUMNS. Defaults to "title".
+            descending (bool, optional): sort in descending order. Defaults to False.
+            title (str, optional): only list books whose title contains this text.
+            creator (str, optional): only list books whose creator contains this text.
+
+        Returns:
+            tuple: the books as list of dicts and the total number of matching books
+        """
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"Unknown sort column: {sort}")
+
+        conditions = []
+        parameters = []
+        if title:
+            conditions.append("title LIKE ? ESCAPE '\\'")
+            parameters.append(like_pattern(title))
+        if creator:
+            conditions.append("creator LIKE ? ESCAPE '\\'")
+            parameters.append(like_pattern(creator))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        order = "DESC" if descending else "ASC"
+
+        with self._lock:
+            total = self._connection.execute(
+                f"SELECT COUNT(*) FROM books {where}", parameters
+            ).fetchone()[0]
+            rows = self._connection.execute(
+                f"SELECT uuid, title, creator, status FROM books {where} "
+                f"ORDER BY {SORT_COLUMNS[sort]} {order} "
+                "LIMIT ? OFFSET ?",
+                # A negative limit returns all rows.
+                [*parameters, -1 if limit is None else limit, offset],
+            ).fetchall()
+        return [dict(row) for row in rows], total
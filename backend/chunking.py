@@ -0,0 +1,101 @@
+"""Strategies for splitting texts into chunks for the summarization model."""
+
+import math
+
+from semantic_text_splitter import TextSplitter  # pylint: disable=no-name-in-module
+
+# Growth of the chunk capacity per attempt when balanced chunks spill over.
+CAPACITY_STEP = 0.05
+
+
+class ChunkingStrategy:
+    """
+    Splits texts at semantic boundaries into chunks of at most a target number
+    of tokens. Balanced splitting spreads a text evenly over the fewest chunks
+    that fit the target, instead of filling chunks greedily and leaving a small
+    remainder. Chunks can repeat the end of the previous chunk as context.
+    """
+
+    def __init__(self, max_tokens: int = None, balanced: bool = True, overlap_tokens: int = 0):
+        """
+        Create a chunking strategy.
+
+        Args:
+            max_tokens (int, optional): target size of a chunk including the overlap.
+            Limited to the maximal input length of the model. If None, the maximal
+            input length of the model is used.
+            balanced (bool, optional): split into chunks of equal size instead of
+            filling each chunk up to the target size. Defaults to True.
+            overlap_tokens (int, optional): number of tokens of the previous chunk
+            repeated at the start of a chunk. Defaults to 0.
+        """
+        self.max_tokens = max_tokens
+        self.balanced = balanced
+        self.overlap_tokens = overlap_tokens
+
+    @property
+    def name(self) -> str:
+        """Short description of the strategy, e.g., "balanced-4096+256"."""
+        name = f"{'balanced' if self.balanced else 'greedy'}-{self.max_tokens or 'max'}"
+        if self.overlap_tokens:
+            name += f"+{self.overlap_tokens}"
+        return name
+
+    def split(self, text: str, tokenizer, model_max_tokens: int):
+        """Split a text into chunks.
+
+        Args:
+            text (str): the text to split
+            tokenizer (tokenizers.Tokenizer): the tokenizer of the model
+            model_max_tokens (int): maximal input length of the model
+
+        Returns:
+            list: (chunk, number of tokens) tuples
+        """
+        limit = min(self.max_tokens or model_max_tokens, model_max_tokens)
+        # Leave room for the overlap added to the chunks afterwards.
+        capacity = max(limit - self.overlap_tokens, 1)
+        total = len(tokenizer.encode(text, add_special_tokens=False).ids)
+
+        if not text.strip():
+            chunks = []
+        elif total <= capacity:
+            chunks = [text.strip()]
+        elif self.balanced:
+            chunks = self._balanced_chunks(text, tokenizer, total, capacity)
+        else:
+            chunks = TextSplitter.from_huggingface_tokenizer(tokenizer, capacity).chunks(text)
+
+        if self.overlap_tokens:
+            chunks = self._add_overlap(chunks, tokenizer)
+        return [(chunk, len(tokenizer.encode(chunk).ids)) for chunk in chunks]
+
+    @staticmethod
+    def _balanced_chunks(text: str, tokenizer, total: int, capacity: int):
+        """Split a text into the fewest chunks that fit the capacity, all of similar size."""
+        count = math.ceil(total / capacity)
+        balanced_capacity = math.ceil(total / count)
+        while True:
+            chunks = TextSplitter.from_huggingface_tokenizer(tokenizer, balanced_capacity).chunks(
+                text
+            )
+            # Chunks end at semantic boundaries, so they rarely fill their capacity
+            # exactly and the text may need one more chunk than computed.
+            if len(chunks) <= count or balanced_capacity >= capacity:
+                return chunks
+            balanced_capacity = min(
+                capacity, balanced_capacity + math.ceil(balanced_capacity * CAPACITY_STEP)
+            )
+
+    def _add_overlap(self, chunks: list, tokenizer):
+        """Prefix each chunk with the whole words at the end of the previous chunk."""
+        overlapped = chunks[:1]
+        for previous, chunk in zip(chunks, chunks[1:]):
+            offsets = tokenizer.encode(previous, add_special_tokens=False).offsets
+            start = offsets[-self.overlap_tokens][0] if len(offsets) > self.overlap_tokens else 0
+            # Do not start the overlap in the middle of a word.
+            while 0 < start < len(previous) and not previous[start - 1].isspace():
+                start += 1
+            context = previous[start:].strip()
+            overlapped.append(f"{context}\n{chunk}" if context else chunk)
+        return overlapped
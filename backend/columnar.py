@@ -0,0 +1,393 @@
+"""Columnar export of the summarized books of the library for analytics and bulk loading."""
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pyarrow is optional, the npy layout is always written
+    pyarrow = None
+
+COLUMNS_DIR = "library_columns"
+SCHEMA_FILE = "schema.json"
+SCHEMA_VERSION = 1
+# Text levels of the nodes, stored as their index in the level column
+LEVELS = ("paragraph", "paragraph_summary", "chapter_summary", "book_summary")
+PARAGRAPH, PARAGRAPH_SUMMARY, CHAPTER_SUMMARY, BOOK_SUMMARY = range(len(LEVELS))
+# Keys of the chapter lists in summarized.json holding the nodes of a level
+LEVEL_KEYS = {PARAGRAPH: "paragraphs", PARAGRAPH_SUMMARY: "paragraph_summaries"}
+# Whitespace separating the words of UTF-8 encoded texts; the non-breaking
+# space (\xa0) is the two bytes C2 A0.
+WHITESPACE = np.frombuffer(b" \t\n\r\x0b\x0c", dtype=np.uint8)
+NBSP = (0xC2, 0xA0)
+
+
+def encode_strings(strings: list):
+    """Store strings as one UTF-8 buffer and offsets into it.
+
+    Args:
+        strings (list): the strings
+
+    Returns:
+        tuple: offsets (int64, one more than strings) and data (uint8) arrays
+    """
+    encoded = [string.encode("utf-8") for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(data) for data in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+
+def count_words(offsets: np.ndarray, data: np.ndarray) -> np.ndarray:
+    """Count the whitespace separated words of all strings of a string column at once.
+
+    Args:
+        offsets (np.ndarray): offsets of the strings, see encode_strings
+        data (np.ndarray): the UTF-8 buffer of the strings
+
+    Returns:
+        np.ndarray: number of words per string
+    """
+    is_space = np.isin(data, WHITESPACE)
+    nbsp = (data[:-1] == NBSP[0]) & (data[1:] == NBSP[1])
+    is_space[:-1] |= nbsp
+    is_space[1:] |= nbsp
+    # A word starts at a non-space byte following a space or the start of a string.
+    follows_space = np.ones(len(data), dtype=bool)
+    follows_space[1:] = is_space[:-1]
+    follows_space[offsets[:-1][offsets[:-1] < len(data)]] = True
+    starts = np.zeros(len(data) + 1, dtype=np.int64)
+    np.cumsum(~is_space & follows_space, out=starts[1:])
+    return (starts[offsets[1:]] - starts[offsets[:-1]]).astype(np.int32)
+
+
+def node_stats(columns: dict):
+    """Compute the token counts and compression ratios of all nodes in one vectorized pass.
+
+    Tokens are whitespace separated words. The source of a chapter summary is
+    its chapter, of a book summary its book, and of a paragraph summary an equal
+    share of its chapter. Paragraphs are their own source.
+
+    Args:
+        columns (dict): the columns of the library, see LibraryColumns
+
+    Returns:
+        dict: "nodes.tokens", "nodes.source_tokens" and "nodes.compression_ratio" columns
+    """
+    level = columns["nodes.level"]
+    chapter = columns["nodes.chapter"]
+    book = columns["nodes.book"]
+    tokens = count_words(columns["nodes.text.offsets"], columns["nodes.text.data"])
+    num_chapters = len(columns["chapters.book"])
+    num_books = len(columns["books.uuid.offsets"]) - 1
+
+    is_paragraph = level == PARAGRAPH
+    chapter_tokens = np.bincount(
+        chapter[is_paragraph], weights=tokens[is_paragraph], minlength=num_chapters
+    )
+    book_tokens = np.bincount(
+        book[is_paragraph], weights=tokens[is_paragraph], minlength=num_books
+    )
+    summaries_per_chapter = np.bincount(
+        chapter[level == PARAGRAPH_SUMMARY], minlength=num_chapters
+    )
+
+    # Book summaries have no chapter; index 0 is replaced below.
+    node_chapter = np.where(chapter >= 0, chapter, 0)
+    source_tokens = np.select(
+        [is_paragraph, level == PARAGRAPH_SUMMARY, level == CHAPTER_SUMMARY],
+        [
+            tokens,
+            chapter_tokens[node_chapter] / np.maximum(summaries_per_chapter[node_chapter], 1),
+            chapter_tokens[node_chapter],
+        ],
+        book_tokens[book],
+    )
+    return {
+        "nodes.tokens": tokens,
+        "nodes.source_tokens": source_tokens.astype(np.float32),
+        "nodes.compression_ratio": (source_tokens / np.maximum(tokens, 1)).astype(np.float32),
+    }
+
+
+def book_columns(data_dir: Path) -> dict:  # pylint: disable=too-many-locals
+    """Flatten the summarized.json files of all books into columns.
+
+    Args:
+        data_dir (Path): directory containing one folder per book
+
+    Returns:
+        dict: column name mapped to array, string columns as offsets and data arrays
+    """
+    uuids, titles = [], []
+    chapter_book, chapter_num, chapter_titles = [], [], []
+    node_book, node_chapter, node_level, node_position, texts = [], [], [], [], []
+
+    for summarized in sorted(data_dir.glob("*/summarized.json")):
+        with open(summarized, encoding="utf-8") as json_file:
+            book = json.load(json_file)["book"]
+        book_index = len(uuids)
+        uuids.append(summarized.parent.name)
+        titles.append(book.get("title", ""))
+        for chapter in book["chapters"]:
+            chapter_index = len(chapter_book)
+            chapter_book.append(book_index)
+            chapter_num.append(chapter.get("num", chapter_index))
+            chapter_titles.append(chapter.get("title", ""))
+            for level, key in LEVEL_KEYS.items():
+                for position, text in enumerate(chapter.get(key, [])):
+                    node_book.append(book_index)
+                    node_chapter.append(chapter_index)
+                    node_level.append(level)
+                    node_position.append(position)
+                    texts.append(text)
+            if "chapter_summary" in chapter:
+                node_book.append(book_index)
+                node_chapter.append(chapter_index)
+                node_level.append(CHAPTER_SUMMARY)
+                node_position.append(-1)
+                texts.append(chapter["chapter_summary"])
+        if "book_summary" in book:
+            node_book.append(book_index)
+            node_chapter.append(-1)
+            node_level.append(BOOK_SUMMARY)
+            node_position.append(-1)
+            texts.append(book["book_summary"])
+
+    columns = {
+        "chapters.book": np.array(chapter_book, dtype=np.int32),
+        "chapters.num": np.array(chapter_num, dtype=np.int32),
+        "nodes.book": np.array(node_book, dtype=np.int32),
+        "nodes.chapter": np.array(node_chapter, dtype=np.int32),
+        "nodes.level": np.array(node_level, dtype=np.int8),
+        "nodes.position": np.array(node_position, dtype=np.int32),
+    }
+    for name, strings in (
+        ("books.uuid", uuids),
+        ("books.title", titles),
+        ("chapters.title", chapter_titles),
+        ("nodes.text", texts),
+    ):
+        columns[f"{name}.offsets"], columns[f"{name}.data"] = encode_strings(strings)
+    return columns
+
+
+def export_library(data_dir: Path, output_dir: Path = None, parquet: bool = False):
+    """Export all summarized books into one npy file per column.
+
+    Args:
+        data_dir (Path): directory containing one folder per book
+        output_dir (Path, optional): destination folder. Defaults to data_dir/library_columns.
+        parquet (bool, optional): also write one Parquet file per table. Requires pyarrow.
+
+    Returns:
+        LibraryColumns: the exported columns
+    """
+    output_dir = output_dir or data_dir / COLUMNS_DIR
+    output_dir.mkdir(parents=True, exist_ok=True)
+    columns = book_columns(data_dir)
+    columns.update(node_stats(columns))
+
+    for name, array in columns.items():
+        np.save(output_dir / f"{name}.npy", array)
+    with open(output_dir / SCHEMA_FILE, "w", encoding="utf-8") as f:
+        json.dump({"version": SCHEMA_VERSION, "levels": LEVELS, "columns": sorted(columns)}, f)
+
+    library = LibraryColumns(columns)
+    if parquet:
+        library.write_parquet(output_dir)
+    return library
+
+
+class LibraryColumns:
+    """
+    The books, chapters and text nodes of the library as columns. String
+    columns are stored as a UTF-8 buffer with offsets, so a text is a slice
+    of the buffer, and loaded columns are memory mapped.
+    """
+
+    def __init__(self, columns: dict):
+        """
+        Wrap exported columns.
+
+        Args:
+            columns (dict): column name mapped to array, see book_columns
+        """
+        self.columns = columns
+
+    @classmethod
+    def load(cls, columns_dir: Path):
+        """Memory map exported columns.
+
+        Args:
+            columns_dir (Path): the folder written by export_library
+
+        Returns:
+            LibraryColumns: the columns
+        """
+        with open(columns_dir / SCHEMA_FILE, encoding="utf-8") as f:
+            schema = json.load(f)
+        if schema["version"] != SCHEMA_VERSION:
+            raise ValueError(f"Unsupported columnar schema version {schema['version']}")
+        return cls(
+            {
+                name: np.load(columns_dir / f"{name}.npy", mmap_mode="r")
+                for name in schema["columns"]
+            }
+        )
+
+    def string(self, column: str, row: int) -> str:
+        """Get a value of a string column.
+
+        Args:
+            column (str): e.g. "nodes.text"
+            row (int): the row
+
+        Returns:
+            str: the value
+        """
+        offsets = self.columns[f"{column}.offsets"]
+        return bytes(self.columns[f"{column}.data"][offsets[row] : offsets[row + 1]]).decode(
+            "utf-8"
+        )
+
+    def strings(self, column: str) -> list:
+        """Get all values of a string column.
+
+        Args:
+            column (str): e.g. "books.uuid"
+
+        Returns:
+            list: the values
+        """
+        rows = len(self.columns[f"{column}.offsets"]) - 1
+        return [self.string(column, row) for row in range(rows)]
+
+    def book(self, uuid: str) -> dict:
+        """Rebuild the summarized.json content of a book.
+
+        Args:
+            uuid (str): UUID of the book
+
+        Returns:
+            dict: the book, see util.parse_book
+        """
+        book_index = self.strings("books.uuid").index(uuid)
+        chapter_rows = np.flatnonzero(self.columns["chapters.book"] == book_index)
+        chapters = {
+            int(row): {
+                "num": int(self.columns["chapters.num"][row]),
+                "title": self.string("chapters.title", row),
+                "paragraphs": [],
+            }
+            for row in chapter_rows
+        }
+        book = {
+            "title": self.string("books.title", book_index),
+            "chapters": list(chapters.values()),
+        }
+        # Nodes are stored in document order, so appending restores the lists.
+        for row in np.flatnonzero(self.columns["nodes.book"] == book_index):
+            level = self.columns["nodes.level"][row]
+            text = self.string("nodes.text", row)
+            if level == BOOK_SUMMARY:
+                book["book_summary"] = text
+                continue
+            chapter = chapters[int(self.columns["nodes.chapter"][row])]
+            if level == CHAPTER_SUMMARY:
+                chapter["chapter_summary"] = text
+            else:
+                chapter.setdefault(LEVEL_KEYS[level], []).append(text)
+        return {"book": book}
+
+    def stats(self) -> dict:
+        """Aggregate the node statistics per level and per book.
+
+        Returns:
+            dict: number of nodes, mean tokens and mean compression ratio per
+            level, and source tokens, summary tokens and compression ratio per book
+        """
+        level = self.columns["nodes.level"]
+        book = self.columns["nodes.book"]
+        tokens = self.columns["nodes.tokens"]
+        ratio = self.columns["nodes.compression_ratio"]
+
+        counts = np.bincount(level, minlength=len(LEVELS))
+        level_tokens = np.bincount(level, weights=tokens, minlength=len(LEVELS))
+        level_ratio = np.bincount(level, weights=ratio, minlength=len(LEVELS))
+        per_level = {
+            name: {
+                "nodes": int(counts[index]),
+                "mean_tokens": round(float(level_tokens[index] / max(counts[index], 1)), 1),
+                "mean_compression_ratio": round(
+                    float(level_ratio[index] / max(counts[index], 1)), 2
+                ),
+            }
+            for index, name in enumerate(LEVELS)
+        }
+
+        num_books = len(self.columns["books.uuid.offsets"]) - 1
+        is_paragraph = level == PARAGRAPH
+        source = np.bincount(book[is_paragraph], weights=tokens[is_paragraph], minlength=num_books)
+        # Every summarized chapter has a chapter summary, not all have paragraph summaries.
+        is_chapter_summary = level == CHAPTER_SUMMARY
+        summary = np.bincount(
+            book[is_chapter_summary], weights=tokens[is_chapter_summary], minlength=num_books
+        )
+        per_book = {
+            uuid: {
+                "source_tokens": int(source[index]),
+                "summary_tokens": int(summary[index]),
+                "compression_ratio": round(float(source[index] / max(summary[index], 1)), 2),
+            }
+            for index, uuid in enumerate(self.strings("books.uuid"))
+        }
+        return {"levels": per_level, "books": per_book}
+
+    def write_parquet(self, output_dir: Path):
+        """Write one Parquet file per table (books, chapters, nodes).
+
+        Args:
+            output_dir (Path): destination folder
+        """
+        if pyarrow is None:
+            raise ImportError("Parquet export requires pyarrow")
+        tables = {}
+        for name in self.columns:
+            table, column = name.split(".", 1)
+            if column.endswith(".data"):
+                continue
+            if column.endswith(".offsets"):
+                column = column.removesuffix(".offsets")
+                tables.setdefault(table, {})[column] = self.strings(f"{table}.{column}")
+            else:
+                tables.setdefault(table, {})[column] = np.asarray(self.columns[name])
+        for table, columns in tables.items():
+            pyarrow.parquet.write_table(pyarrow.table(columns), output_dir / f"{table}.parquet")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export summaries into columns and analyze them")
+    parser.add_argument("--data_dir", type=str, help="book data dir", default="data")
+    parser.add_argument(
+        "--output_dir", type=str, help="export dir. data_dir/library_columns if unspecified"
+    )
+    parser.add_argument("--parquet", action="store_true", help="also write Parquet files")
+    parser.add_argument(
+        "--stats_only", action="store_true", help="analyze a previous export without exporting"
+    )
+    args = parser.parse_args()
+
+    columns_path = Path(args.output_dir) if args.output_dir else Path(args.data_dir) / COLUMNS_DIR
+    start = time.perf_counter()
+    if not args.stats_only:
+        export_library(Path(args.data_dir), columns_path, args.parquet)
+        print(f"Exported in {time.perf_counter() - start:.2f}s")
+    start = time.perf_counter()
+    library_stats = LibraryColumns.load(columns_path).stats()
+    print(json.dumps(library_stats, indent=4))
+    print(f"Analyzed in {time.perf_counter() - start:.3f}s")
@@ -0,0 +1,598 @@
+"""Summarize books on several machines: a coordinator hands out chapters to workers over HTTP."""
+
+import argparse
+import functools
+import itertools
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from pathlib import Path
+from typing import Callable
+
+import requests
+from flask import Flask, jsonify, request
+
+import catalog
+import util
+from book_state import (
+    PARTIAL_FILE,
+    append_partial_chapter,
+    atomic_write_json,
+    start_partial_book,
+)
+
+NO_CONTENT_STATUS = 204
+CONFLICT_STATUS = 409
+
+# Stages of a book. The chapters are summarized first, then the joined
+# chapter summaries in chunks, and finally the joined chunk summaries.
+CHAPTER = "chapter"
+BOOK_CHUNKS = "book_chunks"
+BOOK = "book"
+
+
+class _Task:  # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    """Chunks of text that a worker summarizes at once."""
+
+    def __init__(self, task_id: str, book_id: str, stage: str, index: int, chunks: list):
+        self.task_id = task_id
+        self.book_id = book_id
+        self.stage = stage
+        self.index = index
+        self.chunks = chunks
+        self.attempts = 0
+        self.lease_id = None
+        self.worker = None
+        self.lease_expires = 0.0
+
+
+class _BookJob:  # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    """The summarization state of one book."""
+
+    def __init__(self, book_content: dict, output_dir: Path):
+        self.book_content = book_content
+        self.output_dir = output_dir
+        self.remaining_chapters = len(book_content["book"]["chapters"])
+        self.status = "summarizing"
+        self.error = None
+        self.done = threading.Event()
+        # File writes queued with the coordinator lock held, run in order without it.
+        self.writes = deque()
+        self.write_lock = threading.Lock()
+
+
+class SummarizationCoordinator:  # pylint: disable=too-many-instance-attributes
+    """
+    Splits books into chapter tasks that workers lease, summarize and post
+    back, and assembles the summarized.json of a book from the results.
+    A lease that is not renewed in time expires and its task is handed to
+    another worker, until the task has been attempted max_attempts times.
+    """
+
+    def __init__(
+        self,
+        split_text: Callable[[str], list],
+        lease_seconds: float = 300.0,
+        max_attempts: int = 3,
+        on_finished: Callable[[str, Path, str], None] = None,
+    ):
+        """
+        Create a coordinator.
+
+        Args:
+            split_text (Callable[[str], list]): splits a text into (chunk, number of
+            tokens) tuples, see BookSummarizer.split_text
+            lease_seconds (float, optional): time a worker has to summarize a task
+            or renew its lease. Defaults to 300.
+            max_attempts (int, optional): number of leases of a task before the book
+            fails. Defaults to 3.
+            on_finished (Callable[[str, Path, str], None], optional): called with the
+            book id, its output folder and its status once a book is summarized
+            or has failed, before wait() returns.
+        """
+        self.split_text = split_text
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.on_finished = on_finished
+        self._books = {}
+        self._tasks = {}
+        self._pending = deque()
+        self._workers = {}
+        self._task_ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def add_book(self, book_id: str, book_content: dict, output_dir: Path):
+        """Split a book into chapter tasks.
+
+        Args:
+            book_id (str): the id of the book, e.g., its UUID
+            book_content (dict): the parsed book, see util.parse_book
+            output_dir (Path): the folder summarized.json is written to
+        """
+        output_dir.mkdir(parents=True, exist_ok=True)
+        start_partial_book(output_dir, book_content)
+        chapters = book_content["book"]["chapters"]
+        # Splitting only needs the tokenizer, not the model.
+        chapter_chunks = [
+            self.split_text(util.chapter_text_for_summary(chapter)) for chapter in chapters
+        ]
+        job = _BookJob(book_content, output_dir)
+        with self._lock:
+            self._books[book_id] = job
+            for ch_num, chunks in enumerate(chapter_chunks):
+                self._add_task(book_id, CHAPTER, ch_num, chunks)
+            if not chapters:
+                self._add_book_chunks_task(book_id)
+        self._run_writes(job)
+
+    def lease(self, worker: str):
+        """Lease the next pending task to a worker.
+
+        Args:
+            worker (str): name of the worker
+
+        Returns:
+            dict: task id, lease id, lease duration and chunks of the task,
+            or None if no task is pending
+        """
+        leased = None
+        with self._lock:
+            now = time.monotonic()
+            self._workers[worker] = now
+            self._expire_leases(now)
+            while self._pending:
+                task = self._tasks[self._pending.popleft()]
+                if self._books[task.book_id].status != "summarizing":
+                    continue
+                task.attempts += 1
+                task.lease_id = uuid.uuid4().hex
+                task.worker = worker
+                task.lease_expires = now + self.lease_seconds
+                leased = {
+                    "task_id": task.task_id,
+                    "lease_id": task.lease_id,
+                    "lease_seconds": self.lease_seconds,
+                    "chunks": task.chunks,
+                }
+                break
+        # Books whose last lease expired have failed.
+        self._run_all_writes()
+        return leased
+
+    def renew(self, task_id: str, lease_id: str) -> bool:
+        """Extend the lease of a task that is still being summarized.
+
+        Args:
+            task_id (str): the task
+            lease_id (str): the lease returned by lease()
+
+        Returns:
+            bool: False if the lease has expired or the task is unknown
+        """
+        with self._lock:
+            task = self._leased_task(task_id, lease_id)
+            if task is None:
+                return False
+            task.lease_expires = time.monotonic() + self.lease_seconds
+            self._workers[task.worker] = time.monotonic()
+            return True
+
+    def complete(self, task_id: str, lease_id: str, summaries: list) -> bool:
+        """Store the summaries of a leased task.
+
+        Args:
+            task_id (str): the task
+            lease_id (str): the lease returned by lease()
+            summaries (list): the summaries of the chunks of the task
+
+        Returns:
+            bool: False if the lease has expired, e.g., because the task was
+            handed to another worker, or the task is unknown
+        """
+        with self._lock:
+            task = self._leased_task(task_id, lease_id)
+            if task is None or len(summaries) != len(task.chunks):
+                return False
+            self._workers[task.worker] = time.monotonic()
+            del self._tasks[task_id]
+            self._store(task, summaries)
+            job = self._books[task.book_id]
+        self._run_writes(job)
+        return True
+
+    def fail(self, task_id: str, lease_id: str, error: str) -> bool:
+        """Return a task a worker could not summarize.
+
+        The task is handed to another worker unless it has been attempted
+        max_attempts times, in which case the book fails.
+
+        Args:
+            task_id (str): the task
+            lease_id (str): the lease returned by lease()
+            error (str): description of the error
+
+        Returns:
+            bool: False if the lease has expired or the task is unknown
+        """
+        with self._lock:
+            task = self._leased_task(task_id, lease_id)
+            if task is None:
+                return False
+            self._retry(task, error)
+            job = self._books[task.book_id]
+        self._run_writes(job)
+        return True
+
+    def status(self):
+        """Get the progress of the books and the last contact with the workers.
+
+        Returns:
+            dict: per book its status and remaining chapters, per worker the
+            seconds since its last request
+        """
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "books": {
+                    book_id: {
+                        "status": job.status,
+                        "remaining_chapters": job.remaining_chapters,
+                        "error": job.error,
+                    }
+                    for book_id, job in self._books.items()
+                },
+                "pending_tasks": len(self._pending),
+                "leased_tasks": sum(task.lease_id is not None for task in self._tasks.values()),
+                "workers": {
+                    worker: round(now - last_seen, 1) for worker, last_seen in self._workers.items()
+                },
+            }
+
+    def wait(self, book_id: str, timeout: float = None) -> str:
+        """Wait until a book is summarized or has failed.
+
+        Args:
+            book_id (str): the book
+            timeout (float, optional): maximal seconds to wait.
+
+        Returns:
+            str: the status of the book, "summarized" or "failed" unless the timeout passed
+        """
+        job = self._books[book_id]
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not job.done.wait(1.0):
+            if deadline is not None and time.monotonic() > deadline:
+                break
+            # Leases also expire while no worker asks for a task.
+            with self._lock:
+                self._expire_leases(time.monotonic())
+            self._run_all_writes()
+        return job.status
+
+    def _add_task(self, book_id: str, stage: str, index: int, chunks: list):
+        task_id = f"{next(self._task_ids)}"
+        task = _Task(task_id, book_id, stage, index, chunks)
+        if not chunks:
+            # Nothing to summarize, e.g., an empty chapter.
+            self._store(task, [])
+            return
+        self._tasks[task_id] = task
+        self._pending.append(task_id)
+
+    def _leased_task(self, task_id: str, lease_id: str):
+        task = self._tasks.get(task_id)
+        if task is None or task.lease_id is None or task.lease_id != lease_id:
+            return None
+        return task
+
+    def _expire_leases(self, now: float):
+        for task in list(self._tasks.values()):
+            if task.lease_id is not None and task.lease_expires < now:
+                self._retry(task, f"Lease of worker {task.worker} expired")
+
+    def _retry(self, task: _Task, error: str):
+        task.lease_id = None
+        task.worker = None
+        if task.attempts < self.max_attempts:
+            # Retried before other tasks, so the book is not held up.
+            self._pending.appendleft(task.task_id)
+            return
+        del self._tasks[task.task_id]
+        job = self._books[task.book_id]
+        job.status = "failed"
+        job.error = f"Task {task.stage} {task.index} failed {task.attempts} times: {error}"
+        job.writes.append(functools.partial(self._finish, task.book_id, job))
+
+    def _store(self, task: _Task, summaries: list):
+        job = self._books[task.book_id]
+        if job.status != "summarizing":
+            return
+        book = job.book_content["book"]
+        if task.stage == CHAPTER:
+            chapter = book["chapters"][task.index]
+            chapter["paragraph_summaries"] = summaries
+            chapter["chapter_summary"] = "\n".join(summaries)
+            job.writes.append(
+                functools.partial(append_partial_chapter, job.output_dir, task.index, chapter)
+            )
+            job.remaining_chapters -= 1
+            if job.remaining_chapters == 0:
+                self._add_book_chunks_task(task.book_id)
+        elif task.stage == BOOK_CHUNKS:
+            book_summary_text = "\n".join(summaries)
+            # The worker counts the tokens of the joined summaries.
+            self._add_task(
+                task.book_id, BOOK, 0, [(book_summary_text, None)] if book_summary_text else []
+            )
+        else:
+            book["book_summary"] = summaries[0] if summaries else ""
+            self._write(task.book_id)
+
+    def _add_book_chunks_task(self, book_id: str):
+        book = self._books[book_id].book_content["book"]
+        chapter_summaries = "\n".join(chapter["chapter_summary"] for chapter in book["chapters"])
+        self._add_task(book_id, BOOK_CHUNKS, 0, self.split_text(chapter_summaries))
+
+    def _write(self, book_id: str):
+        job = self._books[book_id]
+
+        def write_book():
+            atomic_write_json(Path(job.output_dir, "summarized.json"), job.book_content)
+            Path(job.output_dir, PARTIAL_FILE).unlink(missing_ok=True)
+            with self._lock:
+                job.status = "summarized"
+            self._finish(book_id, job)
+
+        # Queued after the writes of all chapters, so it runs last.
+        job.writes.append(write_book)
+
+    def _finish(self, book_id: str, job: _BookJob):
+        try:
+            if self.on_finished is not None:
+                self.on_finished(book_id, job.output_dir, job.status)
+        finally:
+            job.done.set()
+
+    def _run_writes(self, job: _BookJob):
+        """Run the queued file writes of a book without holding the coordinator lock."""
+        with job.write_lock:
+            while job.writes:
+                job.writes.popleft()()
+
+    def _run_all_writes(self):
+        with self._lock:
+            jobs = [job for job in self._books.values() if job.writes]
+        for job in jobs:
+            self._run_writes(job)
+
+
+def create_coordinator_app(coordinator: SummarizationCoordinator) -> Flask:
+    """Create the HTTP API the workers use to lease tasks and post results.
+
+    Args:
+        coordinator (SummarizationCoordinator): the coordinator
+
+    Returns:
+        Flask: the app
+    """
+    app = Flask(__name__)
+
+    @app.route("/api/tasks/lease", methods=["POST"])
+    def lease_task():
+        task = coordinator.lease(request.get_json(force=True).get("worker", "unknown"))
+        if task is None:
+            return "", NO_CONTENT_STATUS
+        return jsonify(task)
+
+    @app.route("/api/tasks/<task_id>/renew", methods=["POST"])
+    def renew_task(task_id):
+        if not coordinator.renew(task_id, request.get_json(force=True).get("lease_id")):
+            return jsonify({"error": "Lease expired"}), CONFLICT_STATUS
+        return jsonify({"message": "Lease renewed"})
+
+    @app.route("/api/tasks/<task_id>/result", methods=["POST"])
+    def complete_task(task_id):
+        data = request.get_json(force=True)
+        if not coordinator.complete(task_id, data.get("lease_id"), data.get("summaries", [])):
+            return jsonify({"error": "Lease expired"}), CONFLICT_STATUS
+        return jsonify({"message": "Result stored"})
+
+    @app.route("/api/tasks/<task_id>/failure", methods=["POST"])
+    def fail_task(task_id):
+        data = request.get_json(force=True)
+        if not coordinator.fail(task_id, data.get("lease_id"), data.get("error", "")):
+            return jsonify({"error": "Lease expired"}), CONFLICT_STATUS
+        return jsonify({"message": "Task returned"})
+
+    @app.route("/api/status", methods=["GET"])
+    def get_status():
+        return jsonify(coordinator.status())
+
+    return app
+
+
+class SummarizationWorker:
+    """
+    Leases tasks from a coordinator, summarizes them and posts the summaries
+    back. The lease is renewed while a task is summarized.
+    """
+
+    def __init__(self, coordinator_url: str, summarizer, name: str = None, poll_seconds=2.0):
+        """
+        Create a worker.
+
+        Args:
+            coordinator_url (str): e.g. "http://127.0.0.1:5001"
+            summarizer (BookSummarizer): summarizes the chunks of the tasks
+            name (str, optional): name of the worker. Defaults to host name and a random suffix.
+            poll_seconds (float, optional): pause when no task is pending. Defaults to 2.
+        """
+        self.coordinator_url = coordinator_url.rstrip("/")
+        self.summarizer = summarizer
+        self.name = name or f"{socket.gethostname()}-{uuid.uuid4().hex[:6]}"
+        self.poll_seconds = poll_seconds
+        self.completed = 0
+        self._session = requests.Session()
+
+    def run(self, stop: threading.Event = None):
+        """Summarize tasks until stopped.
+
+        Args:
+            stop (threading.Event, optional): ends the loop once set.
+        """
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            try:
+                task = self._post("/api/tasks/lease", {"worker": self.name})
+            except requests.RequestException:
+                # The coordinator may not be up yet or restarting.
+                stop.wait(self.poll_seconds)
+                continue
+            if task is None:
+                stop.wait(self.poll_seconds)
+                continue
+            self.run_task(task)
+
+    def run_task(self, task: dict):
+        """Summarize one leased task and post the result.
+
+        Args:
+            task (dict): the task returned by the coordinator
+
+        Returns:
+            bool: True if the coordinator accepted the result
+        """
+        task_path = f"/api/tasks/{task['task_id']}"
+        done = threading.Event()
+
+        def renew_lease():
+            while not done.wait(task["lease_seconds"] / 3):
+                try:
+                    self._post(f"{task_path}/renew", {"lease_id": task["lease_id"]})
+                except requests.RequestException:
+                    pass
+
+        threading.Thread(target=renew_lease, daemon=True).start()
+        try:
+            summaries = [
+                self.summarizer.text_summarization(text, num_tokens)
+                for text, num_tokens in task["chunks"]
+            ]
+            result = ("result", {"lease_id": task["lease_id"], "summaries": summaries})
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            # Reported to the coordinator, which hands the task to another worker.
+            result = ("failure", {"lease_id": task["lease_id"], "error": str(e)})
+        finally:
+            done.set()
+        try:
+            self._post(f"{task_path}/{result[0]}", result[1])
+        except requests.RequestException:
+            # The lease expired and the task is handed to another worker.
+            return False
+        if result[0] == "failure":
+            return False
+        self.completed += 1
+        return True
+
+    def _post(self, path: str, data: dict):
+        response = self._session.post(self.coordinator_url + path, json=data, timeout=30)
+        response.raise_for_status()
+        if response.status_code == NO_CONTENT_STATUS:
+            return None
+        return response.json()
+
+
+def main():
+    """Run a coordinator or a worker."""
+    parser = argparse.ArgumentParser(description="Distributed book summarization")
+    subparsers = parser.add_subparsers(dest="role", required=True)
+    coordinator_parser = subparsers.add_parser("coordinator", help="hand out tasks")
+    coordinator_parser.add_argument(
+        "--input_files", type=str, nargs="+", help="input json/epub files"
+    )
+    coordinator_parser.add_argument("--host", type=str, default="127.0.0.1")
+    coordinator_parser.add_argument("--port", type=int, default=5001)
+    coordinator_parser.add_argument("--lease_seconds", type=float, default=300.0)
+    coordinator_parser.add_argument("--max_attempts", type=int, default=3)
+    coordinator_parser.add_argument(
+        "--data_dir",
+        type=str,
+        help="data directory of the server, whose catalog is updated for its books",
+        default="data",
+    )
+    coordinator_parser.add_argument(
+        "--chunk_tokens", type=int, help="target chunk size in tokens", default=None
+    )
+    coordinator_parser.add_argument(
+        "--chunk_overlap", type=int, help="tokens repeated from the previous chunk", default=0
+    )
+    worker_parser = subparsers.add_parser("worker", help="summarize tasks")
+    worker_parser.add_argument(
+        "--coordinator", type=str, help="coordinator URL", default="http://127.0.0.1:5001"
+    )
+    args = parser.parse_args()
+
+    if args.role == "worker":
+        # Only the workers load the model.
+        from book_summarizer import BookSummarizer  # pylint: disable=import-outside-toplevel
+
+        SummarizationWorker(args.coordinator, BookSummarizer()).run()
+        return
+    run_coordinator(args)
+
+
+def run_coordinator(args: argparse.Namespace):
+    """Summarize the input files with the workers that connect to the coordinator.
+
+    Args:
+        args (argparse.Namespace): the parsed coordinator arguments, see main
+    """
+    # pylint: disable=import-outside-toplevel
+    from transformers import AutoConfig, AutoTokenizer
+    from chunking import ChunkingStrategy
+
+    model_id = "pszemraj/led-large-book-summary"
+    data_dir = Path(args.data_dir)
+    # Books uploaded to the server are listed in the catalog of its data directory.
+    book_catalog = catalog.BookCatalog(data_dir) if data_dir.is_dir() else None
+
+    def in_catalog(output_dir: Path) -> bool:
+        return book_catalog is not None and output_dir.resolve().parent == data_dir.resolve()
+
+    def on_finished(_book_id: str, output_dir: Path, status: str):
+        # Written like BookSummarizer.summarize_book does, next to summarized.json.
+        if status == catalog.SUMMARIZED:
+            AutoConfig.from_pretrained(model_id).to_json_file(
+                output_dir / "summarized_config.json"
+            )
+        if in_catalog(output_dir):
+            book_catalog.set_status(output_dir.name, status)
+
+    # The coordinator only needs the tokenizer of the model to split the chapters.
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+    strategy = ChunkingStrategy(args.chunk_tokens, overlap_tokens=args.chunk_overlap)
+    coordinator = SummarizationCoordinator(
+        lambda text: strategy.split(
+            text, tokenizer.backend_tokenizer, tokenizer.model_max_length
+        ),
+        args.lease_seconds,
+        args.max_attempts,
+        on_finished,
+    )
+    for input_file in args.input_files:
+        output_dir = Path(input_file).parent
+        if in_catalog(output_dir):
+            book_catalog.set_status(output_dir.name, catalog.SUMMARIZING)
+        coordinator.add_book(input_file, util.parse_book(Path(input_file)), output_dir)
+    app = create_coordinator_app(coordinator)
+    threading.Thread(
+        target=app.run, kwargs={"host": args.host, "port": args.port}, daemon=True
+    ).start()
+    for input_file in args.input_files:
+        print(input_file, coordinator.wait(input_file))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,18 @@
 #! /usr/bin/env python3
 """Using Stable Diffusion to generate images from a prompt."""
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import keras_cv
+import numpy as np
 from PIL import Image
 
 import util
+from prompt_builder import PromptBuilder, clip_token_counter
+
+# Model does not support more than 77 tokens
+MAX_PROMPT_LENGTH = 77
 
 
 def to_safe_filename(string):
@@ -24,30 +30,44 @@ def to_safe_filename(string):
     return valid_filename[:file_name_max_length]
 
 
-def generate_image_from_text(model, output_dir, prepend_name, text, text_idx):
+def build_prompt(text, prompt_builder=None):
+    """Fit a text into the token window of the model.
+
+    Args:
+        text (string): the text for which an image is to be generated
+        prompt_builder (PromptBuilder, optional): selects the most salient phrases
+        of the text. If None, the text is cut off after MAX_PROMPT_LENGTH characters.
+
+    Returns:
+        string: the prompt
+    """
+    if prompt_builder is None:
+        return text[:MAX_PROMPT_LENGTH]
+    return prompt_builder.build(text)
+
+
+def generate_image_from_text(model, output_dir, prepend_name, prompt, text_idx):
     """Generating an image from a text segment using a diffusion model.
 
     Args:
         model (Model): the ml diffusion model used to generate the image
         output_dir (Path): where to save the generated image
         prepend_name (string): text to prepend filename with, e.g., prepend_name-X.png
-        text (string): the prompt for which an image is to be generated
+        prompt (string): the prompt of the text, see build_prompt
         text_idx (string): the index of the prompt within the level
     """
     print(output_dir, prepend_name, text_idx)
     output_dir.mkdir(parents=True, exist_ok=True)
 
-    print("Generating image for text:", text)
-    # Model does not support more than 77 tokens
-    max_length = 77
-    generated_images = model.text_to_image(text[:max_length], batch_size=1)
+    print("Generating image for prompt:", prompt)
+    generated_images = model.text_to_image(prompt, batch_size=1)
     diffusion_image = Image.fromarray(generated_images[0])
     file_name = output_dir / \
         f"{prepend_name}-{text_idx:04d}.png"
     diffusion_image.save(file_name)
 
 
-def iterate_level(model, output_dir, prepend_name, content_in_level):
+def iterate_level(model, output_dir, prepend_name, content_in_level, prompt_builder=None):
     """Iterate all the content of a level to create images for the texts.
 
     Args:
@@ -55,17 +75,111 @@ def iterate_level(model, output_dir, prepend_name, content_in_level):
         output_dir (string): where to write the resulting images
         prepend_name (string): text to prepend filename with, e.g., prepend_name-X.png
         content_in_level (List[string]): the content of the current level
+        prompt_builder (PromptBuilder, optional): fits the texts into the token window.
     """
     for idx, text in enumerate(content_in_level):
         if not to_safe_filename(text):
             continue
-        generate_image_from_text(model, output_dir, prepend_name, text, idx)
+        generate_image_from_text(
+            model, output_dir, prepend_name, build_prompt(text, prompt_builder), idx)
+
+
+def book_levels(summarized_book):
+    """List the levels of a book for which images are generated.
+
+    Args:
+        summarized_book (dict): the summarized book
+
+    Returns:
+        list: (prepend_name, content_in_level) tuples
+    """
+    levels = []
+    for chapter in summarized_book["chapters"]:
+        ch_num = int(chapter['num'])
+        levels += [
+            (f"chapter-{ch_num:03d}_paragraph", chapter["paragraphs"]),
+            (f"chapter-{ch_num:03d}_paragraph_summary", chapter["paragraph_summaries"]),
+            (f"chapter-{ch_num:03d}_chapter_summary", [chapter["chapter_summary"]]),
+        ]
+    levels.append(("book_summary", [summarized_book["book_summary"]]))
+    return levels
+
+
+def collect_prompts(summarized_book, output_dir, prompt_builder=None):
+    """Build the list of prompts whose images do not exist yet.
+
+    Identical prompts are generated only once and saved to all their files.
+
+    Args:
+        summarized_book (dict): the summarized book
+        output_dir (Path): where the images are written
+        prompt_builder (PromptBuilder, optional): fits the texts into the token window.
+
+    Returns:
+        list: (prompt, [file names]) tuples, in the order of the book
+    """
+    prompts = {}
+    for prepend_name, content_in_level in book_levels(summarized_book):
+        for idx, text in enumerate(content_in_level):
+            if not to_safe_filename(text):
+                continue
+            file_name = output_dir / f"{prepend_name}-{idx:04d}.png"
+            if file_name.exists():
+                continue
+            prompts.setdefault(build_prompt(text, prompt_builder), []).append(file_name)
+    return list(prompts.items())
+
+
+def save_image(image, file_names):
+    """Save a generated image to files, each written atomically.
+
+    An interrupted run therefore never leaves a partial image that would be
+    skipped when the run is resumed.
+
+    Args:
+        image (np.ndarray): the generated image
+        file_names (list): where to save the image
+    """
+    diffusion_image = Image.fromarray(image)
+    for file_name in file_names:
+        util.replace_file(
+            file_name, lambda tmp_file: diffusion_image.save(tmp_file, format="PNG")
+        )
+
+
+def generate_images_in_batches(model, prompts, batch_size, writer_threads=2):
+    """Generate images for prompts in batches while saving finished images in the background.
+
+    Args:
+        model (Model): the diffusion model used to generate the images
+        prompts (list): (prompt, [file names]) tuples, see collect_prompts
+        batch_size (int): number of images generated at once
+        writer_threads (int, optional): number of threads encoding and saving images.
+    """
+    with ThreadPoolExecutor(max_workers=writer_threads) as writer:
+        saved = []
+        for start in range(0, len(prompts), batch_size):
+            batch = prompts[start:start + batch_size]
+            print(f"Generating images {start + 1}-{start + len(batch)} of {len(prompts)}")
+            encoded_text = np.concatenate([model.encode_text(prompt) for prompt, _ in batch])
+            generated_images = model.generate_image(encoded_text, batch_size=len(batch))
+            saved += [
+                writer.submit(save_image, image, file_names)
+                for image, (_, file_names) in zip(generated_images, batch)
+            ]
+        # Raise errors that occurred while saving
+        for future in saved:
+            future.result()
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Book to images')
     parser.add_argument('--input_file', type=str, help='input json/epub file')
     parser.add_argument('--output_dir', type=str, help='output dir')
+    parser.add_argument('--batch_size', type=int, default=None,
+                        help='generate images in batches, skipping existing images')
+    parser.add_argument('--writer_threads', type=int, default=2,
+                        help='threads saving images in batch mode')
     args = parser.parse_args()
 
     target_dir = Path(args.output_dir)
@@ -77,16 +191,15 @@ if __name__ == '__main__':
     diffusion_model = keras_cv.models.StableDiffusion(
         img_width=512, img_height=512)
 
-    book_dir = Path(target_dir / to_safe_filename(book["title"]))
-    for chapter in book["chapters"]:
-        ch_num = int(chapter['num'])
+    builder = PromptBuilder(clip_token_counter(diffusion_model.tokenizer))
 
-        iterate_level(diffusion_model, book_dir,
-                      f"chapter-{ch_num:03d}_paragraph", chapter["paragraphs"])
-        iterate_level(diffusion_model, book_dir, f"chapter-{ch_num:03d}_paragraph_summary",
-                      chapter["paragraph_summaries"])
-        iterate_level(diffusion_model, book_dir, f"chapter-{ch_num:03d}_chapter_summary",
-                      [chapter["chapter_summary"]])
-
-    iterate_level(diffusion_model, book_dir,
-                  "book_summary", [book["book_summary"]])
+    book_dir = Path(target_dir / to_safe_filename(book["title"]))
+    if args.batch_size:
+        book_dir.mkdir(parents=True, exist_ok=True)
+        pending_prompts = collect_prompts(book, book_dir, builder)
+        print(f"{len(pending_prompts)} images to generate")
+        generate_images_in_batches(
+            diffusion_model, pending_prompts, args.batch_size, args.writer_threads)
+    else:
+        for level_name, level_content in book_levels(book):
+            iterate_level(diffusion_model, book_dir, level_name, level_content, builder)
@@ -0,0 +1,130 @@
+"""HTTP caching helpers for the files served by the backend."""
+
+import gzip
+from pathlib import Path
+
+from flask import request, send_file
+
+import util
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+# A versioned image is never rewritten, so clients may keep it for a year.
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+# Responses smaller than this are not worth compressing.
+COMPRESSION_MIN_SIZE = 1024
+EMPTY_IMAGE = "../frontend/static/EmptyImage.jpg"
+
+
+def _compressors():
+    """Get the supported content encodings in order of preference.
+
+    Returns:
+        dict: content encoding mapped to (file suffix, compression function)
+    """
+    encodings = {}
+    if brotli is not None:
+        encodings["br"] = (".br", brotli.compress)
+    encodings["gzip"] = (".gz", lambda data: gzip.compress(data, mtime=0))
+    return encodings
+
+
+def file_etag(path: Path, suffix: str = "") -> str:
+    """Create a validator for a file that changes whenever the file is rewritten.
+
+    Args:
+        path (Path): the file to create the etag for
+        suffix (str, optional): distinguishes different encodings of the same file.
+
+    Returns:
+        str: the etag (without quotes)
+    """
+    stat = path.stat()
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}{suffix}"
+
+
+def send_image(path: Path, mimetype: str = "image/png"):
+    """Send a versioned image that is immutable once written.
+
+    Falls back to the empty placeholder image, which must not be cached as
+    the requested version may be generated later.
+
+    Args:
+        path (Path): the versioned image file
+        mimetype (str, optional): mimetype of the image. Defaults to "image/png".
+
+    Returns:
+        Response: the image, or a 304 response if the client copy is current.
+    """
+    if not path.exists():
+        response = send_file(EMPTY_IMAGE, mimetype="image/png", etag=False)
+        response.cache_control.no_store = True
+        return response
+    response = send_file(path, mimetype=mimetype, max_age=IMMUTABLE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def precompressed_path(path: Path, suffix: str, compress) -> Path:
+    """Get a compressed copy of a file, creating it next to the file if it is stale.
+
+    Args:
+        path (Path): the file to compress
+        suffix (str): suffix appended to the file name for the compressed copy
+        compress (Callable[[bytes], bytes]): the compression function
+
+    Returns:
+        Path: the compressed copy of the file
+    """
+    compressed = path.with_name(path.name + suffix)
+    if (
+        compressed.exists()
+        and compressed.stat().st_mtime_ns >= path.stat().st_mtime_ns
+    ):
+        return compressed
+
+    data = compress(path.read_bytes())
+    # Concurrent requests never read a partially written copy.
+    util.replace_file(compressed, lambda tmp_file: tmp_file.write(data))
+    return compressed
+
+
+def send_json(path: Path):
+    """Send a JSON file with validators, compressing large files.
+
+    Compressed copies are cached on disk next to the file and recreated
+    whenever the file changes.
+
+    Args:
+        path (Path): the JSON file to send
+
+    Returns:
+        Response: the (compressed) JSON, or a 304 response if the client copy is current.
+    """
+    encoding = None
+    if path.stat().st_size >= COMPRESSION_MIN_SIZE:
+        for name in _compressors():
+            if request.accept_encodings[name]:
+                encoding = name
+                break
+
+    if encoding is None:
+        response = send_file(path, mimetype="application/json", etag=file_etag(path))
+    else:
+        suffix, compress = _compressors()[encoding]
+        response = send_file(
+            precompressed_path(path, suffix, compress),
+            mimetype="application/json",
+            download_name=path.name,
+            etag=file_etag(path, suffix),
+        )
+        if response.status_code != 304:
+            response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    # The content can change, so clients have to revalidate on every use.
+    response.cache_control.no_cache = True
+    return response
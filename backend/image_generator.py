@@ -18,7 +18,7 @@ def create_text_to_image_pipeline(model: str = "lykon/dreamshaper-8"):
         # bfloat16/float16 to speed-up 2-10x compared to float32
         dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
         pipe = AutoPipelineForText2Image.from_pretrained(
-            model, torch_dtype=dtype, use_safetensors=True
+            model, torch_dtype=dtype, use_safetensors=True, low_cpu_mem_usage=True
         )
         pipe = pipe.to("cuda")
 
@@ -54,7 +54,13 @@ def create_text_to_image_pipeline(model: str = "lykon/dreamshaper-8"):
         torch.backends.cuda.matmul.allow_tf32 = True
     else:
         pipe = AutoPipelineForText2Image.from_pretrained(
-            model, torch_dtype=torch.float32, variant="fp16", use_safetensors=True
+            model,
+            torch_dtype=torch.float32,
+            variant="fp16",
+            use_safetensors=True,
+            # Memory-map the safetensors files instead of first allocating
+            # randomly initialized weights, see model_residency.py.
+            low_cpu_mem_usage=True,
         )
 
     pipe.scheduler = DEISMultistepScheduler.from_config(pipe.scheduler.config)
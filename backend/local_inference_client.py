@@ -2,12 +2,22 @@
 from typing import Optional
 from concurrent.futures import ThreadPoolExecutor
 from image_generator import generate_image_from_text, create_text_to_image_pipeline
+from model_residency import ModelResidencyManager
 from PIL import Image
 
 class LocalInferenceClient:
     """Emulate huggingface_hub.InferenceClient executed locally"""
 
-    def __init__(self, model="lykon/dreamshaper-8"):
+    def __init__(self, model="lykon/dreamshaper-8", residency: ModelResidencyManager = None):
+        """
+        Args:
+            model (`str`, *optional*):
+                ID of a model hosted on the Hugging Face Hub.
+            residency (`ModelResidencyManager`, *optional*):
+                Loads the pipeline when an image is generated and may unload it while it is
+                idle. If None, the pipeline is loaded right away and stays loaded.
+        """
+        self.residency = residency
         self.set_model(model)
 
     def text_to_image(self, prompt: str, model: Optional[str] = None) -> Image:
@@ -27,6 +37,9 @@ class LocalInferenceClient:
         """
         if model and model != self.model:
             self.set_model(model)
+        if self.residency is not None:
+            with self.residency.use(self.model) as pipeline:
+                return generate_image_from_text(pipeline, prompt)
         pipeline = self.text_to_image_pipeline_future.result()
         return generate_image_from_text(pipeline, prompt)
 
@@ -36,6 +49,9 @@ class LocalInferenceClient:
             model (`str`): ID of a model hosted on the Hugging Face Hub.
         """
         self.model = model
+        if self.residency is not None:
+            self.residency.register(model, lambda: create_text_to_image_pipeline(model))
+            return
         with ThreadPoolExecutor(max_workers=1) as executor:
             self.text_to_image_pipeline_future = executor.submit(
                 create_text_to_image_pipeline, model
@@ -0,0 +1,268 @@
+"""Keep the models of the server within a memory budget.
+
+Models are registered with a function that loads them and are loaded when
+they are used first. If loading a model would exceed the budget, idle
+models are unloaded, least recently used first, and loaded again the next
+time they are used.
+"""
+
+import ctypes
+import ctypes.util
+import gc
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+PAGE_SIZE = resource.getpagesize()
+
+
+def module_bytes(model) -> int:
+    """Estimate the memory of the weights of a model.
+
+    Args:
+        model: a torch module, a diffusers pipeline with components or a
+        transformers pipeline with a model
+
+    Returns:
+        int: bytes of the parameters and buffers of all contained modules
+    """
+    modules = []
+    if hasattr(model, "parameters"):
+        modules.append(model)
+    elif hasattr(model, "components"):
+        modules.extend(part for part in model.components.values() if hasattr(part, "parameters"))
+    elif hasattr(model, "model"):
+        return module_bytes(model.model)
+    tensors = {}
+    for module in modules:
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            # Tied weights are shared between modules.
+            tensors[tensor.data_ptr()] = tensor.numel() * tensor.element_size()
+    return sum(tensors.values())
+
+
+def rss_bytes() -> int:
+    """Get the resident set size of the process.
+
+    Returns:
+        int: current resident bytes, 0 if unknown
+    """
+    try:
+        with open("/proc/self/statm", encoding="ascii") as statm:
+            return int(statm.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        return 0
+
+
+def peak_rss_bytes() -> int:
+    """Get the peak resident set size of the process.
+
+    Returns:
+        int: peak resident bytes
+    """
+    # Kilobytes on Linux, and may lag behind the current RSS.
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, rss_bytes())
+
+
+def release_free_memory():
+    """Return memory of unloaded models to the operating system."""
+    gc.collect()
+    # glibc keeps freed heap memory for reuse, so the RSS would not shrink.
+    libc_name = ctypes.util.find_library("c")
+    if libc_name:
+        libc = ctypes.CDLL(libc_name)
+        if hasattr(libc, "malloc_trim"):
+            libc.malloc_trim(0)
+
+
+class _ResidentModel:  # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    """A registered model and its statistics."""
+
+    def __init__(self, load: Callable, size: Callable):
+        self.load = load
+        self.size = size
+        self.model = None
+        self.loading = False
+        self.users = 0
+        self.resident_bytes = 0
+        # Measured after the first load, 0 until then
+        self.expected_bytes = 0
+        self.last_used = 0.0
+        self.loads = 0
+        self.evictions = 0
+        self.load_seconds = 0.0
+
+
+class ModelResidencyManager:
+    """
+    Loads registered models on demand and unloads idle models to keep the
+    weights of the loaded models within a memory budget.
+    """
+
+    def __init__(self, budget_bytes: int = None):
+        """
+        Create a manager without models.
+
+        Args:
+            budget_bytes (int, optional): memory for the weights of all loaded models.
+            A model that exceeds the budget on its own is still loaded once all other
+            models are unloaded. If None, models are never unloaded.
+        """
+        self.budget_bytes = budget_bytes
+        self._models = {}
+        # Models waiting for memory, idle models are not used again meanwhile.
+        self._waiting = set()
+        self._condition = threading.Condition()
+
+    def register(self, name: str, load: Callable, size: Callable = module_bytes):
+        """Register a model, it is loaded when it is used first.
+
+        Args:
+            name (str): name of the model
+            load (Callable): loads and returns the model
+            size (Callable, optional): estimates the bytes of a loaded model.
+            Defaults to module_bytes.
+        """
+        with self._condition:
+            if name not in self._models:
+                self._models[name] = _ResidentModel(load, size)
+
+    @contextmanager
+    def use(self, name: str):
+        """Use a model, which is not unloaded until the block is left.
+
+        Args:
+            name (str): name of a registered model
+
+        Yields:
+            the loaded model
+        """
+        entry = self._models[name]
+        with self._condition:
+            while True:
+                if entry.model is not None and not (entry.users == 0 and self._waiting):
+                    break
+                if entry.model is None and not entry.loading and self._make_room(name, entry):
+                    entry.loading = True
+                    break
+                if entry.model is None and not entry.loading:
+                    self._waiting.add(name)
+                self._condition.wait()
+            self._waiting.discard(name)
+            entry.users += 1
+            loading = entry.loading
+
+        if loading:
+            self._load(entry)
+        try:
+            yield entry.model
+        finally:
+            with self._condition:
+                entry.users -= 1
+                entry.last_used = time.monotonic()
+                self._condition.notify_all()
+
+    def unload(self, name: str) -> bool:
+        """Unload a model unless it is in use.
+
+        Args:
+            name (str): name of a registered model
+
+        Returns:
+            bool: True if the model is not loaded anymore
+        """
+        with self._condition:
+            entry = self._models[name]
+            if entry.users or entry.loading:
+                return False
+            self._evict(entry)
+        release_free_memory()
+        return True
+
+    def stats(self):
+        """Get the memory of the loaded models and the process.
+
+        Returns:
+            dict: budget, resident bytes of the models and the process, and per model
+            whether it is loaded, its resident bytes, users, loads and evictions
+        """
+        with self._condition:
+            return {
+                "budget_bytes": self.budget_bytes,
+                "resident_bytes": self._resident_bytes(),
+                "rss_bytes": rss_bytes(),
+                "peak_rss_bytes": peak_rss_bytes(),
+                "models": {
+                    name: {
+                        "loaded": entry.model is not None,
+                        "resident_bytes": entry.resident_bytes,
+                        "users": entry.users,
+                        "loads": entry.loads,
+                        "evictions": entry.evictions,
+                        "load_seconds": round(entry.load_seconds, 3),
+                    }
+                    for name, entry in self._models.items()
+                },
+            }
+
+    def _resident_bytes(self) -> int:
+        return sum(entry.resident_bytes for entry in self._models.values())
+
+    def _make_room(self, name: str, entry: _ResidentModel) -> bool:
+        """Unload idle models until the model fits into the budget, with the lock held.
+
+        Returns:
+            bool: True if the model can be loaded now
+        """
+        if self.budget_bytes is None:
+            return True
+        # A model that was never loaded may need the whole budget.
+        needed = entry.expected_bytes or self.budget_bytes
+        idle = sorted(
+            (
+                other
+                for other_name, other in self._models.items()
+                if other_name != name and other.model is not None and other.users == 0
+            ),
+            key=lambda other: other.last_used,
+        )
+        evicted = False
+        while self._resident_bytes() + needed > self.budget_bytes and idle:
+            self._evict(idle.pop(0))
+            evicted = True
+        if evicted:
+            release_free_memory()
+        busy = any(other.users or other.loading for other in self._models.values())
+        # Reserve the memory while the model is loaded.
+        if self._resident_bytes() + needed <= self.budget_bytes or not busy:
+            entry.resident_bytes = needed
+            return True
+        return False
+
+    def _evict(self, entry: _ResidentModel):
+        if entry.model is not None:
+            entry.model = None
+            entry.resident_bytes = 0
+            entry.evictions += 1
+
+    def _load(self, entry: _ResidentModel):
+        start = time.perf_counter()
+        try:
+            model = entry.load()
+        except BaseException:
+            with self._condition:
+                entry.loading = False
+                entry.users -= 1
+                entry.resident_bytes = 0
+                self._condition.notify_all()
+            raise
+        size = entry.size(model)
+        with self._condition:
+            entry.model = model
+            entry.resident_bytes = entry.expected_bytes = size
+            entry.loading = False
+            entry.loads += 1
+            entry.load_seconds = time.perf_counter() - start
+            self._condition.notify_all()
@@ -0,0 +1,308 @@
+"""Serve the data of neighbouring chapters at once and warm the files the reader requests next."""
+
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import thumbnails
+from book_state import PARTIAL_FILE, read_partial_book
+
+VERSION_PATTERN = re.compile(r"(?P<node>.+)-version-(?P<version>\d+)\.png")
+BOOK_NODE = "book_summary"
+
+
+def chapter_node(chapter: int) -> str:
+    """Get the image node of a chapter summary.
+
+    Args:
+        chapter (int): chapter number, starting at 1 like in the image routes
+
+    Returns:
+        str: the file name of the images without the version suffix
+    """
+    return f"chapter-{chapter:03d}_chapter_summary"
+
+
+def paragraph_summary_node(chapter: int, paragraph: int) -> str:
+    """Get the image node of a paragraph summary, see chapter_node."""
+    return f"chapter-{chapter:03d}_paragraph_summary-{paragraph:04d}"
+
+
+def paragraph_node(chapter: int, paragraph: int) -> str:
+    """Get the image node of a paragraph of the original text, see chapter_node."""
+    return f"chapter-{chapter:03d}_paragraph-{paragraph:04d}"
+
+
+def scan_versions(book_dir: Path) -> dict:
+    """Count the image versions of all nodes of a book with one directory listing.
+
+    Args:
+        book_dir (Path): the folder of the book
+
+    Returns:
+        dict: node mapped to its number of versions. Like the version routes,
+        versions are counted from 0 up to the first missing one.
+    """
+    versions = {}
+    try:
+        entries = os.scandir(book_dir)
+    except FileNotFoundError:
+        return {}
+    with entries:
+        for entry in entries:
+            match = VERSION_PATTERN.fullmatch(entry.name)
+            if match:
+                versions.setdefault(match["node"], set()).add(int(match["version"]))
+    counts = {}
+    for node, numbers in versions.items():
+        count = 0
+        while count in numbers:
+            count += 1
+        counts[node] = count
+    return counts
+
+
+def warm_files(paths):
+    """Ask the operating system to read files into the page cache.
+
+    Args:
+        paths (Iterable[Path]): the files, missing files are skipped
+
+    Returns:
+        int: number of files that were warmed
+    """
+    warmed = 0
+    for path in paths:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            continue
+        try:
+            if hasattr(os, "posix_fadvise"):
+                # Reads ahead in the background, without copying the data.
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+            else:
+                while os.read(fd, 1 << 20):
+                    pass
+            warmed += 1
+        finally:
+            os.close(fd)
+    return warmed
+
+
+class _BookFiles:  # pylint: disable=too-few-public-methods
+    """Cached contents of the folder of a book.
+
+    Each value is stored together with the modification time it was read
+    at, as one tuple, so concurrent requests never see a mismatched pair.
+    """
+
+    def __init__(self):
+        self.summaries = (None, None)
+        self.versions = (None, None)
+
+
+class BookFileIndex:
+    """
+    Keeps the parsed summaries and the image version counts of recently
+    read books in memory. Entries are reloaded whenever the summaries or
+    the folder of the book change on disk.
+    """
+
+    def __init__(self, data_dir: Path, cache_size: int = 16):
+        """
+        Create an empty index.
+
+        Args:
+            data_dir (Path): directory containing one folder per book
+            cache_size (int, optional): number of books kept in memory. Defaults to 16.
+        """
+        self.data_dir = data_dir
+        self.cache_size = cache_size
+        self._books = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entry(self, book_uuid: str) -> _BookFiles:
+        with self._lock:
+            entry = self._books.get(book_uuid)
+            if entry is None:
+                entry = self._books[book_uuid] = _BookFiles()
+            self._books.move_to_end(book_uuid)
+            while len(self._books) > self.cache_size:
+                self._books.popitem(last=False)
+            return entry
+
+    def summaries(self, book_uuid: str):
+        """Get the summarized book, or the chapters summarized so far.
+
+        Args:
+            book_uuid (str): UUID of the book
+
+        Returns:
+            dict: the book of summarized.json, or of the partial results while the
+            book is being summarized, see book_state.read_partial_book. None if the
+            book is neither summarized nor being summarized.
+        """
+        book_dir = self.data_dir / book_uuid
+        entry = self._entry(book_uuid)
+        for name in ("summarized.json", PARTIAL_FILE):
+            try:
+                # The file is part of the key, as the partial results are replaced
+                # by summarized.json once the book is summarized.
+                version = (name, (book_dir / name).stat().st_mtime_ns)
+                break
+            except FileNotFoundError:
+                continue
+        else:
+            return None
+        summaries, summaries_version = entry.summaries
+        if summaries_version != version:
+            if version[0] == PARTIAL_FILE:
+                book_content = read_partial_book(book_dir)
+                if book_content is None:
+                    return None
+                summaries = book_content["book"]
+            else:
+                with open(book_dir / version[0], encoding="utf-8") as json_file:
+                    summaries = json.load(json_file)["book"]
+            with self._lock:
+                entry.summaries = (summaries, version)
+        return summaries
+
+    def versions(self, book_uuid: str, node: str) -> int:
+        """Get the number of image versions of a node.
+
+        Args:
+            book_uuid (str): UUID of the book
+            node (str): the node, e.g., chapter_node(1)
+
+        Returns:
+            int: number of versions
+        """
+        book_dir = self.data_dir / book_uuid
+        entry = self._entry(book_uuid)
+        try:
+            # Adding an image changes the modification time of the folder.
+            mtime = book_dir.stat().st_mtime_ns
+        except FileNotFoundError:
+            return 0
+        versions, versions_mtime = entry.versions
+        if versions_mtime != mtime:
+            versions = scan_versions(book_dir)
+            with self._lock:
+                entry.versions = (versions, mtime)
+        return versions.get(node, 0)
+
+    def invalidate(self, book_uuid: str):
+        """Forget the cached files of a book, e.g., after an image was added.
+
+        Args:
+            book_uuid (str): UUID of the book
+        """
+        with self._lock:
+            self._books.pop(book_uuid, None)
+
+
+def image_files(book_dir: Path, node: str, versions: int, sizes=thumbnails.DEFAULT_SIZES):
+    """List the image versions of a node and their thumbnails.
+
+    Args:
+        book_dir (Path): the folder of the book
+        node (str): the node
+        versions (int): number of versions of the node
+        sizes (Iterable[int], optional): edge lengths of the thumbnails
+
+    Returns:
+        list: paths of the images and thumbnails, which may not exist
+    """
+    paths = []
+    for version in range(versions):
+        image = book_dir / f"{node}-version-{version}.png"
+        paths.append(image)
+        paths.extend(
+            thumbnails.thumbnail_path(image, size, image_format)
+            for size in sizes
+            for image_format in thumbnails.FORMATS
+        )
+    return paths
+
+
+def prefetch_chapters(  # pylint: disable=too-many-arguments,too-many-locals
+    index: BookFileIndex,
+    book_uuid: str,
+    chapter: int,
+    radius: int,
+    selected: dict,
+    *,
+    sizes=thumbnails.DEFAULT_SIZES,
+):
+    """Collect the summaries and images of a chapter and its neighbours.
+
+    Args:
+        index (BookFileIndex): the cached books
+        book_uuid (str): UUID of the book, which may still be summarized
+        chapter (int): chapter number, starting at 1 like in the image routes
+        radius (int): number of chapters before and after the chapter
+        selected (dict): the selected images of the book
+        sizes (Iterable[int], optional): edge lengths of the thumbnails
+
+    Returns:
+        tuple: the chapters for the response, and the image files of the chapters
+
+    Raises:
+        FileNotFoundError: if the book is neither summarized nor being summarized
+        ValueError: if the chapter does not exist
+    """
+    book = index.summaries(book_uuid)
+    if book is None:
+        raise FileNotFoundError(f"Book {book_uuid} is not summarized")
+    chapters = book["chapters"]
+    if not 1 <= chapter <= len(chapters):
+        raise ValueError(f"Chapter {chapter} does not exist")
+
+    book_dir = index.data_dir / book_uuid
+    result = []
+    files = []
+    for number in range(max(1, chapter - radius), min(len(chapters), chapter + radius) + 1):
+        content = chapters[number - 1]
+        nodes = {
+            "chapter_summary": chapter_node(number),
+            "paragraph_summaries": [
+                paragraph_summary_node(number, paragraph)
+                for paragraph in range(len(content.get("paragraph_summaries", [])))
+            ],
+            "paragraphs": [
+                paragraph_node(number, paragraph)
+                for paragraph in range(len(content["paragraphs"]))
+            ],
+        }
+        versions = {
+            "chapter_summary": index.versions(book_uuid, nodes["chapter_summary"]),
+            "paragraph_summaries": [
+                index.versions(book_uuid, node) for node in nodes["paragraph_summaries"]
+            ],
+            "paragraphs": [index.versions(book_uuid, node) for node in nodes["paragraphs"]],
+        }
+        files.extend(
+            image_files(book_dir, nodes["chapter_summary"], versions["chapter_summary"], sizes)
+        )
+        for level in ("paragraph_summaries", "paragraphs"):
+            for node, count in zip(nodes[level], versions[level]):
+                files.extend(image_files(book_dir, node, count, sizes))
+        selected_chapters = selected.get("chapters", [])
+        result.append(
+            {
+                "chapter": number,
+                "title": content.get("title"),
+                "chapter_summary": content.get("chapter_summary"),
+                "paragraph_summaries": content.get("paragraph_summaries", []),
+                "selected_images": (
+                    selected_chapters[number - 1] if number <= len(selected_chapters) else None
+                ),
+                "image_versions": versions,
+            }
+        )
+    return result, files
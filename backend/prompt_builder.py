@@ -0,0 +1,260 @@
+"""Fit texts into the token window of the CLIP text encoder of diffusion models."""
+
+import hashlib
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Callable
+
+# CLIP encodes at most 77 tokens including the start and end tokens.
+CLIP_MAX_TOKENS = 77
+SENTENCE_PATTERN = re.compile(r"[^.!?;:\n]+[.!?;:]*")
+CLAUSE_PATTERN = re.compile(r"[^,]+,?")
+WORD_PATTERN = re.compile(r"[A-Za-z][A-Za-z'-]*")
+# The frontend prefixes the text of a node with its style and characters,
+# followed by this marker, see ImageComponent.svelte.
+SCENE_MARKER = "The scene is:"
+STOP_WORDS = frozenset(
+    "a an and are as at be been but by for from had has have he her him his i if in "
+    "into is it its me my no not of on or our she so than that the their them then "
+    "there they this to too up was we were what when which who will with would you "
+    "your said very all out about just could one some".split()
+)
+
+
+def clip_token_counter(tokenizer) -> Callable[[str], int]:
+    """Create a function counting the tokens of a text including special tokens.
+
+    Args:
+        tokenizer: a Huggingface CLIPTokenizer, e.g., the tokenizer of a
+        diffusers pipeline, or a keras_cv SimpleTokenizer
+
+    Returns:
+        Callable[[str], int]: counts the tokens of a text
+    """
+    if hasattr(tokenizer, "model_max_length"):
+        return lambda text: len(tokenizer(text).input_ids)
+    return lambda text: len(tokenizer.encode(text))
+
+
+def pretrained_clip_token_counter(model_id: str) -> Callable[[str], int]:
+    """Create a token counter that loads the CLIP tokenizer of a diffusers model on first use.
+
+    Args:
+        model_id (str): Huggingface id of a Stable Diffusion model
+
+    Returns:
+        Callable[[str], int]: counts the tokens of a text
+    """
+    tokenizer = None
+    lock = threading.Lock()
+
+    def count_tokens(text: str) -> int:
+        nonlocal tokenizer
+        with lock:
+            if tokenizer is None:
+                from transformers import CLIPTokenizer  # pylint: disable=import-outside-toplevel
+
+                tokenizer = CLIPTokenizer.from_pretrained(model_id, subfolder="tokenizer")
+        return len(tokenizer(text).input_ids)
+
+    return count_tokens
+
+
+def text_hash(text: str) -> str:
+    """Hash a text to detect changes of a text node.
+
+    Args:
+        text (str): the text
+
+    Returns:
+        str: hex digest of the text
+    """
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class PromptBuilder:  # pylint: disable=too-few-public-methods
+    """
+    Builds prompts that fit the token window of the text encoder by keeping
+    the most salient sentences (or clauses) of a text instead of cutting it off.
+    The style and character prefix before SCENE_MARKER is kept verbatim, only
+    the scene is shortened.
+    """
+
+    def __init__(
+        self,
+        count_tokens: Callable[[str], int],
+        max_tokens: int = CLIP_MAX_TOKENS,
+        cache_size: int = 4096,
+    ):
+        """
+        Create a prompt builder.
+
+        Args:
+            count_tokens (Callable[[str], int]): counts the tokens of a text, see
+            clip_token_counter
+            max_tokens (int, optional): size of the token window. Defaults to 77.
+            cache_size (int, optional): number of built prompts kept in memory.
+        """
+        self.count_tokens = count_tokens
+        self.max_tokens = max_tokens
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def build(self, text: str) -> str:
+        """Build a prompt from a text that fits the token window.
+
+        Args:
+            text (str): the text, e.g., a summary
+
+        Returns:
+            str: the text itself if it fits, otherwise its prefix followed by the
+            most salient phrases of its scene
+        """
+        text = " ".join(text.split())
+        with self._lock:
+            if text in self._cache:
+                self._cache.move_to_end(text)
+                return self._cache[text]
+
+        if self.count_tokens(text) <= self.max_tokens:
+            prompt = text
+        else:
+            prefix, marker, scene = text.partition(SCENE_MARKER)
+            if not marker:
+                prefix, scene = "", text
+            prefix = (prefix + marker).strip()
+            scene = self._select(scene.strip(), prefix)
+            prompt = f"{prefix} {scene}".strip()
+
+        with self._lock:
+            self._cache[text] = prompt
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return prompt
+
+    def _fits(self, prefix: str, text: str) -> bool:
+        """Check whether the prefix followed by the text fits the token window."""
+        return self.count_tokens(f"{prefix} {text}".strip()) <= self.max_tokens
+
+    def _select(self, text: str, prefix: str = "") -> str:
+        phrases = self._phrases(text, prefix)
+        frequencies = Counter(
+            word.lower()
+            for word in WORD_PATTERN.findall(text)
+            if word.lower() not in STOP_WORDS
+        )
+
+        def salience(position_phrase):
+            position, phrase = position_phrase
+            words = [
+                word for word in WORD_PATTERN.findall(phrase) if word.lower() not in STOP_WORDS
+            ]
+            if not words:
+                return 0.0
+            # Frequent content words and names describe the scene best,
+            # earlier phrases usually introduce it.
+            score = sum(frequencies[word.lower()] + word[0].isupper() for word in words)
+            return score / len(words) ** 0.5 + 1.0 / (1 + position)
+
+        selected = []
+        for position, phrase in sorted(enumerate(phrases), key=salience, reverse=True):
+            candidate = sorted(selected + [(position, phrase)])
+            if self._fits(prefix, " ".join(p for _, p in candidate)):
+                selected = candidate
+
+        if selected:
+            return " ".join(phrase for _, phrase in selected)
+        return self._truncate(phrases[0] if phrases else text, prefix)
+
+    def _phrases(self, text: str, prefix: str = ""):
+        """Split a text into sentences, and sentences that are too long into clauses."""
+        phrases = []
+        for sentence in SENTENCE_PATTERN.findall(text):
+            sentence = sentence.strip()
+            if not sentence:
+                continue
+            if self._fits(prefix, sentence):
+                phrases.append(sentence)
+            else:
+                phrases += [
+                    clause.strip() for clause in CLAUSE_PATTERN.findall(sentence) if clause.strip()
+                ]
+        return phrases
+
+    def _truncate(self, text: str, prefix: str = "") -> str:
+        """Cut a text at the last whole word that fits the token window after the prefix."""
+        words = text.split()
+        low, high = 0, len(words)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self._fits(prefix, " ".join(words[:middle])):
+                low = middle
+            else:
+                high = middle - 1
+        return " ".join(words[:low])
+
+
+class NodePromptCache:
+    """
+    Stores the built prompt of each text node of a book in the book's
+    prompts.json, together with how many images were generated for the node.
+    """
+
+    def __init__(self, state_store, builder: PromptBuilder):
+        """
+        Create a prompt cache.
+
+        Args:
+            state_store (BookStateStore): stores the prompts.json of the books
+            builder (PromptBuilder): builds prompts for new or changed texts
+        """
+        self.state_store = state_store
+        self.builder = builder
+
+    def prompt(self, book_uuid: str, node: str, text: str) -> str:
+        """Get the prompt of a text node, building it if the text is new or changed.
+
+        Args:
+            book_uuid (str): UUID of the book
+            node (str): name of the text node, e.g., "chapter-001_chapter_summary"
+            text (str): the text of the node
+
+        Returns:
+            str: the built prompt
+        """
+        digest = text_hash(text)
+        entry = (self.state_store.read(book_uuid, "prompts") or {}).get(node)
+        if entry is not None and entry["text_hash"] == digest:
+            return entry["prompt"]
+        prompt = self.builder.build(text)
+
+        def store_prompt(prompts):
+            previous = prompts.get(node)
+            prompts[node] = {
+                "text_hash": digest,
+                "prompt": prompt,
+                "generations": previous["generations"] if previous else 0,
+            }
+            return prompts
+
+        self.state_store.update(book_uuid, "prompts", store_prompt, dict)
+        return prompt
+
+    def record_generation(self, book_uuid: str, node: str, prompt: str):
+        """Count an image generated for a text node, once the image is saved.
+
+        Args:
+            book_uuid (str): UUID of the book
+            node (str): name of the text node, see prompt
+            prompt (str): the prompt of the image. Only generations with the built
+            prompt of the node are counted, not those with prompts edited by hand.
+        """
+
+        def increment(prompts):
+            if node in prompts and prompts[node]["prompt"] == prompt:
+                prompts[node]["generations"] += 1
+            return prompts
+
+        self.state_store.update(book_uuid, "prompts", increment, dict)
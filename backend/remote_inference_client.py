@@ -0,0 +1,188 @@
+"""Generate images with the Huggingface inference API, like LocalInferenceClient does locally."""
+
+import io
+import logging
+import random
+import threading
+import time
+from typing import Callable, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from PIL import Image
+
+# Huggingface inference providers, the model ID is appended.
+API_URL = "https://router.huggingface.co/hf-inference/models/"
+# Rate limited, model loading or temporarily unavailable
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+logger = logging.getLogger(__name__)
+
+
+def is_unavailable(error: requests.RequestException) -> bool:
+    """Check whether a failed request means that the API is unavailable.
+
+    Args:
+        error (requests.RequestException): the error of the last attempt
+
+    Returns:
+        bool: True for connection errors, timeouts and retryable statuses, False
+        if the API rejected the request itself, e.g., with 400, 401, 403 or 404
+    """
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    response = getattr(error, "response", None)
+    return response is not None and response.status_code in RETRY_STATUSES
+
+
+class RemoteInferenceClient:  # pylint: disable=too-many-instance-attributes
+    """
+    Calls the inference API over a pooled HTTP session with at most
+    max_in_flight requests at once. Rate limited and failed requests are
+    retried with exponential backoff, and if the API stays unavailable the
+    image is generated by a local fallback client instead.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        token: str = None,
+        model: str = "lykon/dreamshaper-8",
+        *,
+        api_url: str = API_URL,
+        max_in_flight: int = 4,
+        max_retries: int = 3,
+        backoff_seconds: float = 1.0,
+        max_backoff_seconds: float = 30.0,
+        timeout: float = 120.0,
+        fallback: Callable = None,
+    ):
+        """
+        Create a client.
+
+        Args:
+            token (str, optional): Huggingface access token.
+            model (str, optional): ID of the model used if text_to_image is called without one.
+            api_url (str, optional): URL the model ID is appended to. Defaults to the
+            Huggingface inference API.
+            max_in_flight (int, optional): maximal number of concurrent requests, which
+            is also the size of the connection pool. Defaults to 4.
+            max_retries (int, optional): retries of a failed request. Defaults to 3.
+            backoff_seconds (float, optional): delay before the first retry, doubled
+            for every further retry. Defaults to 1.
+            max_backoff_seconds (float, optional): maximal delay between retries. Defaults to 30.
+            timeout (float, optional): seconds to wait for a response. Defaults to 120.
+            fallback (Callable, optional): creates a client with the same interface,
+            e.g., LocalInferenceClient, used if the API stays unavailable. It is
+            created when it is needed first. If None, the error is raised.
+        """
+        self.model = model
+        self.api_url = api_url
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.timeout = timeout
+        self._stats = {"requests": 0, "retries": 0, "failovers": 0}
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight, pool_block=True)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        if token:
+            self._session.headers["Authorization"] = f"Bearer {token}"
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+        self._fallback_factory = fallback
+        self._fallback = None
+        self._lock = threading.Lock()
+        self._fallback_lock = threading.Lock()
+
+    def text_to_image(self, prompt: str, model: Optional[str] = None) -> Image:
+        """
+        Generate an image based on a given text using a specified model.
+
+        Args:
+            prompt (str): The prompt to generate an image from.
+            model (str, optional): The model to use for inference. Overrides the
+            model defined at the instance level. Defaults to None.
+
+        Returns:
+            Image: The generated image.
+
+        Raises:
+            requests.HTTPError: if the API rejects the request, e.g., because of an
+            invalid token. Such errors do not fail over to the local client.
+        """
+        model = model or self.model
+        try:
+            return self._request_image(prompt, model)
+        except requests.RequestException as e:
+            if self._fallback_factory is None or not is_unavailable(e):
+                raise
+            logger.warning("Inference API failed, generating the image locally: %s", e)
+            with self._lock:
+                self._stats["failovers"] += 1
+            # Loading the local pipeline takes a while, only the first failover waits for it.
+            with self._fallback_lock:
+                if self._fallback is None:
+                    self._fallback = self._fallback_factory(model)
+            return self._fallback.text_to_image(prompt, model=model)
+
+    def stats(self):
+        """Get the counters of the client.
+
+        Returns:
+            dict: number of requests, retries and failovers to the local client
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    def set_model(self, model: str):
+        """Set the Hugging Face Hub model to use for inference.
+
+        Args:
+            model (str): ID of a model hosted on the Hugging Face Hub.
+        """
+        self.model = model
+
+    def _request_image(self, prompt: str, model: str) -> Image:
+        attempt = 0
+        while True:
+            with self._in_flight:
+                with self._lock:
+                    self._stats["requests"] += 1
+                try:
+                    response = self._session.post(
+                        self.api_url + model, json={"inputs": prompt}, timeout=self.timeout
+                    )
+                except (requests.ConnectionError, requests.Timeout):
+                    if attempt >= self.max_retries:
+                        raise
+                    response = None
+            if response is not None:
+                if response.ok:
+                    return Image.open(io.BytesIO(response.content))
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    response.raise_for_status()
+
+            # Wait outside of the semaphore, so other requests can use the slot.
+            time.sleep(self._retry_delay(response, attempt))
+            attempt += 1
+            with self._lock:
+                self._stats["retries"] += 1
+
+    def _retry_delay(self, response, attempt: int) -> float:
+        """Get the delay before the next attempt, as requested by the API if it says so."""
+        delay = None
+        if response is not None:
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                delay = float(retry_after)
+            elif response.status_code == 503:
+                # The API estimates how long it takes to load the model.
+                try:
+                    delay = float(response.json().get("estimated_time"))
+                except (ValueError, TypeError, AttributeError):
+                    pass
+        if delay is None:
+            # Jitter keeps a burst of requests from retrying all at once.
+            delay = self.backoff_seconds * 2**attempt * random.uniform(0.5, 1.0)
+        return min(delay, self.max_backoff_seconds)
@@ -0,0 +1,378 @@
+"""Keyword and semantic search over the text and summaries of a book."""
+
+import json
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+import util
+
+INDEX_FILE = "search_index.json"
+EMBEDDINGS_FILE = "search_embeddings.npy"
+TOKEN_PATTERN = re.compile(r"\w+")
+STOP_WORDS = frozenset(
+    "a an and are as at be but by for from had has have he her his i in is it "
+    "its of on or she that the their they this to was were which with you".split()
+)
+# BM25 parameters, see https://en.wikipedia.org/wiki/Okapi_BM25
+BM25_K1 = 1.2
+BM25_B = 0.75
+SNIPPET_LENGTH = 200
+
+
+def tokenize(text: str):
+    """Split a text into lower case terms without stop words.
+
+    Args:
+        text (str): the text to tokenize
+
+    Returns:
+        list: the terms of the text
+    """
+    return [
+        token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOP_WORDS
+    ]
+
+
+def book_nodes(book: dict):
+    """List all searchable text nodes of a summarized book.
+
+    Args:
+        book (dict): the "book" object of summarized.json
+
+    Returns:
+        list: dicts with level, chapter and paragraph index, and text of the nodes
+    """
+    nodes = []
+    for ch_num, chapter in enumerate(book["chapters"]):
+        for level, key in (
+            ("paragraph", "paragraphs"),
+            ("paragraph_summary", "paragraph_summaries"),
+        ):
+            for paragraph, text in enumerate(chapter.get(key, [])):
+                nodes.append(
+                    {"level": level, "chapter": ch_num, "paragraph": paragraph, "text": text}
+                )
+        if "chapter_summary" in chapter:
+            nodes.append(
+                {
+                    "level": "chapter_summary",
+                    "chapter": ch_num,
+                    "paragraph": None,
+                    "text": chapter["chapter_summary"],
+                }
+            )
+    if "book_summary" in book:
+        nodes.append(
+            {
+                "level": "book_summary",
+                "chapter": None,
+                "paragraph": None,
+                "text": book["book_summary"],
+            }
+        )
+    return nodes
+
+
+class BookSearchIndex:
+    """
+    Inverted index with BM25 ranking over the text nodes of one book, and an
+    optional matrix of normalized node embeddings for semantic search.
+    """
+
+    def __init__(self, nodes: list, postings: dict, embeddings: np.ndarray = None):
+        """
+        Create a search index.
+
+        Args:
+            nodes (list): the text nodes, see book_nodes
+            postings (dict): term mapped to a list of [node id, term frequency]
+            embeddings (np.ndarray, optional): normalized embedding per node.
+        """
+        self.nodes = nodes
+        self.postings = postings
+        self.embeddings = embeddings
+        self.node_lengths = np.array([node["length"] for node in nodes], dtype=np.float32)
+        self.average_length = float(self.node_lengths.mean()) if nodes else 0.0
+
+    @classmethod
+    def build(cls, book: dict, embed=None):
+        """Index a summarized book.
+
+        Args:
+            book (dict): the "book" object of summarized.json
+            embed (Callable[[list], np.ndarray], optional): embeds a list of texts.
+            If None, only keyword search is available.
+
+        Returns:
+            BookSearchIndex: the index
+        """
+        nodes = book_nodes(book)
+        postings = {}
+        for node_id, node in enumerate(nodes):
+            terms = tokenize(node["text"])
+            node["length"] = len(terms)
+            for term, frequency in Counter(terms).items():
+                postings.setdefault(term, []).append([node_id, frequency])
+
+        embeddings = None
+        if embed is not None and nodes:
+            embeddings = embed([node["text"] for node in nodes])
+        return cls(nodes, postings, embeddings)
+
+    def save(self, book_dir: Path):
+        """Save the index to the folder of the book.
+
+        Args:
+            book_dir (Path): the folder of the book
+        """
+        # Both files are replaced atomically, as they may be read while the
+        # index is rebuilt. A loaded memory map keeps the replaced file.
+        if self.embeddings is not None:
+            util.replace_file(book_dir / EMBEDDINGS_FILE, lambda f: np.save(f, self.embeddings))
+        data = json.dumps({"nodes": self.nodes, "postings": self.postings}).encode("utf-8")
+        util.replace_file(book_dir / INDEX_FILE, lambda f: f.write(data))
+
+    @classmethod
+    def load(cls, book_dir: Path):
+        """Load the index from the folder of a book.
+
+        Args:
+            book_dir (Path): the folder of the book
+
+        Returns:
+            BookSearchIndex: the index
+        """
+        with open(book_dir / INDEX_FILE, encoding="utf-8") as f:
+            data = json.load(f)
+        embeddings = None
+        if (book_dir / EMBEDDINGS_FILE).exists():
+            embeddings = np.load(book_dir / EMBEDDINGS_FILE, mmap_mode="r")
+        return cls(data["nodes"], data["postings"], embeddings)
+
+    def keyword_search(self, query: str, limit: int = 20):
+        """Rank the nodes containing the query terms with BM25.
+
+        Args:
+            query (str): the search query
+            limit (int, optional): maximal number of results. Defaults to 20.
+
+        Returns:
+            list: (node id, score) tuples, best match first
+        """
+        scores = np.zeros(len(self.nodes), dtype=np.float32)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            node_ids, frequencies = np.array(postings, dtype=np.float32).T
+            node_ids = node_ids.astype(np.int64)
+            idf = math.log(1 + (len(self.nodes) - len(postings) + 0.5) / (len(postings) + 0.5))
+            # Avoid dividing by zero in books whose nodes are all empty.
+            length_norm = 1 - BM25_B + BM25_B * self.node_lengths[node_ids] / max(
+                self.average_length, 1.0
+            )
+            scores[node_ids] += idf * frequencies * (BM25_K1 + 1) / (
+                frequencies + BM25_K1 * length_norm
+            )
+        return self._top(scores, limit, minimum=0.0)
+
+    def semantic_search(self, query_embedding: np.ndarray, limit: int = 20):
+        """Rank all nodes by cosine similarity to the query.
+
+        Args:
+            query_embedding (np.ndarray): normalized embedding of the query
+            limit (int, optional): maximal number of results. Defaults to 20.
+
+        Returns:
+            list: (node id, score) tuples, best match first
+        """
+        if self.embeddings is None:
+            raise ValueError("Semantic search is not available for this book")
+        return self._top(self.embeddings @ query_embedding, limit)
+
+    @staticmethod
+    def _top(scores: np.ndarray, limit: int, minimum: float = None):
+        limit = min(limit, len(scores))
+        if limit <= 0:
+            return []
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top])]
+        return [
+            (int(node_id), float(scores[node_id]))
+            for node_id in top
+            if minimum is None or scores[node_id] > minimum
+        ]
+
+
+class TransformerEmbedder:  # pylint: disable=too-few-public-methods
+    """Embed texts with a sentence transformer model using mean pooling."""
+
+    def __init__(self, model_id="sentence-transformers/all-MiniLM-L6-v2", batch_size=32):
+        """
+        Lazily load a sentence embedding model.
+
+        Args:
+            model_id (string): Huggingface model id
+            batch_size (int, optional): number of texts embedded at once. Defaults to 32.
+        """
+        self.model_id = model_id
+        self.batch_size = batch_size
+        self._model = None
+        self._tokenizer = None
+        self._lock = threading.Lock()
+
+    def __call__(self, texts: list) -> np.ndarray:
+        """Embed texts.
+
+        Args:
+            texts (list): the texts to embed
+
+        Returns:
+            np.ndarray: one normalized float32 embedding per row
+        """
+        # pylint: disable=import-outside-toplevel
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        with self._lock:
+            if self._model is None:
+                self._tokenizer = AutoTokenizer.from_pretrained(self.model_id)
+                self._model = AutoModel.from_pretrained(self.model_id).eval()
+
+            batches = []
+            for start in range(0, len(texts), self.batch_size):
+                encoded = self._tokenizer(
+                    texts[start : start + self.batch_size],
+                    padding=True,
+                    truncation=True,
+                    return_tensors="pt",
+                )
+                with torch.no_grad():
+                    hidden = self._model(**encoded).last_hidden_state
+                mask = encoded["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+                batches.append(((hidden * mask).sum(1) / mask.sum(1)).numpy())
+
+        embeddings = np.concatenate(batches).astype(np.float32)
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-12
+        return embeddings
+
+
+class SearchService:
+    """
+    Builds the search indices of books and keeps the most recently used ones
+    in memory.
+    """
+
+    def __init__(self, data_dir: Path, embed=None, cache_size: int = 32):
+        """
+        Create a search service for the books in a data directory.
+
+        Args:
+            data_dir (Path): directory containing one folder per book
+            embed (Callable[[list], np.ndarray], optional): embeds a list of texts.
+            If None, only keyword search is available.
+            cache_size (int, optional): number of indices kept in memory. Defaults to 32.
+        """
+        self.data_dir = data_dir
+        self.embed = embed
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def build_index(self, book_uuid: str):
+        """Build and save the search index of a summarized book.
+
+        Args:
+            book_uuid (str): UUID of the book
+
+        Returns:
+            BookSearchIndex: the index
+        """
+        book_dir = self.data_dir / book_uuid
+        # Taken before reading, so a book replaced meanwhile is indexed again.
+        modified = (book_dir / "summarized.json").stat().st_mtime_ns
+        with open(book_dir / "summarized.json", encoding="utf8") as json_file:
+            book = json.load(json_file)["book"]
+        index = BookSearchIndex.build(book, self.embed)
+        index.save(book_dir)
+        self._remember(book_uuid, index, modified)
+        return index
+
+    def index(self, book_uuid: str) -> BookSearchIndex:
+        """Get the search index of a book, loading or building it if necessary.
+
+        Args:
+            book_uuid (str): UUID of the book
+
+        Returns:
+            BookSearchIndex: the index
+        """
+        book_dir = self.data_dir / book_uuid
+        summarized = book_dir / "summarized.json"
+        index_file = book_dir / INDEX_FILE
+        if not summarized.exists():
+            raise FileNotFoundError(f"Book {book_uuid} is not summarized")
+        modified = summarized.stat().st_mtime_ns
+
+        with self._lock:
+            cached = self._cache.get(book_uuid)
+            # An index of an older summarized.json, e.g., of a book summarized again, is stale.
+            if cached is not None and cached[0] == modified:
+                self._cache.move_to_end(book_uuid)
+                return cached[1]
+
+        if index_file.exists() and index_file.stat().st_mtime_ns >= modified:
+            index = BookSearchIndex.load(book_dir)
+            # Indices built before semantic search was enabled lack embeddings.
+            if self.embed is None or index.embeddings is not None:
+                self._remember(book_uuid, index, modified)
+                return index
+        return self.build_index(book_uuid)
+
+    def search(self, book_uuid: str, query: str, mode: str = "keyword", limit: int = 20):
+        """Search the text and summaries of a book.
+
+        Args:
+            book_uuid (str): UUID of the book
+            query (str): the search query
+            mode (str, optional): "keyword" or "semantic". Defaults to "keyword".
+            limit (int, optional): maximal number of results. Defaults to 20.
+
+        Returns:
+            list: the matching nodes with level, chapter, paragraph, score and text snippet
+        """
+        index = self.index(book_uuid)
+        if mode == "keyword":
+            matches = index.keyword_search(query, limit)
+        elif mode == "semantic":
+            if self.embed is None:
+                raise ValueError("Semantic search is not enabled")
+            matches = index.semantic_search(self.embed([query])[0], limit)
+        else:
+            raise ValueError(f"Unknown search mode: {mode}")
+
+        results = []
+        for node_id, score in matches:
+            node = index.nodes[node_id]
+            results.append(
+                {
+                    "level": node["level"],
+                    "chapter": node["chapter"],
+                    "paragraph": node["paragraph"],
+                    "score": score,
+                    "text": node["text"][:SNIPPET_LENGTH],
+                }
+            )
+        return results
+
+    def _remember(self, book_uuid: str, index: BookSearchIndex, modified: int):
+        with self._lock:
+            self._cache[book_uuid] = (modified, index)
+            self._cache.move_to_end(book_uuid)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
@@ -1,21 +1,38 @@
 """Server interface for the latent retrieval demo."""
 
 import json
+import functools
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from flask import Flask, jsonify, send_file, request
+from flask import Flask, jsonify, request
 from ebooklib import epub
 from local_inference_client import LocalInferenceClient
-from huggingface_hub import InferenceClient
+import remote_inference_client
+from remote_inference_client import RemoteInferenceClient
 from flask_cors import CORS
-from book_summarizer import BookSummarizer
+from book_summarizer import BookSummarizer, PipelineOptions
+from model_residency import ModelResidencyManager, peak_rss_bytes, rss_bytes
+from chunking import ChunkingStrategy
+from summarization_scheduler import SummarizationScheduler
+import http_cache
+from book_state import BookStateStore, PARTIAL_FILE, read_partial_book
+import catalog
+import prefetch
+import search
+import util
+from prompt_builder import NodePromptCache, PromptBuilder, pretrained_clip_token_counter
+import thumbnails
 
-summarizer = BookSummarizer()
 book_summary_progress = 0 # pylint: disable=invalid-name
+# Summarization progress in percent per book that is being summarized
+book_progress = {}
 
 app = Flask(__name__)
 app.config.from_pyfile('.flaskenv')
-CORS(app)
+# The frontend may page through the books with the total from get_books.
+CORS(app, expose_headers=["X-Total-Count"])
 OK_STATUS = 200
 ERROR_STATUS = 400
 TEXT_TYPE = {"ContentType": "text/plain"}
@@ -23,15 +40,80 @@ JSON_TYPE = {"ContentType": "application/json"}
 DATA_DIR = Path("data")
 UPLOAD_FOLDER = Path("data")
 ALLOWED_EXTENSIONS = {".epub"}
+state_store = BookStateStore(DATA_DIR)
+book_catalog = catalog.BookCatalog(DATA_DIR)
+# Serializes the duplicate check and registration of uploads. Uploads that
+# are not in the catalog yet are tracked by the digest of their file.
+upload_lock = threading.Lock()
+pending_uploads = {}
+MAX_PAGE_SIZE = 1000
+
+# With a memory budget, the summarization and image models are loaded when
+# they are used and the idle one is unloaded if both do not fit together.
+MODEL_MEMORY_BUDGET_MB = app.config.get("MODEL_MEMORY_BUDGET_MB")
+model_residency = (
+    ModelResidencyManager(MODEL_MEMORY_BUDGET_MB * 1024 * 1024)
+    if MODEL_MEMORY_BUDGET_MB else None
+)
+# Shorter chunks are summarized faster, as the attention cost of the model
+# grows with the chunk length. See benchmark_chunking.py.
+summarizer = BookSummarizer(
+    options=PipelineOptions(
+        ChunkingStrategy(
+            max_tokens=app.config.get("CHUNK_TOKENS"),
+            overlap_tokens=app.config.get("CHUNK_OVERLAP", 0),
+        )
+    ),
+    residency=model_residency,
+)
+
+IMAGE_MODEL = "lykon/dreamshaper-8"
 
 # Create text to image pipeline asynchronously as it can take some time to create
 # and we do not want to do it each image generation call.
 # Use ThreadPoolExecutor for creating the object because asyncio is difficult to use
 # as flask runs its own event loop.
 if "HUGGINGFACE_TOKEN" in app.config:
-    inference_client = InferenceClient(token=app.config["HUGGINGFACE_TOKEN"])
+    # Requests to the inference API share pooled connections, are limited
+    # in number and fall back to the local pipeline if the API is unavailable.
+    inference_client = RemoteInferenceClient(
+        token=app.config["HUGGINGFACE_TOKEN"],
+        model=IMAGE_MODEL,
+        api_url=app.config.get("INFERENCE_API_URL", remote_inference_client.API_URL),
+        max_in_flight=app.config.get("INFERENCE_MAX_IN_FLIGHT", 4),
+        max_retries=app.config.get("INFERENCE_MAX_RETRIES", 3),
+        fallback=functools.partial(LocalInferenceClient, residency=model_residency),
+    )
 else:
-    inference_client = LocalInferenceClient()
+    inference_client = LocalInferenceClient(IMAGE_MODEL, residency=model_residency)
+
+# All uploads share the loaded summarization model through the scheduler,
+# which interleaves the chunks of concurrently summarized books.
+scheduler = SummarizationScheduler(
+    summarizer, batch_size=app.config.get("SUMMARIZATION_BATCH_SIZE", 4))
+
+# Prompts are fitted to the token window of the CLIP text encoder of the
+# image model and cached per text node.
+prompt_cache = NodePromptCache(
+    state_store, PromptBuilder(pretrained_clip_token_counter(IMAGE_MODEL)))
+
+# Thumbnails are created in the background so that image generation
+# requests return as soon as the full size image is saved.
+THUMBNAIL_SIZES = app.config.get("THUMBNAIL_SIZES", thumbnails.DEFAULT_SIZES)
+thumbnail_executor = ThreadPoolExecutor(max_workers=1)
+
+# Semantic search needs an additional embedding model, so it is opt-in.
+search_service = search.SearchService(
+    DATA_DIR,
+    search.TransformerEmbedder() if app.config.get("SEMANTIC_SEARCH") else None,
+)
+index_executor = ThreadPoolExecutor(max_workers=1)
+
+# Summaries and image version counts of recently read books are kept in
+# memory, and the images of prefetched chapters are read ahead in the background.
+book_files = prefetch.BookFileIndex(DATA_DIR)
+prefetch_executor = ThreadPoolExecutor(max_workers=1)
+MAX_PREFETCH_RADIUS = 3
 
 
 def allowed_file(filename: str):
@@ -46,17 +128,50 @@ def allowed_file(filename: str):
     return Path(filename).suffix in ALLOWED_EXTENSIONS
 
 
-@app.route("/api/image", methods=["POST"])
-async def generate_image():
-    """Generate an image on the server based on client input.
+def send_version_image(filename: Path):
+    """Send a version of an image, or its thumbnail if the request has a size parameter.
+
+    Args:
+        filename (Path): the full size image
 
     Returns:
-        Response: Status of the image generation.
+        Response: the image or its thumbnail.
+    """
+    size = request.args.get("size", type=int)
+    if size is None or not filename.exists():
+        return http_cache.send_image(filename)
+
+    image_format = "webp" if request.accept_mimetypes["image/webp"] else "jpeg"
+    thumbnail = thumbnails.select_thumbnail(
+        filename, size, THUMBNAIL_SIZES, image_format)
+    if thumbnail is None:
+        return http_cache.send_image(filename)
+    response = http_cache.send_image(
+        thumbnail, mimetype=thumbnails.FORMATS[image_format][1])
+    response.vary.add("Accept")
+    return response
+
+
+def prepare_image(data: dict):
+    """Choose the file of the next image version of a text node and build its prompt.
+
+    Args:
+        data (dict): the request body with the "src" URL of the node's images,
+        the "prompt" text of the node and whether the user edited the prompt
+        by hand ("userModified")
+
+    Returns:
+        tuple: (file name, prompt), or None if the URL is not the images of a text node
+
+    Raises:
+        ValueError: if the src URL or the prompt is invalid
     """
-    data = request.get_json()
     src = data.get("src")
+    text = data.get("prompt")
+    if not isinstance(src, str) or not isinstance(text, str):
+        raise ValueError("src and prompt must be strings")
+    parts = src.split("/")
     try:
-        parts = src.split("/")
         book = parts[3]
         filename = None
 
@@ -82,100 +197,277 @@ async def generate_image():
                 / book
                 / f"chapter-{chapter:03d}_paragraph-{paragraph:04d}-version-.png"
             )
+    except IndexError as e:
+        raise ValueError(f"Invalid image URL: {src}") from e
 
-        if filename is None:
-            return jsonify({"error": "Unknown route type"}), ERROR_STATUS
+    if filename is None:
+        return None
 
-        counter = 0
-        text = data.get("prompt")
-        basefilename = filename
+    counter = 0
+    basefilename = filename
+    filename = basefilename.with_stem(f"{basefilename.stem}{counter}")
+    while filename.exists():
+        # If the file exists, generate a new filename with an incrementing counter
+        counter += 1
         filename = basefilename.with_stem(f"{basefilename.stem}{counter}")
-        while filename.exists():
-            # If the file exists, generate a new filename with an incrementing counter
-            counter += 1
-            filename = basefilename.with_stem(f"{basefilename.stem}{counter}")
-        output_path = str(filename)
-
-        image = inference_client.text_to_image(
-            text, model="lykon/dreamshaper-8")
-        image.save(output_path)
+
+    if data.get("userModified"):
+        # Prompts edited by hand are used as they are.
+        prompt = text
+    else:
+        prompt = prompt_cache.prompt(
+            book, basefilename.stem.removesuffix("-version-"), text)
+    return filename, prompt
+
+
+def render_image(filename: Path, prompt: str):
+    """Generate an image with the image model and save it.
+
+    Args:
+        filename (Path): the file of the image version, see prepare_image
+        prompt (str): the prompt
+    """
+    image = inference_client.text_to_image(prompt, model=IMAGE_MODEL)
+    image.save(str(filename))
+    # Failed generations are not counted.
+    prompt_cache.record_generation(
+        filename.parent.name, filename.stem.rsplit("-version-", 1)[0], prompt)
+    book_files.invalidate(filename.parent.name)
+    thumbnail_executor.submit(
+        thumbnails.create_thumbnails, filename, THUMBNAIL_SIZES)
+
+
+@app.route("/api/image", methods=["POST"])
+async def generate_image():
+    """Generate an image on the server based on client input.
+
+    Returns:
+        Response: Status of the image generation.
+    """
+    try:
+        target = prepare_image(request.get_json())
+        if target is None:
+            return jsonify({"error": "Unknown route type"}), ERROR_STATUS
+        render_image(*target)
         return jsonify({"message": "Image successfully generated"}), OK_STATUS
 
     except (FileNotFoundError, ValueError) as e:
         return jsonify({"error": f"Error generating image: {str(e)}"}), ERROR_STATUS
 
 
-@app.route("/api/book", methods=["POST"])
-async def upload_book():
-    """Upload a book in EPUB format and create a folder with the book title.
+def prepare_upload(files):
+    """Save an uploaded EPUB book and register it in the catalog.
+
+    The file is streamed to disk while it is hashed, so that uploading a
+    book that already exists returns the existing book right away.
+
+    Args:
+        files (MultiDict): the files of the upload request
 
     Returns:
-        Response: Status of the upload request.
+        tuple: response data and status, and the upload to summarize, see
+        summarize_upload, or None if there is nothing to summarize
     """
-    if "file" not in request.files:
-        return jsonify({"error": "No file part"}), ERROR_STATUS
+    if "file" not in files:
+        return {"error": "No file part"}, ERROR_STATUS, None
 
-    file = request.files["file"]
+    file = files["file"]
     if file.filename == "":
-        return jsonify({"error": "No selected file"}), ERROR_STATUS
-
-    if file and allowed_file(file.filename):
-        folder_path = UPLOAD_FOLDER / str(uuid.uuid4())
-        folder_path.mkdir(parents=True, exist_ok=True)
-        file_path = folder_path / "book.epub"
-        file.save(file_path)
+        return {"error": "No selected file"}, ERROR_STATUS, None
+
+    if not (file and allowed_file(file.filename)):
+        return {"error": "Invalid file type"}, ERROR_STATUS, None
+
+    UPLOAD_FOLDER.mkdir(parents=True, exist_ok=True)
+    upload_path = UPLOAD_FOLDER / f".upload-{uuid.uuid4()}.epub"
+    content_hash = util.save_stream(file.stream, upload_path)
+
+    with upload_lock:
+        existing = book_catalog.find_by_hash(content_hash)
+        if existing is None and content_hash in pending_uploads:
+            existing = pending_uploads[content_hash]
+        if existing is None:
+            folder_path = UPLOAD_FOLDER / str(uuid.uuid4())
+            folder_path.mkdir(parents=True, exist_ok=True)
+            file_path = folder_path / "book.epub"
+            upload_path.replace(file_path)
+            pending_uploads[content_hash] = {
+                "uuid": folder_path.name,
+                "title": file.filename,
+                "status": catalog.UPLOADED,
+            }
+    if existing is not None:
+        upload_path.unlink()
+        return {
+            "message": "Book already uploaded",
+            "title": existing["title"],
+            "uuid": existing["uuid"],
+            "status": existing["status"],
+        }, OK_STATUS, None
 
-        # Extract the title from the EPUB metadata
+    try:
+        # Read the EPUB once for its metadata and its content
         book = epub.read_epub(file_path)
-        title = book.get_metadata("DC", "title")
-        title = title[0][0] if title else None
-
-        creator = book.get_metadata("DC", "creator")
-        creator = creator[0][0] if creator else None
-
+        book_metadata = util.epub_metadata(book)
+        title = book_metadata["title"]
         if title:
-            book_metadata = {"title": title, "creator": creator}
+            book_metadata["content_hash"] = content_hash
             with open(folder_path / "metadata.json", "w", encoding="utf8") as file:
                 json.dump(book_metadata, file)
-
-            def update_progress(num_processed, total):
-                global book_summary_progress # pylint: disable=global-statement
-                if num_processed == total:
-                    book_summary_progress = 0
-                else:
-                    book_summary_progress = 100.0 * num_processed / total
-
-            await summarizer.summarize_book(file_path, folder_path, update_progress)
-            return (
-                jsonify({"message": "File successfully uploaded", "title": title}),
-                OK_STATUS,
+            book_catalog.add_book(
+                folder_path.name,
+                title,
+                book_metadata["creator"],
+                catalog.SUMMARIZING,
+                content_hash,
             )
-        return jsonify({"error": "Failed to extract book title"}), ERROR_STATUS
-    return jsonify({"error": "Invalid file type"}), ERROR_STATUS
+    finally:
+        with upload_lock:
+            del pending_uploads[content_hash]
+
+    if not title:
+        return {"error": "Failed to extract book title"}, ERROR_STATUS, None
+    return None, None, (folder_path, file_path, book, title)
+
+
+def summarize_upload(upload: tuple):
+    """Summarize an uploaded book and index it for search.
+
+    Args:
+        upload (tuple): folder, file, read EPUB and title of the book, see prepare_upload
+
+    Returns:
+        tuple: response data and status
+    """
+    folder_path, file_path, book, title = upload
+
+    def update_progress(num_processed, total):
+        global book_summary_progress # pylint: disable=global-statement
+        if num_processed == total:
+            book_summary_progress = 0
+        else:
+            book_summary_progress = 100.0 * num_processed / total
+        book_progress[folder_path.name] = 100.0 * num_processed / total
+
+    try:
+        summarizer.summarize_book(
+            file_path,
+            folder_path,
+            update_progress,
+            book_content=util.parse_epub_book(book),
+            summarize_chunks=functools.partial(
+                scheduler.summarize, folder_path.name),
+        )
+    except Exception:
+        book_catalog.set_status(folder_path.name, catalog.FAILED)
+        raise
+    finally:
+        book_progress.pop(folder_path.name, None)
+        scheduler.finish(folder_path.name)
+    book_catalog.set_status(folder_path.name, catalog.SUMMARIZED)
+    index_executor.submit(search_service.build_index, folder_path.name)
+    return {
+        "message": "File successfully uploaded",
+        "title": title,
+        "uuid": folder_path.name,
+    }, OK_STATUS
+
+
+@app.route("/api/book", methods=["POST"])
+def upload_book():
+    """Upload a book in EPUB format and create a folder with the book title.
+
+    Returns:
+        Response: Status of the upload request.
+    """
+    data, status, upload = prepare_upload(request.files)
+    if upload is not None:
+        data, status = summarize_upload(upload)
+    return jsonify(data), status
 
 
 @app.route("/api/book/progress", methods=["GET"])
 async def get_summarization_progress_route():
-    """Get the summarization progress."""
-    return jsonify({"progress": book_summary_progress})
+    """Get the summarization progress.
+
+    Returns:
+        Response: progress of the latest update in percent, and per book
+        that is being summarized.
+    """
+    return jsonify({"progress": book_summary_progress, "books": book_progress})
+
+
+@app.route("/api/book/scheduler", methods=["GET"])
+def get_scheduler_stats():
+    """Get throughput and queue wait times of the books that are being summarized.
+
+    Returns:
+        Response: statistics per book uuid.
+    """
+    return jsonify(scheduler.stats())
+
+
+@app.route("/api/models", methods=["GET"])
+def get_model_memory():
+    """Get the memory of the loaded models and of the server process.
+
+    Returns:
+        Response: resident bytes of the process, and with a memory budget,
+        the budget and the resident bytes per model.
+    """
+    if model_residency is None:
+        return jsonify({"rss_bytes": rss_bytes(), "peak_rss_bytes": peak_rss_bytes()})
+    return jsonify(model_residency.stats())
+
+
+@app.route("/api/inference", methods=["GET"])
+def get_inference_stats():
+    """Get the requests, retries and failovers of the inference API client.
+
+    Returns:
+        Response: the counters of the client, empty if images are generated locally.
+    """
+    if isinstance(inference_client, RemoteInferenceClient):
+        return jsonify(inference_client.stats())
+    return jsonify({})
 
 
 @app.route("/api/books", methods=["GET"])
 def get_books():
-    """Get list of books.
+    """Get the list of books, or a page of it.
+
+    Query parameters:
+        page (int): 1-based page number. Defaults to 1.
+        per_page (int): number of books per page. Defaults to 100 if page is given,
+            otherwise all books are listed.
+        sort (string): "title", "creator" or "added". Defaults to "title".
+        order (string): "asc" or "desc". Defaults to "asc".
+        title (string): only list books whose title contains this text.
+        creator (string): only list books whose creator contains this text.
 
     Returns:
-        Response<string[]>: book titles.
+        Response<object[]>: uuid, title, creator and summarization status of the books.
+        The total number of matching books is sent in the X-Total-Count header.
     """
-    data = []
-    for path in DATA_DIR.iterdir():
-        if path.is_dir():
-            with open(path / "metadata.json", encoding="utf8") as json_file:
-                metadata = json.load(json_file)
-                metadata["uuid"] = path.stem
-            data.append(metadata)
+    page = max(request.args.get("page", 1, type=int), 1)
+    per_page = None
+    if "page" in request.args or "per_page" in request.args:
+        per_page = min(max(request.args.get("per_page", 100, type=int), 1), MAX_PAGE_SIZE)
+    try:
+        books, total = book_catalog.list_books(
+            offset=(page - 1) * (per_page or 0),
+            limit=per_page,
+            sort=request.args.get("sort", "title"),
+            descending=request.args.get("order", "asc") == "desc",
+            title=request.args.get("title"),
+            creator=request.args.get("creator"),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), ERROR_STATUS
 
-    return jsonify(data)
+    response = jsonify(books)
+    response.headers["X-Total-Count"] = str(total)
+    return response
 
 
 @app.route("/api/books/<book_uuid>")
@@ -186,14 +478,60 @@ def get_book(book_uuid):
         book_uuid (string): uuid of the book
 
     Returns:
-        Response: summaries of the book, its chapters, and paragraphs.
+        Response: summaries of the book, its chapters, and paragraphs. While the book
+        is being summarized, the chapters summarized so far, marked as incomplete.
     """
     path = DATA_DIR / book_uuid / "summarized.json"
-    if not path.exists():
+    if path.exists():
+        return http_cache.send_json(path)
+    partial_path = DATA_DIR / book_uuid / PARTIAL_FILE
+    try:
+        # Taken before reading, so a chapter added meanwhile changes the etag.
+        etag = http_cache.file_etag(partial_path)
+    except FileNotFoundError:
+        etag = None
+    partial_book = read_partial_book(partial_path.parent) if etag else None
+    if partial_book is None:
+        # The summarization may have finished in the meantime.
+        if path.exists():
+            return http_cache.send_json(path)
         return jsonify({"error": "Book not found"}), ERROR_STATUS
-    with open(path, encoding="utf8") as json_file:
-        data = json.load(json_file)
-    return jsonify(data)
+    response = jsonify(partial_book)
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+@app.route("/api/books/<book_uuid>/search")
+def search_book(book_uuid):
+    """Search the paragraphs and summaries of a book.
+
+    Query parameters:
+        q (string): the search query.
+        mode (string): "keyword" or "semantic". Defaults to "keyword".
+        limit (int): maximal number of results. Defaults to 20.
+
+    Args:
+        book_uuid (string): uuid of the book
+
+    Returns:
+        Response: matching paragraphs and summaries, best match first.
+    """
+    query = request.args.get("q", "")
+    if not query.strip():
+        return jsonify({"error": "Missing query"}), ERROR_STATUS
+    try:
+        results = search_service.search(
+            book_uuid,
+            query,
+            mode=request.args.get("mode", "keyword"),
+            limit=min(max(request.args.get("limit", 20, type=int), 1), 100),
+        )
+    except FileNotFoundError:
+        return jsonify({"error": "Book not found"}), ERROR_STATUS
+    except ValueError as e:
+        return jsonify({"error": str(e)}), ERROR_STATUS
+    return jsonify({"results": results})
 
 
 @app.route("/api/books/<book_uuid>/metadata")
@@ -236,15 +574,16 @@ def get_selected_images(book_uuid):
     Returns:
         Response: selected image ids of the book, its chapters, and paragraphs.
     """
-    path = DATA_DIR / book_uuid / "selected_images.json"
-
-    if not path.exists():
-        generate_selected_images(book_uuid)
-    return send_file(path, mimetype='application/json')
+    try:
+        data = state_store.read(
+            book_uuid, "selected_images", lambda: generate_selected_images(book_uuid))
+        return jsonify(data)
+    except FileNotFoundError:
+        return jsonify({"error": "Book not found"}), ERROR_STATUS
 
 
 def generate_selected_images(book_uuid):
-    """Generate selected images JSON data for a book and save it to a file.
+    """Generate the initial selected images JSON data for a book.
 
     Args:
         book_uuid (string): UUID of the book.
@@ -254,27 +593,28 @@ def generate_selected_images(book_uuid):
     """
     json_file_path = DATA_DIR / book_uuid / 'summarized.json'
 
-    with open(json_file_path, encoding='utf8') as json_file:
-        data = json.load(json_file)
-        chapters = data["book"]["chapters"]
-
-        new_json_data = {
-            "bookSelectedId": 0,
-            "chapters": []
+    try:
+        with open(json_file_path, encoding='utf8') as json_file:
+            data = json.load(json_file)
+    except FileNotFoundError:
+        # The paragraphs are known while the book is being summarized.
+        data = read_partial_book(json_file_path.parent)
+        if data is None:
+            raise
+    chapters = data["book"]["chapters"]
+
+    new_json_data = {
+        "bookSelectedId": 0,
+        "chapters": []
+    }
+
+    for chapter in chapters:
+        paragraph_count = len(chapter["paragraphs"])
+        new_chapter = {
+            "chapterSelectedId": 0,
+            "paragraphSelectedIds": [0] * paragraph_count
         }
-
-        for chapter in chapters:
-            paragraph_count = len(chapter["paragraphs"])
-            new_chapter = {
-                "chapterSelectedId": 0,
-                "paragraphSelectedIds": [0] * paragraph_count
-            }
-            new_json_data["chapters"].append(new_chapter)
-
-    save_path = DATA_DIR / book_uuid / "selected_images.json"
-    with open(save_path, 'w', encoding='utf-8') as json_output_file:
-        json.dump(new_json_data, json_output_file,
-                  ensure_ascii=False, indent=4)
+        new_json_data["chapters"].append(new_chapter)
 
     return new_json_data
 
@@ -291,20 +631,64 @@ def update_selected_images(book_uuid):
     """
     try:
         updated_selected_images = request.json
-        json_file_path = DATA_DIR / book_uuid / 'selected_images.json'
-
-        if not json_file_path.exists():
-            generate_selected_images(book_uuid)
-
-        with open(json_file_path, 'w', encoding='utf-8') as json_file:
-            json.dump(updated_selected_images, json_file,
-                      ensure_ascii=False, indent=4)
+        state_store.write(book_uuid, "selected_images", updated_selected_images)
 
         return jsonify({"message": "Selected images updated successfully."}), 200
     except (FileNotFoundError, ValueError) as e:
         return jsonify({"message": f"Error updating selected images: {str(e)}"}), 500
 
 
+@app.route('/api/books/<book_uuid>/images/selected', methods=['PATCH'])
+def patch_selected_image(book_uuid):
+    """Update the selected image id of a single element of a book.
+
+    The request body contains the "selectedId" and the "chapter" and "paragraph"
+    indices of the element. A missing chapter selects the book image, a missing
+    paragraph the chapter image.
+
+    Args:
+        book_uuid (string): UUID of the book
+
+    Returns:
+        Response: Message indicating success or failure of the update.
+    """
+    data = request.get_json()
+    if not isinstance(data, dict):
+        return jsonify({"message": "The body must be a JSON object"}), ERROR_STATUS
+    chapter = data.get("chapter")
+    paragraph = data.get("paragraph")
+    selected_id = data.get("selectedId")
+    # JSON booleans are parsed as bool, which is a subclass of int.
+    if not isinstance(selected_id, int) or isinstance(selected_id, bool):
+        return jsonify({"message": "selectedId must be an integer"}), ERROR_STATUS
+    if any(index is not None
+           and (not isinstance(index, int) or isinstance(index, bool) or index < 0)
+           for index in (chapter, paragraph)):
+        return jsonify({"message": "Indices must be non-negative integers"}), ERROR_STATUS
+
+    def set_selected_id(selected_images):
+        if chapter is None:
+            selected_images["bookSelectedId"] = selected_id
+        elif paragraph is None:
+            selected_images["chapters"][chapter]["chapterSelectedId"] = selected_id
+        else:
+            selected_images["chapters"][chapter]["paragraphSelectedIds"][paragraph] = selected_id
+        return selected_images
+
+    try:
+        state_store.update(
+            book_uuid,
+            "selected_images",
+            set_selected_id,
+            lambda: generate_selected_images(book_uuid),
+        )
+        return jsonify({"message": "Selected image updated successfully."}), 200
+    except (IndexError, TypeError) as e:
+        return jsonify({"message": f"Invalid element: {str(e)}"}), ERROR_STATUS
+    except FileNotFoundError as e:
+        return jsonify({"message": f"Error updating selected image: {str(e)}"}), 500
+
+
 @app.route('/api/books/<book_uuid>/characters', methods=['POST'])
 def save_characters(book_uuid):
     """Save characters of a book.
@@ -317,16 +701,65 @@ def save_characters(book_uuid):
     """
     try:
         characters_data = request.json
-        json_file_path = DATA_DIR / book_uuid / 'characters.json'
-
-        with open(json_file_path, 'w', encoding='utf-8') as json_file:
-            json.dump(characters_data, json_file, ensure_ascii=False, indent=4)
+        state_store.write(book_uuid, "characters", characters_data)
 
         return jsonify({"message": "Characters updated successfully."}), 200
     except (FileNotFoundError, ValueError) as e:
         return jsonify({"message": f"Error updating characters: {str(e)}"}), 500
 
 
+@app.route('/api/books/<book_uuid>/characters/<int:character_id>', methods=['PUT'])
+def save_character(book_uuid, character_id):
+    """Add or replace a single character of a book.
+
+    Args:
+        book_uuid (string): UUID of the book
+        character_id (int): id of the character
+
+    Returns:
+        Response: Message indicating success or failure of the update.
+    """
+    character = request.get_json()
+    if not isinstance(character, dict):
+        return jsonify({"message": "The body must be a JSON object"}), ERROR_STATUS
+    character["id"] = character_id
+
+    def upsert_character(characters):
+        # Characters saved by older versions may have no id.
+        for index, char in enumerate(characters):
+            if char.get("id") == character_id:
+                characters[index] = character
+                return characters
+        return characters + [character]
+
+    try:
+        state_store.update(book_uuid, "characters", upsert_character, list)
+        return jsonify({"message": "Character updated successfully."}), 200
+    except FileNotFoundError as e:
+        return jsonify({"message": f"Error updating character: {str(e)}"}), 500
+
+
+@app.route('/api/books/<book_uuid>/characters/<int:character_id>', methods=['DELETE'])
+def delete_character(book_uuid, character_id):
+    """Delete a single character of a book.
+
+    Args:
+        book_uuid (string): UUID of the book
+        character_id (int): id of the character
+
+    Returns:
+        Response: Message indicating success or failure of the update.
+    """
+    def remove_character(characters):
+        return [char for char in characters if char.get("id") != character_id]
+
+    try:
+        state_store.update(book_uuid, "characters", remove_character, list)
+        return jsonify({"message": "Character deleted successfully."}), 200
+    except FileNotFoundError as e:
+        return jsonify({"message": f"Error deleting character: {str(e)}"}), 500
+
+
 @app.route('/api/books/<book_uuid>/characters')
 def get_characters(book_uuid):
     """Get characters of a book.
@@ -338,15 +771,8 @@ def get_characters(book_uuid):
         Response: JSON with characters or an empty list if the file does not exist.
     """
     try:
-        json_file_path = DATA_DIR / book_uuid / 'characters.json'
-
-        if not json_file_path.exists():
-            return jsonify([])
-
-        with open(json_file_path, 'r', encoding='utf-8') as json_file:
-            characters_data = json.load(json_file)
-
-        return jsonify(characters_data)
+        characters_data = state_store.read(book_uuid, "characters")
+        return jsonify(characters_data if characters_data is not None else [])
     except ValueError as e:
         return jsonify({"error": f"Error loading characters: {str(e)}"}), 500
 
@@ -364,9 +790,7 @@ def get_book_summary_image(book_uuid, version):
     """
 
     filename = DATA_DIR / book_uuid / f"book_summary-version-{version}.png"
-    if not filename.exists():
-        return send_file("../frontend/static/EmptyImage.jpg", mimetype="image/png")
-    return send_file(filename, mimetype="image/png")
+    return send_version_image(filename)
 
 
 @app.route("/api/books/<book_uuid>/chapters/<int:chapter>/images/<int:version>")
@@ -387,9 +811,7 @@ def get_chapter_summary_image(book_uuid, chapter: int, version):
         / book_uuid
         / f"chapter-{chapter:03d}_chapter_summary-version-{version}.png"
     )
-    if not filename.exists():
-        return send_file("../frontend/static/EmptyImage.jpg", mimetype="image/png")
-    return send_file(filename, mimetype="image/png")
+    return send_version_image(filename)
 
 
 @app.route(
@@ -414,9 +836,7 @@ def get_paragraph_summary_image(book_uuid, chapter: int, paragraph: int, version
         / book_uuid
         / f"chapter-{chapter:03d}_paragraph_summary-{paragraph:04d}-version-{version}.png"
     )
-    if not filename.exists():
-        return send_file("../frontend/static/EmptyImage.jpg", mimetype="image/png")
-    return send_file(filename, mimetype="image/png")
+    return send_version_image(filename)
 
 
 @app.route(
@@ -441,9 +861,7 @@ def get_paragraph_image(book_uuid, chapter: int, paragraph: int, version):
         / book_uuid
         / f"chapter-{chapter:03d}_paragraph-{paragraph:04d}-version-{version}.png"
     )
-    if not filename.exists():
-        return send_file("../frontend/static/EmptyImage.jpg", mimetype="image/png")
-    return send_file(filename, mimetype="image/png")
+    return send_version_image(filename)
 
 
 @app.route("/api/books/<book_uuid>/image/versions")
@@ -456,13 +874,7 @@ def get_num_book_summary_images(book_uuid):
     Returns:
         Response: JSON with the number of versions.
     """
-    counter = 0
-    base_filename = DATA_DIR / book_uuid / "book_summary.png"
-    while (
-        base_filename.with_name(f"{base_filename.stem}-version-{counter}.png")
-    ).exists():
-        counter += 1
-    return jsonify({"versions": counter})
+    return jsonify({"versions": book_files.versions(book_uuid, prefetch.BOOK_NODE)})
 
 
 @app.route("/api/books/<book_uuid>/chapters/<int:chapter>/image/versions")
@@ -476,12 +888,7 @@ def get_num_chapter_summary_images(book_uuid, chapter):
     Returns:
         Response: JSON with the number of versions.
     """
-    counter = 0
-    base_filename = DATA_DIR / book_uuid / \
-        f"chapter-{chapter:03d}_chapter_summary.png"
-    while (base_filename.with_name(f"{base_filename.stem}-version-{counter}.png")).exists():
-        counter += 1
-    return jsonify({"versions": counter})
+    return jsonify({"versions": book_files.versions(book_uuid, prefetch.chapter_node(chapter))})
 
 
 @app.route(
@@ -499,17 +906,8 @@ def get_num_paragraph_summary_images(book_uuid, chapter, paragraph):
     Returns:
         Response: JSON with the number of versions.
     """
-    counter = 0
-    base_filename = (
-        DATA_DIR
-        / book_uuid
-        / f"chapter-{chapter:03d}_paragraph_summary-{paragraph:04d}.png"
-    )
-    while (
-        base_filename.with_name(f"{base_filename.stem}-version-{counter}.png")
-    ).exists():
-        counter += 1
-    return jsonify({"versions": counter})
+    node = prefetch.paragraph_summary_node(chapter, paragraph)
+    return jsonify({"versions": book_files.versions(book_uuid, node)})
 
 
 @app.route(
@@ -526,12 +924,38 @@ def get_num_paragraph_images(book_uuid, chapter, paragraph):
     Returns:
         Response: JSON with the number of versions.
     """
-    counter = 0
-    base_filename = DATA_DIR / book_uuid / \
-        f"chapter-{chapter:03d}_paragraph-{paragraph:04d}.png"
-    while (base_filename.with_name(f"{base_filename.stem}-version-{counter}.png")).exists():
-        counter += 1
-    return jsonify({"versions": counter})
+    node = prefetch.paragraph_node(chapter, paragraph)
+    return jsonify({"versions": book_files.versions(book_uuid, node)})
+
+
+@app.route("/api/books/<book_uuid>/chapters/<int:chapter>/prefetch")
+def prefetch_chapter(book_uuid, chapter):
+    """Get the data the reader needs for a chapter and its neighbours in one request.
+
+    The images of these chapters are read into memory in the background,
+    so that navigating to a neighbouring chapter does not wait for the disk.
+
+    Args:
+        book_uuid (string): UUID of the book
+        chapter (int): chapter number, starting at 1 like in the image routes.
+
+    Returns:
+        Response: per chapter its summaries, selected image ids and number of
+        image versions of the chapter summary, paragraph summaries and paragraphs.
+    """
+    radius = min(request.args.get("radius", 1, type=int), MAX_PREFETCH_RADIUS)
+    try:
+        selected = state_store.read(
+            book_uuid, "selected_images", lambda: generate_selected_images(book_uuid))
+        chapters, files = prefetch.prefetch_chapters(
+            book_files, book_uuid, chapter, max(radius, 0), selected,
+            sizes=THUMBNAIL_SIZES)
+    except FileNotFoundError:
+        return jsonify({"error": "Book not found"}), ERROR_STATUS
+    except ValueError as e:
+        return jsonify({"error": str(e)}), ERROR_STATUS
+    prefetch_executor.submit(prefetch.warm_files, files)
+    return jsonify({"chapters": chapters})
 
 
 if __name__ == "__main__":
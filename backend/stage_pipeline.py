@@ -0,0 +1,180 @@
+"""Run items through a sequence of stages that overlap in time."""
+
+import queue
+import threading
+import time
+from typing import Callable, Iterable
+
+# Marks the end of the items in a queue.
+_DONE = object()
+
+
+class PipelineStage:
+    """A step of a StagePipeline that is run by one or more worker threads."""
+
+    def __init__(self, name: str, function: Callable, workers: int = 1):
+        """
+        Create a pipeline stage.
+
+        Args:
+            name (str): name of the stage used in the statistics
+            function (Callable): transforms the output of the previous stage
+            into the input of the next stage
+            workers (int, optional): number of threads running the stage. Defaults to 1.
+        """
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.processed = 0
+        self.busy_seconds = 0.0
+        self.wait_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """Reset the statistics of the stage."""
+        with self._lock:
+            self.processed = 0
+            self.busy_seconds = 0.0
+            self.wait_seconds = 0.0
+
+    def record(self, busy_seconds: float, wait_seconds: float):
+        """Record the time a worker spent processing an item and waiting for it.
+
+        Args:
+            busy_seconds (float): time spent processing the item
+            wait_seconds (float): time spent waiting for the item
+        """
+        with self._lock:
+            self.processed += 1
+            self.busy_seconds += busy_seconds
+            self.wait_seconds += wait_seconds
+
+
+class StagePipeline:
+    """
+    Passes items through stages connected by bounded queues, so that later
+    items are prepared by earlier stages while later stages still process
+    previous items. The bounded queues limit how far stages run ahead.
+    """
+
+    def __init__(self, stages: list, queue_size: int = 4):
+        """
+        Create a pipeline.
+
+        Args:
+            stages (list): the PipelineStages in order
+            queue_size (int, optional): maximal number of items waiting in
+            front of each stage. Defaults to 4.
+        """
+        self.stages = stages
+        self.queue_size = queue_size
+        self._queues = []
+        self._occupancy = []
+        # Set once an item failed, so that the remaining items are skipped.
+        self._failed = threading.Event()
+
+    def run(self, items: Iterable):
+        """Pass all items through the stages.
+
+        Args:
+            items (Iterable): the input of the first stage
+
+        Returns:
+            list: the output of the last stage, in the order of the items
+        """
+        self._queues = [
+            queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)
+        ]
+        self._occupancy = [[] for _ in self.stages]
+        self._failed.clear()
+        threads = []
+        for stage_index, stage in enumerate(self.stages):
+            stage.reset()
+            # The last worker of a stage to finish signals the end to the next stage.
+            remaining = [stage.workers]
+            lock = threading.Lock()
+            threads += [
+                threading.Thread(
+                    target=self._work, args=(stage_index, remaining, lock), daemon=True
+                )
+                for _ in range(stage.workers)
+            ]
+        feeder = threading.Thread(target=self._feed, args=(items,), daemon=True)
+        feeder.start()
+        for thread in threads:
+            thread.start()
+
+        results = {}
+        error = None
+        while (item := self._queues[-1].get()) is not _DONE:
+            index, value, item_error = item
+            if item_error is not None and error is None:
+                error = item_error
+            results[index] = value
+        feeder.join()
+        for thread in threads:
+            thread.join()
+        if error is not None:
+            raise error
+        return [results[index] for index in sorted(results)]
+
+    def stats(self):
+        """Get the statistics of the last run.
+
+        Returns:
+            dict: per stage the number of processed items, the time spent processing
+            and waiting for input, and the mean and maximal number of waiting items.
+        """
+        stats = {}
+        for stage, occupancy in zip(self.stages, self._occupancy):
+            stats[stage.name] = {
+                "workers": stage.workers,
+                "processed": stage.processed,
+                "busy_seconds": round(stage.busy_seconds, 3),
+                "wait_seconds": round(stage.wait_seconds, 3),
+                "mean_queue_occupancy": (
+                    round(sum(occupancy) / len(occupancy), 2) if occupancy else 0
+                ),
+                "max_queue_occupancy": max(occupancy, default=0),
+            }
+        return stats
+
+    def _feed(self, items: Iterable):
+        try:
+            for index, item in enumerate(items):
+                self._queues[0].put((index, item, None))
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            # Forwarded to the caller of run() through the stages.
+            self._failed.set()
+            self._queues[0].put((-1, None, e))
+        self._queues[0].put(_DONE)
+
+    def _work(self, stage_index: int, remaining: list, lock: threading.Lock):
+        stage = self.stages[stage_index]
+        input_queue = self._queues[stage_index]
+        output_queue = self._queues[stage_index + 1]
+        while True:
+            wait_start = time.perf_counter()
+            self._occupancy[stage_index].append(input_queue.qsize())
+            item = input_queue.get()
+            busy_start = time.perf_counter()
+            if item is _DONE:
+                # Let the other workers of the stage see the end as well.
+                input_queue.put(_DONE)
+                with lock:
+                    remaining[0] -= 1
+                    if remaining[0] == 0:
+                        output_queue.put(_DONE)
+                return
+
+            index, value, error = item
+            if error is None and not self._failed.is_set():
+                try:
+                    value = stage.function(value)
+                except Exception as e:  # pylint: disable=broad-exception-caught
+                    # Forwarded to the caller of run() through the remaining stages.
+                    value, error = None, e
+                    self._failed.set()
+            # Time blocked on a full output queue is neither busy nor waiting for input.
+            stage.record(time.perf_counter() - busy_start, busy_start - wait_start)
+            output_queue.put((index, value, error))
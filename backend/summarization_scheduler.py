@@ -0,0 +1,212 @@
+"""Share one summarization model between the books that are summarized concurrently."""
+
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+
+class _WorkItem:  # pylint: disable=too-few-public-methods
+    """A chunk of text waiting to be summarized."""
+
+    def __init__(self, text: str, num_tokens: int):
+        self.text = text
+        self.num_tokens = num_tokens
+        self.future = Future()
+        self.submitted_at = time.perf_counter()
+
+
+class _BookQueue:  # pylint: disable=too-few-public-methods
+    """The waiting work items and statistics of one book."""
+
+    def __init__(self, weight: int):
+        self.weight = weight
+        self.items = deque()
+        self.submitted = 0
+        self.completed = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.first_submitted_at = time.perf_counter()
+
+
+class SummarizationScheduler:
+    """
+    Summarizes the chunks of all active books on a single model thread.
+    Chunks are taken from the books round-robin, so a small book finishes
+    quickly even while a large book is summarized, and are passed to the
+    model in batches.
+    """
+
+    def __init__(self, summarizer, batch_size: int = 4):
+        """
+        Start the model thread.
+
+        Args:
+            summarizer (BookSummarizer): the shared summarization model
+            batch_size (int, optional): maximal number of chunks summarized at once.
+            Defaults to 4.
+        """
+        self.summarizer = summarizer
+        self.batch_size = batch_size
+        self._books = OrderedDict()
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, book_id: str, text: str, num_tokens: int = None, weight: int = 1):
+        """Queue a chunk of a book for summarization.
+
+        Args:
+            book_id (str): the book the chunk belongs to
+            text (str): the text to summarize
+            num_tokens (int, optional): number of tokens of the text if already known.
+            weight (int, optional): number of chunks of the book taken per round,
+            i.e., its priority relative to other books. Defaults to 1.
+
+        Returns:
+            Future: resolves to the summary of the text
+        """
+        if num_tokens is None:
+            num_tokens = len(self.summarizer.tokenizer.encode(text))
+        item = _WorkItem(text, num_tokens)
+        with self._condition:
+            book = self._books.get(book_id)
+            if book is None:
+                book = self._books[book_id] = _BookQueue(weight)
+            book.weight = weight
+            book.items.append(item)
+            book.submitted += 1
+            self._condition.notify()
+        return item.future
+
+    def summarize(self, book_id: str, chunks: list, weight: int = 1):
+        """Summarize chunks of a book and wait for the summaries.
+
+        Args:
+            book_id (str): the book the chunks belong to
+            chunks (list): (text, number of tokens) tuples
+            weight (int, optional): priority of the book, see submit. Defaults to 1.
+
+        Returns:
+            list: the summaries of the chunks
+        """
+        futures = [
+            self.submit(book_id, text, num_tokens, weight) for text, num_tokens in chunks
+        ]
+        return [future.result() for future in futures]
+
+    def finish(self, book_id: str):
+        """Remove a book that has been summarized or has failed.
+
+        Its statistics are removed, and chunks of the book that are still
+        waiting are cancelled instead of being summarized.
+
+        Args:
+            book_id (str): the book
+        """
+        with self._condition:
+            items = self._remove(book_id)
+        for item in items:
+            item.future.cancel()
+
+    def stats(self):
+        """Get throughput and queue wait times of the active books.
+
+        Returns:
+            dict: statistics per book
+        """
+        now = time.perf_counter()
+        with self._condition:
+            return {
+                book_id: {
+                    "queued": len(book.items),
+                    "submitted": book.submitted,
+                    "completed": book.completed,
+                    "chunks_per_minute": round(
+                        60 * book.completed / max(now - book.first_submitted_at, 1e-9), 2
+                    ),
+                    "mean_wait_seconds": round(
+                        book.wait_seconds / book.completed if book.completed else 0.0, 3
+                    ),
+                    "max_wait_seconds": round(book.max_wait_seconds, 3),
+                }
+                for book_id, book in self._books.items()
+            }
+
+    def _next_batch(self):
+        """Take up to batch_size chunks, round-robin over the books with waiting chunks.
+
+        Returns:
+            list: (book id, work item) tuples
+        """
+        batch = []
+        while len(batch) < self.batch_size:
+            progressed = False
+            for book_id, book in list(self._books.items()):
+                for _ in range(book.weight):
+                    if not book.items or len(batch) == self.batch_size:
+                        break
+                    batch.append((book_id, book.items.popleft()))
+                    progressed = True
+                # Continue with the next book in the following batch.
+                self._books.move_to_end(book_id)
+                if len(batch) == self.batch_size:
+                    break
+            if not progressed:
+                break
+        return batch
+
+    def _remove(self, book_id: str):
+        """Remove a book with the condition held.
+
+        Returns:
+            list: the work items of the book that were still waiting
+        """
+        book = self._books.pop(book_id, None)
+        return list(book.items) if book is not None else []
+
+    def _summarize(self, batch):
+        """Summarize a batch, or its chunks one by one if the batch fails.
+
+        Returns:
+            list: the summary, or the raised exception, of each chunk
+        """
+        try:
+            return self.summarizer.summarize_batch(
+                [(item.text, item.num_tokens) for _, item in batch]
+            )
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            if len(batch) == 1:
+                return [e]
+        # Only the chunks that fail on their own fail, not the other books of the batch.
+        return [self._summarize([entry])[0] for entry in batch]
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not (batch := self._next_batch()):
+                    self._condition.wait()
+
+            started_at = time.perf_counter()
+            results = self._summarize(batch)
+
+            failed = []
+            with self._condition:
+                for (book_id, item), result in zip(batch, results):
+                    if isinstance(result, Exception):
+                        # The book fails, so its other chunks are not summarized.
+                        failed += [(waiting, result) for waiting in self._remove(book_id)]
+                        continue
+                    book = self._books.get(book_id)
+                    if book is not None:
+                        wait = started_at - item.submitted_at
+                        book.completed += 1
+                        book.wait_seconds += wait
+                        book.max_wait_seconds = max(book.max_wait_seconds, wait)
+            for (_, item), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    item.future.set_exception(result)
+                else:
+                    item.future.set_result(result)
+            for item, error in failed:
+                item.future.set_exception(error)
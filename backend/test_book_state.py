@@ -0,0 +1,93 @@
+"""Tests of the atomic per-book state files."""
+
+import json
+import threading
+
+import pytest
+
+from book_state import BookStateStore, atomic_write_json
+
+BOOK = "book"
+
+
+@pytest.fixture(name="store")
+def fixture_store(tmp_path):
+    """A state store with one empty book folder."""
+    (tmp_path / BOOK).mkdir()
+    return BookStateStore(tmp_path)
+
+
+def test_atomic_write_json_keeps_old_content_on_error(tmp_path):
+    """A failed write leaves the previous file and no temporary file behind."""
+    path = tmp_path / "state.json"
+    atomic_write_json(path, {"version": 1})
+    with pytest.raises(TypeError):
+        atomic_write_json(path, {"version": object()})
+    assert json.loads(path.read_text(encoding="utf-8")) == {"version": 1}
+    assert [file.name for file in tmp_path.iterdir()] == ["state.json"]
+
+
+def test_read_creates_default_once(store):
+    """The default document is written on the first read and kept afterwards."""
+    calls = []
+
+    def default():
+        calls.append(1)
+        return {"selected": 0}
+
+    assert store.read(BOOK, "selected_images", default) == {"selected": 0}
+    assert store.read(BOOK, "selected_images", default) == {"selected": 0}
+    assert len(calls) == 1
+    assert store.read(BOOK, "characters") is None
+
+
+def test_write_to_missing_book_fails(store):
+    """Documents are only written into existing book folders."""
+    with pytest.raises(FileNotFoundError):
+        store.write("missing", "characters", [])
+
+
+def test_concurrent_updates_are_not_lost(store):
+    """Concurrent read-modify-write updates of one document all persist."""
+    threads, updates = 8, 50
+
+    def increment():
+        for _ in range(updates):
+            store.update(
+                BOOK, "counter", lambda data: {"count": data["count"] + 1}, lambda: {"count": 0}
+            )
+
+    workers = [threading.Thread(target=increment) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert store.read(BOOK, "counter") == {"count": threads * updates}
+
+
+def test_readers_never_see_partial_documents(store):
+    """Reading while the document is replaced returns either version, never a torn file."""
+    small, large = {"items": [0]}, {"items": list(range(10000))}
+    store.write(BOOK, "document", small)
+    stop = threading.Event()
+    errors = []
+
+    def read():
+        while not stop.is_set():
+            # Read the file directly, without the lock of the store.
+            try:
+                data = json.loads(store.path(BOOK, "document").read_text(encoding="utf-8"))
+            except ValueError as e:
+                errors.append(e)
+                return
+            if data not in (small, large):
+                errors.append(data)
+                return
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    for index in range(50):
+        store.write(BOOK, "document", large if index % 2 else small)
+    stop.set()
+    reader.join()
+    assert not errors
@@ -0,0 +1,89 @@
+"""Tests of the SQLite book catalog."""
+
+import json
+
+import catalog
+import util
+
+
+def add_folder(data_dir, book_uuid, title, *, summarized=False, content_hash=None):
+    """Create the folder of a book like the server does when uploading it."""
+    folder = data_dir / book_uuid
+    folder.mkdir()
+    (folder / "book.epub").write_bytes(f"epub of {book_uuid}".encode())
+    metadata = {"title": title, "creator": "Author"}
+    if content_hash is not None:
+        metadata["content_hash"] = content_hash
+    (folder / "metadata.json").write_text(json.dumps(metadata), encoding="utf-8")
+    if summarized:
+        (folder / "summarized.json").write_text('{"book": {}}', encoding="utf-8")
+    return folder
+
+
+def test_new_catalog_is_built_from_the_book_folders(tmp_path):
+    """Books are listed with their status, and missing hashes are computed from the epub."""
+    add_folder(tmp_path, "a", "Alice", summarized=True, content_hash="hash-a")
+    folder = add_folder(tmp_path, "b", "Bob")
+    (tmp_path / "no-metadata").mkdir()
+
+    books = catalog.BookCatalog(tmp_path)
+
+    listed, total = books.list_books()
+    assert total == 2
+    assert [(book["uuid"], book["status"]) for book in listed] == [
+        ("a", catalog.SUMMARIZED),
+        ("b", catalog.UPLOADED),
+    ]
+    assert books.find_by_hash("hash-a")["uuid"] == "a"
+    books.set_status("b", catalog.SUMMARIZED)
+    assert books.find_by_hash(util.file_hash(folder / "book.epub"))["uuid"] == "b"
+
+
+def test_find_by_hash_ignores_books_that_can_be_uploaded_again(tmp_path):
+    """Only books that are summarized or being summarized count as duplicates."""
+    books = catalog.BookCatalog(tmp_path)
+    books.add_book("uploaded", "T", "A", catalog.UPLOADED, "hash")
+    books.add_book("failed", "T", "A", catalog.FAILED, "hash")
+    assert books.find_by_hash("hash") is None
+
+    books.add_book("summarizing", "T", "A", catalog.SUMMARIZING, "hash")
+    assert books.find_by_hash("hash")["uuid"] == "summarizing"
+    books.set_status("summarizing", catalog.SUMMARIZED)
+    assert books.find_by_hash("hash")["status"] == catalog.SUMMARIZED
+
+
+def test_rebuild_marks_unsummarized_books_as_uploaded(tmp_path):
+    """A rebuilt catalog does not deduplicate uploads against unsummarized books."""
+    add_folder(tmp_path, "a", "Alice", content_hash="hash-a")
+    books = catalog.BookCatalog(tmp_path)
+    assert books.find_by_hash("hash-a") is None
+
+    (tmp_path / "a" / "summarized.json").write_text('{"book": {}}', encoding="utf-8")
+    assert books.rebuild() == 1
+    assert books.find_by_hash("hash-a")["uuid"] == "a"
+
+
+def test_reopening_resets_interrupted_summarizations(tmp_path):
+    """Books left summarizing by a stopped server become summarized or failed."""
+    add_folder(tmp_path, "done", "Done", summarized=True)
+    add_folder(tmp_path, "cut", "Cut")
+    books = catalog.BookCatalog(tmp_path)
+    books.set_status("done", catalog.SUMMARIZING)
+    books.set_status("cut", catalog.SUMMARIZING)
+
+    statuses = {
+        book["uuid"]: book["status"] for book in catalog.BookCatalog(tmp_path).list_books()[0]
+    }
+    assert statuses == {"done": catalog.SUMMARIZED, "cut": catalog.FAILED}
+
+
+def test_filters_take_wildcards_literally(tmp_path):
+    """Percent signs and underscores in a filter match only themselves."""
+    books = catalog.BookCatalog(tmp_path)
+    books.add_book("a", "100% Alice", "A")
+    books.add_book("b", "1000 Bobs", "B_C")
+    books.add_book("c", "Carol", "BxC")
+
+    assert [book["uuid"] for book in books.list_books(title="0%")[0]] == ["a"]
+    assert [book["uuid"] for book in books.list_books(creator="B_C")[0]] == ["b"]
+    assert books.list_books(title="\\")[1] == 0
@@ -0,0 +1,69 @@
+"""Tests of the chunking strategies for the summarization model."""
+
+import pytest
+from tokenizers import Tokenizer, models, pre_tokenizers
+
+from chunking import ChunkingStrategy
+
+WORDS = [f"w{index}" for index in range(50)]
+# 30 sentences of 9 words, 270 tokens
+TEXT = ". ".join(" ".join(WORDS[(i * 7 + j) % 50] for j in range(9)) for i in range(30)) + "."
+
+
+@pytest.fixture(name="tokenizer", scope="module")
+def fixture_tokenizer():
+    """A tokenizer with one token per whitespace separated word, so no download is needed."""
+    vocabulary = {word: index for index, word in enumerate(["[UNK]", *WORDS])}
+    tokenizer = Tokenizer(models.WordLevel(vocabulary, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.WhitespaceSplit()
+    return tokenizer
+
+
+def sizes(chunks: list) -> list:
+    """Get the number of tokens of each chunk."""
+    return [num_tokens for _, num_tokens in chunks]
+
+
+def test_balanced_chunks_have_similar_sizes(tokenizer):
+    """Balanced chunks need no more chunks than greedy ones, without a small remainder."""
+    greedy = ChunkingStrategy(100, balanced=False).split(TEXT, tokenizer, 512)
+    balanced = ChunkingStrategy(100).split(TEXT, tokenizer, 512)
+
+    assert len(balanced) == len(greedy) == 3
+    assert max(sizes(balanced)) <= 100
+    assert max(sizes(balanced)) - min(sizes(balanced)) < 10
+    assert min(sizes(greedy)) < min(sizes(balanced))
+    assert " ".join(chunk for chunk, _ in balanced).split() == TEXT.split()
+
+
+def test_overlap_repeats_the_end_of_the_previous_chunk(tokenizer):
+    """Chunks start with whole words of the previous chunk and still fit the target."""
+    chunks = ChunkingStrategy(100, overlap_tokens=10).split(TEXT, tokenizer, 512)
+
+    assert max(sizes(chunks)) <= 100
+    for (previous, _), (chunk, _) in zip(chunks, chunks[1:]):
+        context = chunk.split("\n")[0]
+        assert context.split()
+        assert len(context.split()) <= 10
+        assert previous.endswith(context)
+
+
+def test_target_is_limited_to_the_model(tokenizer):
+    """Targets larger than the maximal input length of the model are capped."""
+    chunks = ChunkingStrategy(1000).split(TEXT, tokenizer, 100)
+
+    assert len(chunks) == 3
+    assert max(sizes(chunks)) <= 100
+
+
+def test_short_and_empty_texts(tokenizer):
+    """A text that fits is one chunk, an empty text has no chunks."""
+    assert ChunkingStrategy(100).split("  w1 w2.\n", tokenizer, 512) == [("w1 w2.", 2)]
+    assert not ChunkingStrategy(100).split(" \n ", tokenizer, 512)
+
+
+def test_names_describe_the_strategy():
+    """Names distinguish the strategies in benchmark results."""
+    assert ChunkingStrategy().name == "balanced-max"
+    assert ChunkingStrategy(4096, balanced=False).name == "greedy-4096"
+    assert ChunkingStrategy(4096, overlap_tokens=256).name == "balanced-4096+256"
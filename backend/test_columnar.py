@@ -0,0 +1,83 @@
+"""Tests of the columnar export of the summarized books."""
+
+import json
+
+import pytest
+
+import columnar
+
+ALICE = {
+    "title": "Alice's Adventures in Wonderland",
+    "chapters": [
+        {
+            "num": 0,
+            "title": "Down the Rabbit-Hole",
+            "paragraphs": ["Alice was beginning to get very tired.", "So she was considering."],
+            "paragraph_summaries": ["Alice is tired."],
+            "chapter_summary": "Alice follows a rabbit.",
+        },
+        {
+            "num": 1,
+            "title": "The Pool of Tears",
+            "paragraphs": ["“Curiouser and curiouser!” cried Alice\xa0— 🐇"],
+            "chapter_summary": "Alice cries.",
+        },
+    ],
+    "book_summary": "A girl falls into Wonderland.",
+}
+EMPTY = {"title": "", "chapters": [], "book_summary": ""}
+
+
+@pytest.fixture(name="data_dir")
+def fixture_data_dir(tmp_path):
+    """A data directory with two summarized books and one that is not summarized."""
+    for book_uuid, book in (("alice", ALICE), ("empty", EMPTY)):
+        (tmp_path / book_uuid).mkdir()
+        (tmp_path / book_uuid / "summarized.json").write_text(
+            json.dumps({"book": book}), encoding="utf-8"
+        )
+    (tmp_path / "uploaded").mkdir()
+    return tmp_path
+
+
+def test_export_round_trip(data_dir, tmp_path):
+    """The exported and memory mapped columns rebuild the books unchanged."""
+    output_dir = tmp_path / "columns"
+    columnar.export_library(data_dir, output_dir)
+    library = columnar.LibraryColumns.load(output_dir)
+
+    assert library.strings("books.uuid") == ["alice", "empty"]
+    assert library.book("alice") == {"book": ALICE}
+    assert library.book("empty") == {"book": EMPTY}
+
+
+def test_count_words_matches_str_split():
+    """Words are counted on the UTF-8 bytes like str.split, including non-breaking spaces."""
+    texts = ["a b", "", "  ", "x\xa0y  z\n", "é ü 🐇", "one"]
+    offsets, data = columnar.encode_strings(texts)
+
+    assert columnar.count_words(offsets, data).tolist() == [len(text.split()) for text in texts]
+
+
+def test_stats_per_level_and_book(data_dir, tmp_path):
+    """Summary tokens are compared with the tokens of the summarized text."""
+    stats = columnar.export_library(data_dir, tmp_path / "columns").stats()
+
+    assert stats["levels"]["paragraph"]["nodes"] == 3
+    assert stats["levels"]["chapter_summary"]["nodes"] == 2
+    assert stats["books"]["alice"] == {
+        "source_tokens": 18,
+        "summary_tokens": 6,
+        "compression_ratio": 3.0,
+    }
+    assert stats["books"]["empty"]["source_tokens"] == 0
+
+
+def test_parquet_tables(data_dir, tmp_path):
+    """The Parquet export has one table per entity with decoded strings."""
+    parquet = pytest.importorskip("pyarrow.parquet")
+    library = columnar.export_library(data_dir, tmp_path / "columns", parquet=True)
+
+    nodes = parquet.read_table(tmp_path / "columns" / "nodes.parquet")
+    assert nodes.num_rows == len(library.columns["nodes.level"])
+    assert nodes.column("text").to_pylist() == library.strings("nodes.text")
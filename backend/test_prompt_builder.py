@@ -0,0 +1,90 @@
+"""Tests of the prompts fitted to the token window of the CLIP text encoder."""
+
+import pytest
+
+from book_state import BookStateStore
+from prompt_builder import SCENE_MARKER, SENTENCE_PATTERN, NodePromptCache, PromptBuilder
+
+PREFIX = (
+    "Generate an image in watercolor style. "
+    f"The character is Alice, a curious girl in a blue dress. {SCENE_MARKER}"
+)
+SCENE = (
+    "Alice follows the White Rabbit down the rabbit hole. "
+    "She falls for a long time and wonders about the cats and bats. "
+    "At the bottom of the hole, Alice finds a hall with many locked doors. "
+    "On a glass table lies a tiny golden key that opens a little door to a garden."
+)
+
+
+def count_words(text: str) -> int:
+    """Count words as tokens, plus the start and end tokens."""
+    return len(text.split()) + 2
+
+
+def sentences(text: str) -> list:
+    """Split a text into its sentences."""
+    return [sentence.strip() for sentence in SENTENCE_PATTERN.findall(text) if sentence.strip()]
+
+
+def assert_selected_from_scene(text: str):
+    """Check that a text consists of sentences of SCENE in their original order."""
+    scene_sentences = sentences(SCENE)
+    selected = sentences(text)
+    assert selected
+    assert all(sentence in scene_sentences for sentence in selected)
+    assert selected == sorted(selected, key=scene_sentences.index)
+
+
+@pytest.fixture(name="builder")
+def fixture_builder():
+    """A prompt builder with a window of 40 word tokens."""
+    return PromptBuilder(count_words, max_tokens=40)
+
+
+def test_text_that_fits_is_kept(builder):
+    """Short texts are only normalized in their whitespace."""
+    assert builder.build(f"{PREFIX}  Alice\n falls.") == f"{PREFIX} Alice falls."
+
+
+def test_prefix_is_kept_verbatim_and_scene_is_shortened(builder):
+    """Only the scene is shortened, to whole phrases of it in their original order."""
+    prompt = builder.build(f"{PREFIX} {SCENE}")
+
+    assert prompt.startswith(f"{PREFIX} ")
+    assert count_words(prompt) <= builder.max_tokens
+    assert_selected_from_scene(prompt[len(PREFIX) :])
+
+
+def test_long_sentence_is_cut_at_a_word(builder):
+    """A scene without phrases that fit is cut after the last whole word that fits."""
+    scene = " ".join(f"word{index}" for index in range(100))
+    prompt = builder.build(f"{PREFIX} {scene}")
+
+    assert prompt.startswith(f"{PREFIX} word0 word1")
+    assert count_words(prompt) == builder.max_tokens
+
+
+def test_text_without_marker_is_shortened_as_a_whole(builder):
+    """Texts without a style and character prefix are treated as scene."""
+    prompt = builder.build(f"{SCENE} {SCENE}")
+
+    assert count_words(prompt) <= builder.max_tokens
+    assert all(sentence in sentences(SCENE) for sentence in sentences(prompt))
+
+
+def test_node_prompts_are_rebuilt_only_when_the_text_changes(tmp_path, builder):
+    """The stored prompt is reused until the text of the node changes."""
+    (tmp_path / "book").mkdir()
+    cache = NodePromptCache(BookStateStore(tmp_path), builder)
+    text = f"{PREFIX} {SCENE}"
+
+    prompt = cache.prompt("book", "node", text)
+    cache.record_generation("book", "node", prompt)
+    cache.record_generation("book", "node", "a prompt edited by hand")
+    assert cache.prompt("book", "node", text) == prompt
+    assert cache.state_store.read("book", "prompts")["node"]["generations"] == 1
+
+    assert cache.prompt("book", "node", f"{PREFIX} Alice grows.") == f"{PREFIX} Alice grows."
+    # Images generated before the text changed still count.
+    assert cache.state_store.read("book", "prompts")["node"]["generations"] == 1
@@ -0,0 +1,136 @@
+"""Tests of the retry and failover decisions of the remote inference client."""
+
+import io
+
+import pytest
+import requests
+from PIL import Image
+
+import remote_inference_client
+from remote_inference_client import RemoteInferenceClient, is_unavailable
+
+
+def png_bytes() -> bytes:
+    """Encode a small image like the inference API returns it."""
+    buffer = io.BytesIO()
+    Image.new("RGB", (4, 4), "red").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def response(status: int, content: bytes = b"", headers: dict = None) -> requests.Response:
+    """Create a response of the inference API."""
+    result = requests.Response()
+    result.status_code = status
+    result._content = content  # pylint: disable=protected-access
+    result.headers.update(headers or {})
+    result.url = remote_inference_client.API_URL
+    return result
+
+
+class FakeSession:  # pylint: disable=too-few-public-methods
+    """Answers the requests of a client with prepared responses or errors."""
+
+    def __init__(self, results: list):
+        self.results = list(results)
+
+    def post(self, *_args, **_kwargs):
+        """Return or raise the next prepared result."""
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+class FakeFallback:  # pylint: disable=too-few-public-methods
+    """A local client that records the models it is created for."""
+
+    created = []
+
+    def __init__(self, model):
+        FakeFallback.created.append(model)
+
+    def text_to_image(self, _prompt, model=None):  # pylint: disable=unused-argument
+        """Generate an image locally, see LocalInferenceClient."""
+        return "local image"
+
+
+@pytest.fixture(name="delays")
+def fixture_delays(monkeypatch):
+    """Record the backoff delays instead of sleeping."""
+    recorded = []
+    monkeypatch.setattr(remote_inference_client.time, "sleep", recorded.append)
+    FakeFallback.created = []
+    return recorded
+
+
+def client_with(results: list, fallback=None, **options) -> RemoteInferenceClient:
+    """Create a client whose requests get the prepared results."""
+    client = RemoteInferenceClient("token", "model", fallback=fallback, **options)
+    client._session = FakeSession(results)  # pylint: disable=protected-access
+    return client
+
+
+@pytest.mark.parametrize(
+    "error, unavailable",
+    [
+        (requests.ConnectionError(), True),
+        (requests.Timeout(), True),
+        (requests.HTTPError(response=response(429)), True),
+        (requests.HTTPError(response=response(503)), True),
+        (requests.HTTPError(response=response(400)), False),
+        (requests.HTTPError(response=response(401)), False),
+        (requests.HTTPError(response=response(404)), False),
+        (requests.RequestException(), False),
+    ],
+)
+def test_is_unavailable(error, unavailable):
+    """Only connection problems and retryable statuses mean that the API is unavailable."""
+    assert is_unavailable(error) is unavailable
+
+
+def test_retryable_statuses_are_retried(delays):
+    """Rate limited and unavailable responses are retried, honoring Retry-After."""
+    client = client_with(
+        [response(429, headers={"Retry-After": "7"}), response(503), response(200, png_bytes())],
+        backoff_seconds=1.0,
+    )
+
+    assert client.text_to_image("a cat").size == (4, 4)
+    assert client.stats() == {"requests": 3, "retries": 2, "failovers": 0}
+    assert delays[0] == 7
+    assert 0.5 <= delays[1] <= 2.0
+
+
+def test_rejected_requests_are_neither_retried_nor_failed_over(delays):
+    """A request the API rejects raises instead of generating the image locally."""
+    client = client_with([response(401)], fallback=FakeFallback)
+
+    with pytest.raises(requests.HTTPError):
+        client.text_to_image("a cat")
+    assert client.stats() == {"requests": 1, "retries": 0, "failovers": 0}
+    assert not delays
+    assert not FakeFallback.created
+
+
+@pytest.mark.parametrize(
+    "failure", [lambda: response(503), requests.ConnectionError, requests.Timeout]
+)
+def test_unavailable_api_fails_over_to_the_local_client(delays, failure):
+    """Once the retries are used up, the fallback client generates the image."""
+    client = client_with([failure() for _ in range(6)], fallback=FakeFallback, max_retries=2)
+
+    assert client.text_to_image("a cat") == "local image"
+    assert client.text_to_image("a dog") == "local image"
+    assert client.stats() == {"requests": 6, "retries": 4, "failovers": 2}
+    # The local client is only created once.
+    assert FakeFallback.created == ["model"]
+    assert len(delays) == 4
+
+
+def test_unavailable_api_without_fallback_raises(delays):
+    """Without a fallback client the last error is raised."""
+    client = client_with([response(503), response(503)], max_retries=1)
+
+    with pytest.raises(requests.HTTPError):
+        client.text_to_image("a cat")
+    assert len(delays) == 1
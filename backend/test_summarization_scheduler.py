@@ -0,0 +1,84 @@
+"""Tests of the summarization scheduler shared by concurrent uploads."""
+
+import threading
+from concurrent.futures import CancelledError
+
+import pytest
+
+from summarization_scheduler import SummarizationScheduler
+
+
+class FakeSummarizer:  # pylint: disable=too-few-public-methods
+    """Upper-cases texts in batches and fails on texts containing "fail"."""
+
+    def __init__(self):
+        self.batches = []
+        # The first batch holds the model thread, so that chunks can be queued meanwhile.
+        self.running = threading.Event()
+        self.release = threading.Event()
+
+    def summarize_batch(self, chunks):
+        """Summarize a batch of (text, number of tokens) tuples, see BookSummarizer."""
+        self.running.set()
+        self.release.wait()
+        self.batches.append([text for text, _ in chunks])
+        if any("fail" in text for text, _ in chunks):
+            raise RuntimeError("model failed")
+        return [text.upper() for text, _ in chunks]
+
+
+def test_chunks_of_books_are_interleaved():
+    """A book that is submitted later does not wait for all chunks of an earlier one."""
+    summarizer = FakeSummarizer()
+    scheduler = SummarizationScheduler(summarizer, batch_size=2)
+    first = scheduler.submit("large", "blocker", 1)
+    summarizer.running.wait(5)
+    large = [scheduler.submit("large", f"l{index}", 1) for index in range(4)]
+    small = scheduler.submit("small", "s0", 1)
+    summarizer.release.set()
+
+    assert small.result(timeout=5) == "S0"
+    assert [future.result(timeout=5) for future in [first, *large]] == [
+        "BLOCKER", "L0", "L1", "L2", "L3"
+    ]
+    # The small book is in the batch right after the one that was running.
+    assert summarizer.batches[1] == ["l0", "s0"]
+
+
+def test_failing_chunk_fails_only_its_book():
+    """A failing chunk fails its book, the other books of its batch are summarized."""
+    summarizer = FakeSummarizer()
+    scheduler = SummarizationScheduler(summarizer, batch_size=2)
+    blocker = scheduler.submit("other", "blocker", 1)
+    summarizer.running.wait(5)
+    failing = scheduler.submit("bad", "fail", 1)
+    good = scheduler.submit("good", "fine", 1)
+    waiting = scheduler.submit("bad", "later", 1)
+    summarizer.release.set()
+
+    assert blocker.result(timeout=5) == "BLOCKER"
+    assert good.result(timeout=5) == "FINE"
+    with pytest.raises(RuntimeError):
+        failing.result(timeout=5)
+    with pytest.raises(RuntimeError):
+        waiting.result(timeout=5)
+    assert "bad" not in scheduler.stats()
+    assert scheduler.stats()["good"]["completed"] == 1
+
+
+def test_finish_cancels_waiting_chunks_and_removes_stats():
+    """Chunks of a finished book are not summarized and its statistics are removed."""
+    summarizer = FakeSummarizer()
+    scheduler = SummarizationScheduler(summarizer, batch_size=1)
+    running = scheduler.submit("other", "running", 1)
+    summarizer.running.wait(5)
+    waiting = scheduler.submit("book", "waiting", 1)
+
+    scheduler.finish("book")
+    summarizer.release.set()
+
+    assert running.result(timeout=5) == "RUNNING"
+    with pytest.raises(CancelledError):
+        waiting.result(timeout=5)
+    assert "book" not in scheduler.stats()
+    assert ["waiting"] not in summarizer.batches
@@ -0,0 +1,132 @@
+"""Create smaller derivatives of the generated images."""
+
+import argparse
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from PIL import Image
+
+import util
+
+# Edge lengths (in pixels) of the square thumbnails that are created per image.
+DEFAULT_SIZES = (96, 256)
+# Image format name mapped to (file extension, mimetype, Pillow save options).
+FORMATS = {
+    "webp": (".webp", "image/webp", {"format": "WEBP", "quality": 80, "method": 4}),
+    "jpeg": (
+        ".jpg",
+        "image/jpeg",
+        {"format": "JPEG", "quality": 85, "optimize": True, "progressive": True},
+    ),
+}
+THUMBNAIL_DIR = "thumbnails"
+
+
+def thumbnail_path(image_path: Path, size: int, image_format: str = "webp") -> Path:
+    """Get the location of a thumbnail of an image.
+
+    Args:
+        image_path (Path): the original image
+        size (int): edge length of the thumbnail
+        image_format (str, optional): one of FORMATS. Defaults to "webp".
+
+    Returns:
+        Path: where the thumbnail is stored
+    """
+    extension = FORMATS[image_format][0]
+    return image_path.parent / THUMBNAIL_DIR / f"{image_path.stem}-{size}{extension}"
+
+
+def create_thumbnails(image_path: Path, sizes=DEFAULT_SIZES, formats=tuple(FORMATS)):
+    """Create all missing thumbnails of an image.
+
+    Args:
+        image_path (Path): the original image
+        sizes (Iterable[int], optional): edge lengths of the thumbnails.
+        formats (Iterable[str], optional): formats of the thumbnails, see FORMATS.
+
+    Returns:
+        list: paths of the thumbnails that were created
+    """
+    missing = [
+        (size, image_format)
+        for size in sizes
+        for image_format in formats
+        if not thumbnail_path(image_path, size, image_format).exists()
+    ]
+    if not missing:
+        return []
+
+    created = []
+    with Image.open(image_path) as original:
+        original = original.convert("RGB")
+        for size, image_format in missing:
+            output_path = thumbnail_path(image_path, size, image_format)
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            image = original.copy()
+            image.thumbnail((size, size), Image.Resampling.LANCZOS)
+            # Write to a temporary file first so that a request never
+            # reads a partially written thumbnail.
+            util.replace_file(
+                output_path, functools.partial(image.save, **FORMATS[image_format][2])
+            )
+            created.append(output_path)
+    return created
+
+
+def select_thumbnail(image_path: Path, size: int, sizes=DEFAULT_SIZES, image_format="webp"):
+    """Get the smallest thumbnail that is at least as large as the requested size.
+
+    Missing thumbnails are created on demand.
+
+    Args:
+        image_path (Path): the original image
+        size (int): the requested edge length
+        sizes (Iterable[int], optional): edge lengths of the available thumbnails.
+        image_format (str, optional): one of FORMATS. Defaults to "webp".
+
+    Returns:
+        Path: the thumbnail, or None if no thumbnail is large enough.
+    """
+    fitting = [thumbnail_size for thumbnail_size in sorted(sizes) if thumbnail_size >= size]
+    if not fitting:
+        return None
+    path = thumbnail_path(image_path, fitting[0], image_format)
+    if not path.exists():
+        create_thumbnails(image_path, [fitting[0]], [image_format])
+    return path
+
+
+def backfill(data_dir: Path, sizes=DEFAULT_SIZES, workers: int = 4):
+    """Create missing thumbnails for all generated images of all books.
+
+    Args:
+        data_dir (Path): directory containing one folder per book
+        sizes (Iterable[int], optional): edge lengths of the thumbnails.
+        workers (int, optional): number of images processed in parallel. Defaults to 4.
+
+    Returns:
+        int: number of thumbnails created
+    """
+    images = sorted(data_dir.glob("*/*-version-*.png"))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        created = executor.map(lambda path: len(create_thumbnails(path, sizes)), images)
+        return sum(created)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create thumbnails for generated images")
+    parser.add_argument("--data_dir", type=str, help="book data dir", default="data")
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        help="thumbnail edge lengths",
+        default=list(DEFAULT_SIZES),
+    )
+    parser.add_argument("--workers", type=int, help="parallel workers", default=4)
+    args = parser.parse_args()
+
+    num_created = backfill(Path(args.data_dir), args.sizes, args.workers)
+    print(f"Created {num_created} thumbnails")
@@ -1,6 +1,9 @@
 """Providing utility functitons for the backend."""
 
+import hashlib
 import json
+import os
+import tempfile
 from pathlib import Path
 
 import ebooklib
@@ -62,8 +65,18 @@ def parse_epub(path):
     Returns:
         object: the parsed book with title and chapters
     """
-    book = epub.read_epub(path)
+    return parse_epub_book(epub.read_epub(path))
 
+
+def parse_epub_book(book: epub.EpubBook):
+    """Parse an already read epub into individual chapters.
+
+    Args:
+        book (EpubBook): the epub to be parsed
+
+    Returns:
+        object: the parsed book with title and chapters
+    """
     items = list(book.get_items_of_type(ebooklib.ITEM_DOCUMENT))
     epub_chapters = [item for item in items if item.is_chapter()]
     chapters = [
@@ -89,3 +102,98 @@ def parse_book(input_file: Path):
         return parse_epub(input_file)
 
     raise NotImplementedError(f"Unsupported file type: {input_file.suffix}")
+
+
+# Characters in the original text that are irrelevant for summarization:
+# e.g. multiple new lines, \xa0 non-breaking space, \u2009 thin space
+TRANSLATION_TABLE = dict.fromkeys(map(ord, '\n*\xa0\u2009""'), None)
+
+
+def chapter_text_for_summary(chapter: dict) -> str:
+    """Join the cleaned paragraphs of a chapter.
+
+    Args:
+        chapter (dict): a chapter of a parsed book, see parse_book
+
+    Returns:
+        str: the text of the chapter, one paragraph per line
+    """
+    return "\n".join(paragraph.translate(TRANSLATION_TABLE) for paragraph in chapter["paragraphs"])
+
+
+def epub_metadata(book: epub.EpubBook):
+    """Extract title and creator from the metadata of an epub.
+
+    Args:
+        book (EpubBook): the epub
+
+    Returns:
+        dict: title and creator of the book, None if not present
+    """
+    title = book.get_metadata("DC", "title")
+    creator = book.get_metadata("DC", "creator")
+    return {
+        "title": title[0][0] if title else None,
+        "creator": creator[0][0] if creator else None,
+    }
+
+
+def replace_file(path: Path, write):
+    """Write a file so that readers see either the old or the new content.
+
+    The content is written to a temporary file in the same folder, which then
+    replaces the file. The temporary file is removed if writing fails.
+
+    Args:
+        path (Path): the file to write
+        write (Callable[[BinaryIO], None]): writes the content to a binary file
+    """
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.stem}-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            write(tmp_file)
+        os.replace(tmp_name, path)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+
+
+def save_stream(stream, path: Path, chunk_size: int = 1 << 16):
+    """Copy a binary stream to a file in chunks while hashing its content.
+
+    Args:
+        stream (BinaryIO): the stream to save
+        path (Path): the file to write
+        chunk_size (int, optional): number of bytes read at once. Defaults to 64 KiB.
+
+    Returns:
+        str: hex SHA-256 digest of the content
+    """
+    digest = hashlib.sha256()
+    try:
+        with open(path, "wb") as file:
+            while chunk := stream.read(chunk_size):
+                digest.update(chunk)
+                file.write(chunk)
+    except BaseException:
+        # E.g., the client disconnected during the upload.
+        path.unlink(missing_ok=True)
+        raise
+    return digest.hexdigest()
+
+
+def file_hash(path: Path, chunk_size: int = 1 << 16):
+    """Hash the content of a file without reading it into memory at once.
+
+    Args:
+        path (Path): the file to hash
+        chunk_size (int, optional): number of bytes read at once. Defaults to 64 KiB.
+
+    Returns:
+        str: hex SHA-256 digest of the content
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -8,6 +8,9 @@ export async function fetchBooks(): Promise<string[]> {
 
 export async function fetchBook(book: string): Promise<Book> {
 	const response = await fetch(`/api/books/${book}`);
+	if (!response.ok) {
+		throw new Error(`Book could not be loaded: ${response.status}`);
+	}
 	const jsonResponse = (await response.json()) as { book: Book };
 	return jsonResponse['book'];
 }
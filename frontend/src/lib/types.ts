@@ -2,6 +2,9 @@ export interface Book {
 	title: string;
 	chapters: Chapter[];
 	book_summary: string;
+	// Set while the book is still being summarized
+	incomplete?: boolean;
+	summarized_chapters?: number[];
 }
 
 export interface SelectedImages {